@@ -1,8 +1,26 @@
 import os
+import time
 import unittest
+import numpy
 from __main__ import vtk, qt, ctk, slicer
 
 import manipulator
+import handsmrml
+import cursorpool
+import raypicker
+import handbenchmark
+from handscore import handprotocol
+from handscore import handreader
+from handscore import handbroker
+from handscore import handdriver
+from handscore import handsources
+from handscore import posefilter
+from handscore import handrecording
+from handscore import handsession
+from handscore import handlatency
+from handscore import handscheduler
+from handscore import handgestures
+from handscore import handtransforms
 
 #
 # SlicerHands
@@ -82,11 +100,27 @@ class SlicerHandsWidget:
     # Layout within the parameters collapsible button
     parametersFormLayout = qt.QFormLayout(parametersCollapsibleButton)
 
+    # hand driver command, remembered between sessions
+    settings = qt.QSettings()
+    self.driverCommandEdit = qt.QLineEdit()
+    self.driverCommandEdit.text = settings.value('SlicerHands/DriverCommand', 'handdriver.bat pieper')
+    self.driverCommandEdit.toolTip = "Command line that runs the hand driver"
+    parametersFormLayout.addRow("Driver command: ", self.driverCommandEdit)
+    self.driverDirectoryEdit = qt.QLineEdit()
+    self.driverDirectoryEdit.text = settings.value('SlicerHands/DriverDirectory', r'd:\threegear\GesturalUserInterface')
+    self.driverDirectoryEdit.toolTip = "Directory the hand driver runs in"
+    parametersFormLayout.addRow("Driver directory: ", self.driverDirectoryEdit)
+
     # start hand driver button
-    startDriver = qt.QPushButton("Start Hand Driver")
-    startDriver.toolTip = "Run the threegear hand driver"
-    parametersFormLayout.addWidget(startDriver)
-    startDriver.connect('clicked()', self.startDriver)
+    self.startDriverButton = qt.QPushButton("Start Hand Driver")
+    self.startDriverButton.toolTip = "Run the hand driver, connect once it is ready and reconnect if the connection drops"
+    self.startDriverButton.checkable = True
+    parametersFormLayout.addWidget(self.startDriverButton)
+    self.startDriverButton.connect('toggled(bool)', self.onStartDriverToggled)
+    self.driverState = None
+    self.driverTimer = qt.QTimer()
+    self.driverTimer.interval = 250
+    self.driverTimer.connect('timeout()', self.onDriverTimer)
 
     # connect to the driver
     self.connectToHandsButton = qt.QPushButton("Connect to Hand Driver")
@@ -101,6 +135,73 @@ class SlicerHandsWidget:
     parametersFormLayout.addWidget(self.disconnectFromHandsButton)
     self.disconnectFromHandsButton.connect('clicked()', self.disconnectFromHands)
 
+    # latest-wins reading
+    self.latestWinsCheckBox = qt.QCheckBox()
+    self.latestWinsCheckBox.checked = self.logic.latestWins
+    self.latestWinsCheckBox.toolTip = "Only decode the newest pose when the driver gets ahead of rendering"
+    parametersFormLayout.addRow("Latest pose only: ", self.latestWinsCheckBox)
+    self.latestWinsCheckBox.connect('toggled(bool)', self.onLatestWinsToggled)
+
+    # background reader
+    self.readerThreadCheckBox = qt.QCheckBox()
+    self.readerThreadCheckBox.checked = self.logic.useReaderThread
+    self.readerThreadCheckBox.toolTip = "Read the driver socket on a background thread (takes effect on connect)"
+    parametersFormLayout.addRow("Background reader: ", self.readerThreadCheckBox)
+    self.readerThreadCheckBox.connect('toggled(bool)', self.onReaderThreadToggled)
+
+    # shared driver
+    self.brokerCheckBox = qt.QCheckBox()
+    self.brokerCheckBox.checked = self.logic.useBroker
+    self.brokerCheckBox.toolTip = "Connect through a handbroker that shares the driver with other programs (takes effect on connect)"
+    parametersFormLayout.addRow("Shared driver: ", self.brokerCheckBox)
+    self.brokerCheckBox.connect('toggled(bool)', self.onBrokerToggled)
+
+    # input source
+    self.sourceComboBox = qt.QComboBox()
+    for name in sorted(handsources.SOURCES.keys()):
+      self.sourceComboBox.addItem(name)
+    self.sourceComboBox.currentIndex = self.sourceComboBox.findText(self.logic.sourceName)
+    self.sourceComboBox.toolTip = "Where hands come from: the threegear driver stream, or sequence numbered datagrams (takes effect on connect)"
+    parametersFormLayout.addRow("Input source: ", self.sourceComboBox)
+    self.sourceComboBox.connect('currentIndexChanged(QString)', self.onSourceChanged)
+
+    # record the driver stream
+    self.recordButton = qt.QPushButton("Start Recording")
+    self.recordButton.toolTip = "Record the hand driver stream for later replay"
+    self.recordButton.checkable = True
+    parametersFormLayout.addWidget(self.recordButton)
+    self.recordButton.connect('toggled(bool)', self.onRecordToggled)
+
+    # latency readout
+    self.latencyCheckBox = qt.QCheckBox()
+    self.latencyCheckBox.toolTip = "Time each pose from the socket to the screen and show it in the status bar"
+    parametersFormLayout.addRow("Show latency: ", self.latencyCheckBox)
+    self.latencyCheckBox.connect('toggled(bool)', self.onLatencyToggled)
+    self.latencyTimer = qt.QTimer()
+    self.latencyTimer.interval = 1000
+    self.latencyTimer.connect('timeout()', self.showLatency)
+
+    # frame rate cap
+    self.targetFPSSpinBox = qt.QSpinBox()
+    self.targetFPSSpinBox.minimum = 1
+    self.targetFPSSpinBox.maximum = 240
+    self.targetFPSSpinBox.value = self.logic.scheduler.targetFPS
+    self.targetFPSSpinBox.toolTip = "Most poses per second applied to the scene (and so renders caused by the hands)"
+    parametersFormLayout.addRow("Frame rate cap: ", self.targetFPSSpinBox)
+    self.targetFPSSpinBox.connect('valueChanged(int)', self.logic.setTargetFPS)
+
+    # undo history of hand manipulations
+    self.historyCheckBox = qt.QCheckBox()
+    self.historyCheckBox.toolTip = "Remember what each pinch changes; swipe left to undo and right to redo"
+    parametersFormLayout.addRow("Gesture undo: ", self.historyCheckBox)
+    self.historyCheckBox.connect('toggled(bool)', self.logic.recordHistory)
+    self.undoButton = qt.QPushButton("Undo Hand Manipulation")
+    parametersFormLayout.addWidget(self.undoButton)
+    self.undoButton.connect('clicked()', self.logic.undo)
+    self.redoButton = qt.QPushButton("Redo Hand Manipulation")
+    parametersFormLayout.addWidget(self.redoButton)
+    self.redoButton.connect('clicked()', self.logic.redo)
+
     # update camera transform (temp)
     self.updateCameraButton = qt.QPushButton("UpdateCameraTransform")
     parametersFormLayout.addWidget(self.updateCameraButton)
@@ -109,25 +210,96 @@ class SlicerHandsWidget:
     # Add vertical spacer
     self.layout.addStretch(1)
 
-    # Set local var as instance attribute
-    self.startDriver = startDriver
-
-  def startDriver(self):
-    import subprocess
-    print('TODO: launch batch file from python - use shortcut on desktop for now')
-    self.driver = subprocess.Popen(['handdriver.bat', 'pieper'], cwd=r'd:\threegear\GesturalUserInterface')
-    self.driverout, self.drivererr = self.driver.communicate()
+  def onStartDriverToggled(self,checked):
+    if checked:
+      command = self.driverCommandEdit.text
+      directory = self.driverDirectoryEdit.text or None
+      settings = qt.QSettings()
+      settings.setValue('SlicerHands/DriverCommand', command)
+      settings.setValue('SlicerHands/DriverDirectory', directory or '')
+      try:
+        self.logic.startDriver(command, directory)
+      except OSError as e:
+        slicer.util.showStatusMessage('Could not start the hand driver: %s' % e)
+        self.startDriverButton.checked = False
+        return
+      self.driverTimer.start()
+      self.startDriverButton.text = "Stop Hand Driver"
+    else:
+      self.driverTimer.stop()
+      self.logic.stopDriver()
+      self.logic.disconnectFromHands()
+      self.updateConnectionButtons()
+      self.startDriverButton.text = "Start Hand Driver"
+
+  def onDriverTimer(self):
+    state = self.logic.superviseDriver()
+    if state != self.driverState:
+      self.driverState = state
+      slicer.util.showStatusMessage('Hand driver %s' % state)
+    self.updateConnectionButtons()
+
+  def updateConnectionButtons(self):
+    connected = self.logic.isConnected()
+    self.disconnectFromHandsButton.enabled = connected
+    self.connectToHandsButton.enabled = not connected
 
   def connectToHands(self):
     self.logic.connectToHands()
-    self.disconnectFromHandsButton.enabled = True
-    self.connectToHandsButton.enabled = False
+    self.updateConnectionButtons()
 
   def disconnectFromHands(self):
+    if self.logic.driver:
+      # keep the driver running, but do not connect again behind the user's back
+      self.logic.driver.stop(terminate=False)
+    self.driverTimer.stop()
+    self.startDriverButton.blockSignals(True)
+    self.startDriverButton.checked = False
+    self.startDriverButton.blockSignals(False)
+    self.startDriverButton.text = "Start Hand Driver"
     self.logic.disconnectFromHands()
-    self.disconnectFromHandsButton.enabled = False
-    self.connectToHandsButton.enabled = True
+    self.updateConnectionButtons()
+
 
+  def onLatestWinsToggled(self,checked):
+    self.logic.latestWins = checked
+
+  def onReaderThreadToggled(self,checked):
+    self.logic.useReaderThread = checked
+
+  def onBrokerToggled(self,checked):
+    self.logic.useBroker = checked
+
+  def onSourceChanged(self,name):
+    self.logic.sourceName = name
+
+  def onRecordToggled(self,checked):
+    if checked:
+      path = qt.QFileDialog.getSaveFileName(self.parent, "Record hand session", "", "Hand sessions (*.txt)")
+      if not path:
+        self.recordButton.checked = False
+        return
+      self.logic.startRecording(path)
+      self.recordButton.text = "Stop Recording"
+    else:
+      self.logic.stopRecording()
+      self.recordButton.text = "Start Recording"
+
+  def onLatencyToggled(self,checked):
+    self.logic.latency.enabled = checked
+    if checked:
+      self.logic.latency.reset()
+      self.latencyTimer.start()
+    else:
+      self.latencyTimer.stop()
+
+  def showLatency(self):
+    slicer.util.showStatusMessage('%s; %s' % (self.logic.latency.summary(), self.logic.scheduler.summary()))
+
+  def cleanup(self):
+    self.driverTimer.stop()
+    self.latencyTimer.stop()
+    self.logic.cleanup()
 
   def onReload(self,moduleName="SlicerHands"):
     """Generic reload method for any scripted module.
@@ -137,6 +309,9 @@ class SlicerHandsWidget:
 
     widgetName = moduleName + "Widget"
 
+    # let go of the connection and the scene observers of this widget
+    self.cleanup()
+
     # reload the source code
     # - set source file path
     # - load the module to the global space
@@ -186,271 +361,852 @@ class SlicerHandsLogic:
   def __init__(self):
     self.host='localhost'
     self.port=1988
+    # where hands come from: a name registered in handsources.  The
+    # threegear driver is at host:port, other sources take their
+    # sourceOptions, for example {'datagram': {'port': 1991}}
+    self.sourceName = 'threegear'
+    self.sourceOptions = {}
     self.socket = None
-    self.latestPose = None
+    self.parser = handprotocol.HandParser()
+    self.latestWins = True
+    self.useReaderThread = False
+    self.useBroker = False
+    self.reader = None
+    self.recorder = None
+    self.driver = None
     self.observerTags = []
-
-  def __del__(self):
+    self.handMatrices = {}
+    self.handOrientations = {}
+    # the pose the scene shows, as a handprotocol.SKELETON_DTYPE record
+    # that cursors and manipulators read in place
+    self.skeleton = self.parser.skeleton
+    self.skeletonPoseCount = 0
+    self.applyOrientation = True
+    self.showFingertips = True
+    self.fingertipScale = 4.
+    self.filters = posefilter.defaultPipeline()
+    self.filterPoses = True
+    self.filteredPoseCount = 0
+    self.frameInterval = 1. / 60.
+    self.lastFrameTime = None
+    self.latency = handlatency.LatencyMonitor()
+    self.gestures = handgestures.GestureEngine()
+    self.recognizeGestures = True
+    self.recognizedPoseCount = 0
+    self.publishedGestures = {}
+    self.twoHandedManipulator = None
+    self.historyRecorder = None
+    self.timedPoseCount = 0
+    self.pendingRender = None
+    # poses are applied on a timer paced by the scheduler
+    self.scheduler = handscheduler.FrameScheduler()
+    self.frameTimer = None
+    # pointing rays pick scene models and segments, see raypicker
+    self.pickModels = True
+    self.pointTimeout = 0.25
+    self.picker = raypicker.ModelPicker()
+    self.pointGates = dict([(hand, raypicker.ConfidenceGate()) for hand in handprotocol.HANDS])
+    self.pickedNodes = {}
+    self.pickedSegments = {}
+    # the models and segmentations that may be picked, found again only
+    # when nodes come or go
+    self.pickNodes = None
+    self.pickNodeScans = 0
+
+    # node handles by hand, dropped whenever nodes leave the scene
+    self.nodeCache = {}
+    self.cursorPools = {}
+    self.nodeCacheHits = 0
+    self.nodeCacheMisses = 0
+    self.nodeCacheInvalidations = 0
+    self.viewCameras = {}
+    self.cameraModifiedTimes = {}
+    self.cameraToRAS = vtk.vtkMatrix4x4()
+    # the camera nodes followCameras observes, observed again when a
+    # scene close or a new camera node may have replaced them
+    self.cameraObserverTags = []
+    self.followingCameras = False
+    self.refollowPending = False
+    self.sceneObserverTags = []
+    for event in (slicer.vtkMRMLScene.NodeRemovedEvent,
+                  slicer.vtkMRMLScene.StartCloseEvent,
+                  slicer.vtkMRMLScene.EndCloseEvent):
+      tag = slicer.mrmlScene.AddObserver(event, self.invalidateNodeCache)
+      self.sceneObserverTags.append(tag)
+    tag = slicer.mrmlScene.AddObserver(slicer.vtkMRMLScene.EndCloseEvent, self.refollowCamerasLater)
+    self.sceneObserverTags.append(tag)
+    tag = slicer.mrmlScene.AddObserver(slicer.vtkMRMLScene.NodeAddedEvent, self.onNodeAdded)
+    self.sceneObserverTags.append(tag)
+
+  def cleanup(self):
+    """Disconnect, stop the driver and the manipulators and remove the
+    scene observers.  The observers hold the logic, so it is only freed
+    once this has been called."""
     self.disconnectFromHands()
+    self.stopDriver()
+    self.manipulateWithBothHands(None)
+    self.recordHistory(False)
+    for tag in self.sceneObserverTags:
+      slicer.mrmlScene.RemoveObserver(tag)
+    self.sceneObserverTags = []
+
+  def invalidateNodeCache(self,caller=None,event=None):
+    """Forget the cached node handles (scene clear/close or node removal)"""
+    self.pickNodes = None
+    if self.nodeCache or self.viewCameras:
+      self.nodeCache = {}
+      self.viewCameras = {}
+      self.cameraModifiedTimes = {}
+      self.nodeCacheInvalidations += 1
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeAdded(self,caller,event,node):
+    """A node was added: it may be a model or segmentation to pick, or
+    the new camera of a followed view"""
+    self.pickNodes = None
+    if node.IsA('vtkMRMLCameraNode'):
+      self.refollowCamerasLater()
+
+  def nodeCacheStatistics(self):
+    """Hit/miss counts of the node handle cache"""
+    return {
+        'hits': self.nodeCacheHits,
+        'misses': self.nodeCacheMisses,
+        'invalidations': self.nodeCacheInvalidations,
+        }
+
+  def createSource(self):
+    """The input source read on a background thread: a client of a
+    shared handbroker, or the source named by sourceName"""
+    if self.useBroker:
+      return handbroker.BrokerClient(self.host)
+    if self.sourceName == 'threegear':
+      return handsources.createSource('threegear', host=self.host, port=self.port)
+    return handsources.createSource(self.sourceName, **self.sourceOptions.get(self.sourceName, {}))
 
   def connectToHands(self):
     """
-    Initiate the connection
+    Initiate the connection - either with a socket serviced by
+    the Qt event loop or with an input source read on a background
+    thread (see handsources), or as a client of a handbroker shared
+    with other programs
     """
-    self.socket = qt.QTcpSocket()
-    self.socket.connectToHost(self.host, self.port)
-    self.socket.connect('readyRead()', self.handleRead)
-
+    # a new source counts its poses from zero again
+    self.resetPoseCounts()
+    if self.useBroker or self.useReaderThread or self.sourceName != 'threegear':
+      self.reader = self.createSource()
+      if not self.useBroker:
+        self.reader.recorder = self.recorder
+      self.reader.start()
+    else:
+      self.socket = qt.QTcpSocket()
+      self.socket.connectToHost(self.host, self.port)
+      self.socket.connect('readyRead()', self.handleRead)
+
+    # poses are applied from a timer at most targetFPS times a second and
+    # only when the hands moved; the render's EndEvent just counts frames
+    # and closes the latency measurement
+    self.scheduler.reset()
+    self.frameTimer = qt.QTimer()
+    self.frameTimer.interval = self.frameTimerInterval()
+    self.frameTimer.connect('timeout()', self.onFrameTimer)
+    self.frameTimer.start()
     tv = self.threeDView()
-    rw = tv.renderWindow()
-    tag = rw.AddObserver(vtk.vtkCommand.EndEvent,self.applyPose)
-    self.observerTags.append((rw,tag))
-
-    #tag = self.cameraNode().AddObserver(vtk.vtkCommand.ModifiedEvent, self.updateCamera)
-    #self.observerTags.append((cameraNode,tag))
+    if tv:
+      rw = tv.renderWindow()
+      tag = rw.AddObserver(vtk.vtkCommand.EndEvent,self.onRenderEnd)
+      self.observerTags.append((rw,tag))
+
+    self.followCameras()
+
+  def resetPoseCounts(self):
+    """Forget the pose counts seen so far, so the first poses of a new
+    source or parser are not mistaken for ones already applied"""
+    self.skeletonPoseCount = 0
+    self.filteredPoseCount = 0
+    self.recognizedPoseCount = 0
+    self.timedPoseCount = 0
+    self.publishedGestures = {}
 
   def disconnectFromHands(self):
     """
     terminate the connection
     """
-    self.socket.abort()
-    self.socket.close()
+    self.stopRecording()
+    if self.frameTimer:
+      self.frameTimer.stop()
+      self.frameTimer = None
+    if self.reader:
+      self.reader.stop()
+      self.reader = None
+    if self.socket:
+      self.socket.abort()
+      self.socket.close()
+      self.socket = None
     for obj,tag in self.observerTags:
       obj.RemoveObserver(tag)
+    self.observerTags = []
+    self.stopFollowingCameras()
+    for hand,node in list(self.pickedNodes.items()):
+      if node:
+        self.setPicked(hand, None)
+
+  def isConnected(self):
+    return bool(self.socket or self.reader)
+
+  def connectionLost(self):
+    """True once the connection to the driver (or broker) has ended"""
+    if self.reader:
+      return not self.reader.is_alive()
+    if self.socket:
+      return self.socket.state() == qt.QAbstractSocket.UnconnectedState
+    return True
+
+  def startDriver(self,command=None,directory=None):
+    """Launch the hand driver without waiting for it (no command just
+    waits for one started elsewhere); superviseDriver, called from a
+    timer, then connects and reconnects.  See handdriver."""
+    self.stopDriver()
+    self.driver = handdriver.DriverSupervisor(command, directory, self.host, self.port)
+    self.driver.start()
+
+  def stopDriver(self,terminate=True):
+    if self.driver:
+      self.driver.stop(terminate)
+      self.driver = None
+
+  def superviseDriver(self):
+    """One step of driver supervision: connect when the driver is
+    ready, and start over when the connection drops.  Returns the
+    supervisor state, or None when there is no supervisor."""
+    driver = self.driver
+    if not driver:
+      return None
+    if driver.state == 'connected' and self.connectionLost():
+      self.disconnectFromHands()
+      driver.disconnected()
+    if driver.poll() == 'ready':
+      if self.isConnected():
+        self.disconnectFromHands()
+      self.connectToHands()
+      driver.connected()
+    return driver.state
+
+  def driverStatistics(self):
+    """Startup time and connect / reconnect counts, see handdriver"""
+    if self.driver:
+      return self.driver.statistics()
+    return None
 
   def handleRead(self):
-    while self.socket.canReadLine():
-      m = str(self.socket.readLine()).split()
-      if m[0] == 'POINT' and float(m[-1]) > .0:
-        #print('Pointing %s at %s %s %s (conf: %s)' % (m[1], m[5], m[6], m[7], m[-1]))
-        pass
-      #events = ('PRESSED', 'RELEASED', 'DRAGGED', 'MOVED')
-      events = ('PRESSED', 'RELEASED', 'DRAGGED')
-      inGestureEvents = ('PRESSED', 'RELEASED', 'DRAGGED')
-      outOfGestureEvents = ('RELEASED',)
-      message = ""
-      if m[0] in events:
-        message += '%s %s' % (m[0], m[-1],)
-        transform,line = self.handCursor(m[-1].title())
-        if m[0] in inGestureEvents:
-          transform.SetAttribute('SlicerHands.gesture', 'pinch')
-        if m[0] in outOfGestureEvents:
-          transform.SetAttribute('SlicerHands.gesture', None)
-
-      if message != "":
-        slicer.util.showStatusMessage(message)
-      if m[0] == 'POSE':
-        self.savePose(m)
-
-  def savePose(self,pose):
-    """Keep track of the latest pose so it can be
-    set after the Render is completed"""
-    self.latestPose = pose
+    if self.latency.enabled:
+      self.parser.readTime = time.time()
+    if self.latestWins:
+      # decode only the newest pose of the burst, but keep every gesture
+      data = self.socket.readAll().data()
+      if self.recorder:
+        self.recorder.write(data)
+      self.parser.parseBuffer(data)
+    else:
+      while self.socket.canReadLine():
+        line = self.socket.readLine().data()
+        if self.recorder:
+          self.recorder.write(line)
+        self.parser.parseLine(line)
+    self.handleEvents(self.parser.popEvents())
+
+  def startRecording(self,path):
+    """Tee everything read from the driver into a timestamped recording
+    that handrecording.HandReplayServer can play back"""
+    self.stopRecording()
+    self.recorder = handrecording.HandRecorder(path)
+    if self.reader:
+      self.reader.recorder = self.recorder
+
+  def stopRecording(self):
+    if self.reader:
+      self.reader.recorder = None
+    if self.recorder:
+      self.recorder.close()
+      self.recorder = None
+
+  def droppedPoseCount(self):
+    """Number of stale poses skipped by latest-wins reading"""
+    if self.reader:
+      return self.reader.droppedPoseCount()
+    return self.parser.droppedPoseCount
+
+  def frameTimerInterval(self):
+    return int(round(1000. * self.scheduler.interval()))
+
+  def setTargetFPS(self,targetFPS):
+    self.scheduler.targetFPS = float(targetFPS)
+    self.updateFrameTimer()
+
+  def updateFrameTimer(self):
+    """Follow the scheduler between full rate and idle rate"""
+    if self.frameTimer:
+      interval = self.frameTimerInterval()
+      if self.frameTimer.interval != interval:
+        self.frameTimer.interval = interval
+
+  def onFrameTimer(self):
+    self.applyPose(None, None)
+    self.updateFrameTimer()
+
+  def onRenderEnd(self,caller,event):
+    self.scheduler.rendered()
+    if self.latency.enabled and self.pendingRender:
+      self.recordRenderLatency()
+
+  def requestRender(self):
+    """Ask for a render of the 3D view, merged with any render the
+    scene changes already asked for.  Without a main window
+    (--no-main-window) there is nothing to render."""
+    tv = self.threeDView()
+    if tv:
+      tv.scheduleRender()
+
+  def handleEvents(self,events):
+    """Map gesture events from the driver
+    onto the gesture attribute of the hand transforms"""
+    inGestureEvents = ('PRESSED', 'RELEASED', 'DRAGGED')
+    outOfGestureEvents = ('RELEASED',)
+    if events and self.scheduler.idle:
+      # a gesture should not wait for the idle rate
+      self.scheduler.wake()
+      self.updateFrameTimer()
+    for messageType,hand in events:
+      transform,line = self.handCursor(hand)
+      if messageType in inGestureEvents:
+        transform.SetAttribute('SlicerHands.gesture', 'pinch')
+      if messageType in outOfGestureEvents:
+        transform.SetAttribute('SlicerHands.gesture', None)
+      if hand in handgestures.HANDS:
+        self.gestures.setPinch(hand, messageType not in outOfGestureEvents)
+      slicer.util.showStatusMessage('%s %s' % (messageType, hand.upper()))
 
   def applyPose(self,caller,event):
     """Transfer the latest pose to the transform nodes
-    to trigger changes in the scene, and then a render"""
-    if not self.latestPose:
+    to trigger changes in the scene, and then a render.
+    Moves inside the scheduler's dead-band leave the scene alone."""
+    timing = self.latency.enabled
+    if self.reader:
+      # gestures and poses collected by the reader thread
+      self.handleEvents(self.reader.popEvents())
+      latest = self.reader.latestPose()
+      if not latest:
+        self.scheduler.tick()
+        return
+      poseCount,poseTime,skeleton,readTime = latest
+      if poseCount != self.skeletonPoseCount:
+        # the reader's copy is never written again, so one copy into
+        # the shared skeleton is all it takes
+        self.skeleton[...] = skeleton
+        self.skeletonPoseCount = poseCount
+    else:
+      parser = self.parser
+      if not parser.poseCount:
+        self.scheduler.tick()
+        return
+      poseCount,poseTime,readTime = parser.poseCount,parser.poseTime,parser.poseReadTime
+      parser.decodeJoints()
+    positions = self.parser.positions
+    timing = timing and poseCount != self.timedPoseCount
+    if timing:
+      applyStart = time.time()
+    pl,pr = self.filterPose(poseCount, poseTime, positions)
+    orientations = self.parser.orientations if self.applyOrientation else None
+    moved = self.scheduler.tick((pl, pr), orientations)
+    if moved:
+      if orientations is None:
+        orientations = (None, None)
+      self.setHandPosition('Left', pl, orientations[0])
+      self.setHandPosition('Right', pr, orientations[1])
+      self.flushCursors()
+      self.requestRender()
+    if self.recognizeGestures and poseCount != self.recognizedPoseCount:
+      self.recognizedPoseCount = poseCount
+      self.publishGestures(self.gestures.update(poseTime, positions))
+    if self.pickModels:
+      self.applyPoints()
+    if timing:
+      applyEnd = time.time()
+    # the slice jumps and updates the manipulators coalesced from this
+    # pose, run now rather than on the next event loop pass
+    manipulator.runFlushes()
+    if timing:
+      manipulateEnd = time.time()
+      self.latency.record('read', poseTime - readTime)
+      self.latency.record('wait', applyStart - poseTime)
+      self.latency.record('apply', applyEnd - applyStart)
+      self.latency.record('manipulate', manipulateEnd - applyEnd)
+      self.timedPoseCount = poseCount
+      if moved:
+        self.pendingRender = (manipulateEnd, readTime)
+
+  def publishGestures(self,gestures):
+    """Set the gestures recognized in the latest sample as attributes of
+    the hand transforms for manipulators to watch:
+      SlicerHands.recognized       gesture name, or None when there is none
+      SlicerHands.recognizedValue  its value (speed, scale, angle...)
+    Two handed gestures are set on both hands.  When a hand has more
+    than one gesture the one first in handgestures.GESTURE_PRIORITY is
+    set: zoom, rotate, the swipes, then dwell."""
+    recognized = handgestures.winningGestures(gestures)
+    for whichHand in handgestures.HANDS:
+      if whichHand in recognized:
+        name,value = recognized[whichHand]
+        published = (name, '%g' % value)
+      else:
+        published = (None, None)
+      if self.publishedGestures.get(whichHand, (None, None)) == published:
+        continue
+      self.publishedGestures[whichHand] = published
+      transform,line = self.handCursor(whichHand)
+      wasModifying = transform.StartModify()
+      transform.SetAttribute('SlicerHands.recognized', published[0])
+      transform.SetAttribute('SlicerHands.recognizedValue', published[1])
+      transform.EndModify(wasModifying)
+
+  def applyPoints(self):
+    """Cast the newest pointing ray of each hand into the scene.
+    Rays are in table coordinates, like the hand positions; a hand that
+    has not sent one for pointTimeout seconds is not pointing."""
+    if self.reader:
+      latest = self.reader.latestPoints()
+      if not latest:
+        return
+      points,pointTimes = latest
+    else:
+      points,pointTimes = self.parser.points,self.parser.pointTimes
+    now = time.time()
+    tableToWorld = None
+    for index,hand in enumerate(handprotocol.HANDS):
+      confidence = points[index, 6] if now - pointTimes[index] < self.pointTimeout else 0.
+      if not self.pointGates[hand].update(confidence):
+        self.setPicked(hand, None)
+        continue
+      if tableToWorld is None:
+        tableToWorld = handsmrml.worldMatrix(self.tableCursor())
+      origin = handtransforms.transformPoints(tableToWorld, points[index:index+1, 0:3])[0]
+      direction = numpy.dot(tableToWorld[:3, :3], points[index, 3:6])
+      self.updatePointing(hand, origin, direction)
+
+  def updatePointing(self,hand,origin,direction):
+    """Pick with a ray in world coordinates and highlight what it hits.
+    Returns the picked model or segmentation node, or None."""
+    hit = self.picker.pick(origin, direction, self.pickTargets())
+    key = hit[0] if hit else None
+    nodeID,segmentID = key if isinstance(key, tuple) else (key, None)
+    node = slicer.mrmlScene.GetNodeByID(nodeID) if nodeID else None
+    self.setPicked(hand, node, segmentID)
+    return node
+
+  def pickTargets(self):
+    """(key, polydata, world matrix) of the visible models and segments,
+    other than the module's own cursors.  A model's key is its node ID,
+    a segment's is (segmentation node ID, segment ID).  Segments are
+    picked by their closed surface, and only in segmentations that
+    already have one (those shown in 3D), since making it from a
+    labelmap can take seconds.  The nodes are looked up in the scene
+    only after nodes were added or removed."""
+    if self.pickNodes is None:
+      self.pickNodeScans += 1
+      own = set([pool.modelNode.GetID() for pool in self.cursorPools.values() if pool.inScene()])
+      self.pickNodes = []
+      for className in ('vtkMRMLModelNode', 'vtkMRMLSegmentationNode'):
+        nodes = slicer.mrmlScene.GetNodesByClass(className)
+        for index in range(nodes.GetNumberOfItems()):
+          node = nodes.GetItemAsObject(index)
+          if node.GetID() not in own and not node.GetHideFromEditors():
+            self.pickNodes.append(node)
+    targets = []
+    for node in self.pickNodes:
+      displayNode = node.GetDisplayNode()
+      if not displayNode or not displayNode.GetVisibility():
+        continue
+      parent = node.GetParentTransformNode()
+      matrix = handsmrml.worldMatrix(parent) if parent else None
+      if node.IsA('vtkMRMLSegmentationNode'):
+        targets.extend(self.segmentTargets(node, displayNode, matrix))
+        continue
+      polyData = node.GetPolyData()
+      if polyData and polyData.GetNumberOfCells():
+        targets.append((node.GetID(), polyData, matrix))
+    return targets
+
+  def segmentTargets(self,node,displayNode,matrix):
+    """Pick targets of the visible segments of a segmentation node"""
+    segmentation = node.GetSegmentation()
+    surface = slicer.vtkSegmentationConverter.GetSegmentationClosedSurfaceRepresentationName()
+    if not segmentation.ContainsRepresentation(surface):
+      return []
+    targets = []
+    for segmentID in segmentation.GetSegmentIDs():
+      if not displayNode.GetSegmentVisibility(segmentID):
+        continue
+      polyData = segmentation.GetSegment(segmentID).GetRepresentation(surface)
+      if polyData and polyData.GetNumberOfCells():
+        targets.append(((node.GetID(), segmentID), polyData, matrix))
+    return targets
+
+  def setPicked(self,hand,node,segmentID=None):
+    """Highlight the model or segmentation a hand points at (the display
+    node's selected state, so its own color is untouched) and publish
+    its ID as the SlicerHands.picked attribute of the hand transform,
+    and the segment's ID, if it is one, as SlicerHands.pickedSegment"""
+    previous = self.pickedNodes.get(hand)
+    if previous is node and self.pickedSegments.get(hand) == segmentID:
       return
-    m = self.latestPose
-    pl = map(float,m[1:4])
-    pr = map(float,m[9:12])
-    leftTransform,leftHandLine = self.handCursor('Left')
-    rightTransform,rightHandLine = self.handCursor('Right')
-    for t,p in ( (leftTransform,pl), (rightTransform,pr) ):
-      t.GetMatrixTransformToParent().SetElement(0, 3, p[0])
-      t.GetMatrixTransformToParent().SetElement(1, 3, p[1])
-      t.GetMatrixTransformToParent().SetElement(2, 3, p[2])
-    for handLine,p in ( (leftHandLine,pl), (rightHandLine,pr) ):
-      points = handLine.GetPolyData().GetPoints()
-      points.SetPoint(0,p[0], 0.0,p[2])
-      points.SetPoint(1,p[0],p[1],p[2])
-      handLine.GetPolyData().Modified()
+    self.pickedNodes[hand] = node
+    self.pickedSegments[hand] = segmentID
+    others = [picked for other,picked in self.pickedNodes.items() if other != hand]
+    if previous and previous is not node and previous not in others and previous.GetDisplayNode():
+      previous.GetDisplayNode().SetSelected(0)
+    if node and node.GetDisplayNode():
+      node.GetDisplayNode().SetSelected(1)
+    transform,cursors = self.handCursor(hand)
+    wasModifying = transform.StartModify()
+    transform.SetAttribute('SlicerHands.picked', node.GetID() if node else None)
+    transform.SetAttribute('SlicerHands.pickedSegment', segmentID)
+    transform.EndModify(wasModifying)
+
+  def recordRenderLatency(self):
+    """Called from the EndEvent of the render that shows the last timed pose"""
+    now = time.time()
+    applyEnd,readTime = self.pendingRender
+    self.latency.record('render', now - applyEnd)
+    self.latency.record('total', now - readTime)
+    self.pendingRender = None
+
+  def latencyStatistics(self):
+    """Rolling p50/p95/p99 (ms) per pipeline stage, see handlatency"""
+    return self.latency.statistics()
+
+  def sourceStatistics(self):
+    """Loss, reordering and transit statistics of the input source,
+    for the sources that keep them"""
+    if self.reader and hasattr(self.reader, 'statistics'):
+      return self.reader.statistics()
+    return None
+
+  def filterPose(self,poseCount,poseTime,positions):
+    """Smooth new pose samples and predict them forward to
+    when the next frame is expected on screen"""
+    now = time.time()
+    if self.lastFrameTime is not None:
+      self.frameInterval += 0.1 * ((now - self.lastFrameTime) - self.frameInterval)
+    self.lastFrameTime = now
+    if not self.filterPoses:
+      return positions
+    if poseCount != self.filteredPoseCount:
+      self.filteredPoseCount = poseCount
+      self.filters.process(poseTime, positions, now + self.frameInterval)
+    return self.filters.output
+
+  def setHandPosition(self,whichHand,p,orientation=None):
+    """Move one hand transform, and turn it to the orientation
+    quaternion if one is given, with a single modification.  Its
+    cursor, fingertip cursors and drop line are written into their
+    pools (drawn by flushCursors)."""
+    transform,cursors = self.handCursor(whichHand)
+    toParent = transform.GetMatrixTransformToParent()
+    if (toParent.GetElement(0, 3) == p[0] and
+        toParent.GetElement(1, 3) == p[1] and
+        toParent.GetElement(2, 3) == p[2] and
+        (orientation is None or numpy.array_equal(orientation, self.handOrientations.get(whichHand)))):
+      return
+    try:
+      matrix = self.handMatrices[whichHand]
+    except KeyError:
+      matrix = self.handMatrices[whichHand] = numpy.identity(4)
+    if orientation is None:
+      # keep the current rotation and scale
+      handsmrml.transformMatrix(transform, matrix)
+      matrix[:3, 3] = p
+    else:
+      self.handOrientations.setdefault(whichHand, numpy.zeros(4))[:] = orientation
+      handtransforms.handToTable(p, handtransforms.normalizedQuaternion(orientation), out=matrix)
+    # only the matrix changes, so attribute watchers need not scan
+    handsmrml.setTransformMatrix(transform, matrix, manipulator.attributeRegistry)
+    cursors.positions[0] = p
+    cursors.shapes[0] = matrix[:3, :3]
+    hand = handprotocol.HANDS.index(whichHand)
+    if self.showFingertips and self.skeleton['hasJoints']:
+      # the fingertips are raw samples, so move them with the filtered hand
+      numpy.add(self.skeleton['fingertips'][hand], p - self.parser.positions[hand], out=cursors.positions[1:])
+      cursors.shapes[1:] = self.fingertipScale * numpy.identity(3)
+    else:
+      cursors.shapes[1:] = 0.
+    cursors.modified()
+    dropLines = self.dropLines()
+    segment = dropLines.segments[hand]
+    segment[:] = p
+    segment[0, 1] = 0.
+    dropLines.modified()
+
+  def flushCursors(self):
+    """Redraw the cursor pools written since the last flush, each
+    as one polydata modification"""
+    for pool in self.cursorPools.values():
+      pool.flush()
+
+  def cursorPool(self,name,makePool):
+    """The cursor or line pool of a name, made by makePool on first use
+    and again whenever its model has been taken out of the scene"""
+    pool = self.cursorPools.get(name)
+    if not pool or not pool.inScene():
+      pool = self.cursorPools[name] = makePool()
+    return pool
 
   def updateCamera(self,caller=None,event=None):
-    cameraToRAS,distance = self.cameraTransform()
+    """Bring the Camera-To-RAS / Table-To-Camera chain up to date.
+    As an observer of a camera node (caller) this follows that view and
+    returns early unless its vtkCamera has actually changed; called
+    directly it uses the camera of the first 3D view."""
+    if caller is None:
+      cameraNode = self.cameraNode()
+      if not cameraNode:
+        return
+    else:
+      cameraNode = caller
+    camera = cameraNode.GetCamera()
+    modifiedTime = camera.GetMTime()
+    if caller is not None and self.cameraModifiedTimes.get(cameraNode.GetID()) == modifiedTime:
+      return
+    self.cameraModifiedTimes[cameraNode.GetID()] = modifiedTime
+    cameraToRAS,distance = self.cameraTransform(camera)
     tableToCamera = self.tableCursor()
-    tableToCamera.GetMatrixTransformToParent().SetElement(2, 3, -distance)
-    tableToCamera.SetAndObserveTransformNodeID(cameraToRAS.GetID())
-    leftToTable,leftHandLine = self.handCursor('Left')
-    rightToTable,rightHandLine = self.handCursor('Right')
-    for node in (leftToTable,leftHandLine,rightToTable,rightHandLine):
-      node.SetAndObserveTransformNodeID(tableToCamera.GetID())
+    toParent = tableToCamera.GetMatrixTransformToParent()
+    if toParent.GetElement(2, 3) != -distance:
+      toParent.SetElement(2, 3, -distance)
+    if tableToCamera.GetTransformNodeID() != cameraToRAS.GetID():
+      tableToCamera.SetAndObserveTransformNodeID(cameraToRAS.GetID())
+    leftToTable,leftCursors = self.handCursor('Left')
+    rightToTable,rightCursors = self.handCursor('Right')
+    for node in (leftToTable,rightToTable,leftCursors.modelNode,
+                 rightCursors.modelNode,self.dropLines().modelNode):
+      self.parentToTable(node)
+
+  def followCameras(self):
+    """Keep the hand cursors registered to whichever 3D view's camera
+    moves, without having to press UpdateCameraTransform.  The cameras
+    are observed again after a scene close or when a camera node is
+    added, until stopFollowingCameras."""
+    self.stopFollowingCameras()
+    self.followingCameras = True
+    lm = slicer.app.layoutManager()
+    for index in range(lm.threeDViewCount if lm else 0):
+      viewNode = lm.threeDWidget(index).threeDView().mrmlViewNode()
+      cameraNode = self.cameraNode(viewNode)
+      if cameraNode:
+        tag = cameraNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.updateCamera)
+        self.cameraObserverTags.append((cameraNode,tag))
+    self.updateCamera()
+
+  def stopFollowingCameras(self):
+    for cameraNode,tag in self.cameraObserverTags:
+      cameraNode.RemoveObserver(tag)
+    self.cameraObserverTags = []
+    self.followingCameras = False
+
+  def refollowCamerasLater(self,caller=None,event=None):
+    """Observe the views' cameras again on the next event loop pass,
+    once the views have taken up a new camera node"""
+    if self.followingCameras and not self.refollowPending:
+      self.refollowPending = True
+      qt.QTimer.singleShot(0, self.refollowCameras)
+
+  def refollowCameras(self):
+    self.refollowPending = False
+    if self.followingCameras:
+      # the cached view to camera mapping may name the old camera
+      self.viewCameras = {}
+      self.followCameras()
+
+  def manipulateWithBothHands(self,node,targetFPS=20.):
+    """Let a two handed pinch grab, turn and scale a volume or model
+    (see manipulator.TwoHandedManipulator); None stops it"""
+    if self.twoHandedManipulator:
+      self.twoHandedManipulator.cleanup()
+      self.twoHandedManipulator = None
+    if node:
+      leftTransform = self.handCursor('Left')[0]
+      rightTransform = self.handCursor('Right')[0]
+      target = manipulator.grabTransformFor(node)
+      self.twoHandedManipulator = manipulator.TwoHandedManipulator(
+          leftTransform, rightTransform, target, targetFPS=targetFPS, skeleton=self.skeleton)
+    return self.twoHandedManipulator
+
+  def recordHistory(self,enabled=True,capacity=64):
+    """Keep an undo history of what each pinch changes (see
+    manipulator.HistoryRecorder); a swipe left undoes, a swipe right
+    redoes.  Returns the recorder, or None when turned off."""
+    if self.historyRecorder:
+      self.historyRecorder.cleanup()
+      self.historyRecorder = None
+    if enabled:
+      hands = [self.handCursor(whichHand)[0] for whichHand in handgestures.HANDS]
+      exclude = (self.tableCursor(), self.cameraTransform()[0])
+      self.historyRecorder = manipulator.HistoryRecorder(hands, exclude, capacity=capacity)
+    return self.historyRecorder
+
+  def undo(self):
+    return bool(self.historyRecorder) and self.historyRecorder.undo()
+
+  def redo(self):
+    return bool(self.historyRecorder) and self.historyRecorder.redo()
+
+  def historyStatistics(self):
+    """Entries, bytes per entry and restore times of the undo history"""
+    if self.historyRecorder:
+      return self.historyRecorder.statistics()
+    return None
 
   def threeDView(self):
-    """Return the current camera node"""
+    """Return the first 3D view, or None when there is none (such as
+    with --no-main-window)"""
     lm = slicer.app.layoutManager()
-    threeDWidget = lm.threeDWidget(0)
-    return threeDWidget.threeDView()
-
-  def cameraNode(self):
-    """Return the current camera node"""
-    # update transform with current camera parameters - only default view for now
-    viewNode = self.threeDView().mrmlViewNode()
+    threeDWidget = lm.threeDWidget(0) if lm and lm.threeDViewCount else None
+    return threeDWidget.threeDView() if threeDWidget else None
+
+  def cameraNode(self,viewNode=None):
+    """Return the camera node of a view (default: the first 3D view).
+    The view to camera mapping is cached with the other node handles.
+    Returns None when there is no view."""
+    if viewNode is None:
+      tv = self.threeDView()
+      if not tv:
+        return None
+      viewNode = tv.mrmlViewNode()
+    try:
+      cameraNode = self.viewCameras[viewNode.GetID()]
+      self.nodeCacheHits += 1
+      return cameraNode
+    except KeyError:
+      self.nodeCacheMisses += 1
     cameraNodes = slicer.util.getNodes('vtkMRMLCameraNode*')
     for cameraNode in cameraNodes.values():
       if cameraNode.GetActiveTag() == viewNode.GetID():
+        self.viewCameras[viewNode.GetID()] = cameraNode
         return cameraNode
     return None
 
-  def cameraTransform(self):
-    """Create the transform and the observer for the camera
-    """
-    transformName = 'Camera-To-RAS'
-    transformNode = slicer.util.getNode(transformName)
-    if not transformNode:
-      # Create transform node
-      transformNode = slicer.vtkMRMLLinearTransformNode()
-      transformNode.SetName(transformName)
-      slicer.mrmlScene.AddNode(transformNode)
-
-    camera = self.cameraNode().GetCamera()
-
-    import numpy
-    position = numpy.array(camera.GetPosition())
-    focalPoint = numpy.array(camera.GetFocalPoint())
-    viewUp = numpy.array(camera.GetViewUp())
-    viewPlaneNormal = numpy.array(camera.GetViewPlaneNormal())
-    viewAngle = camera.GetViewAngle()
-    viewRight = numpy.cross(viewUp,viewPlaneNormal)
-    viewDistance = numpy.linalg.norm(focalPoint - position)
-
-    cameraToRAS = vtk.vtkMatrix4x4()
-    for row in xrange(3):
-      cameraToRAS.SetElement(row, 0, viewRight[row])
-      cameraToRAS.SetElement(row, 1, viewUp[row])
-      cameraToRAS.SetElement(row, 2, viewPlaneNormal[row])
-      cameraToRAS.SetElement(row, 3, position[row])
-
-    transformNode.GetMatrixTransformToParent().DeepCopy(cameraToRAS)
-    return transformNode,viewDistance
+  def cameraTransform(self,camera=None):
+    """Create the transform for the camera if needed and set it
+    from the camera: the columns are the view right, up and plane
+    normal directions and the camera position, which is the inverse
+    of the camera's view transform.  With no camera (no 3D view) the
+    transform is left as it is and the distance is 0."""
+    try:
+      transformNode = self.nodeCache['Camera']
+    except KeyError:
+      transformName = 'Camera-To-RAS'
+      transformNode = slicer.util.getNode(transformName)
+      if not transformNode:
+        # Create transform node
+        transformNode = slicer.vtkMRMLLinearTransformNode()
+        transformNode.SetName(transformName)
+        slicer.mrmlScene.AddNode(transformNode)
+      self.nodeCache['Camera'] = transformNode
+
+    if camera is None:
+      cameraNode = self.cameraNode()
+      if not cameraNode:
+        return transformNode,0.
+      camera = cameraNode.GetCamera()
+
+    vtk.vtkMatrix4x4.Invert(camera.GetViewTransformMatrix(), self.cameraToRAS)
+    transformNode.GetMatrixTransformToParent().DeepCopy(self.cameraToRAS)
+    return transformNode,camera.GetDistance()
 
   def handCursor(self,whichHand='Left'):
     """Create the mrml structure to represent a hand cursor if needed
-    otherwise return the current transform
+    otherwise return the current transform and the hand's cursor pool
     whichHand : 'Left' for left color, anything else for right
                 also defines suffix for Transform and Cursor
+    The cursors are drawn by the pool in table coordinates; the
+    transform carries the hand pose for the manipulators.
     """
+    try:
+      nodes = self.nodeCache[whichHand]
+      self.nodeCacheHits += 1
+      return nodes
+    except KeyError:
+      self.nodeCacheMisses += 1
     transformName = '%s-To-Table' % whichHand
     transformNode = slicer.util.getNode(transformName)
     if not transformNode:
-      # make the mrml 
-      sphere = vtk.vtkSphereSource()
-      sphere.Update()
-      # Create model node
-      cursor = slicer.vtkMRMLModelNode()
-      cursor.SetScene(slicer.mrmlScene)
-      cursor.SetName("Cursor-%s" % whichHand)
-      cursor.SetAndObservePolyData(sphere.GetOutput())
-      # Create display node
-      cursorModelDisplay = slicer.vtkMRMLModelDisplayNode()
-      if whichHand == 'Left':
-        color = (1,.84313725490196079,0) # gold (wedding ring hand)
-      else:
-        color = (0.69411764705882351, 0.47843137254901963, 0.396078431372549) # slicer skin tone
-      cursorModelDisplay.SetColor(color)
-      cursorModelDisplay.SetScene(slicer.mrmlScene)
-      slicer.mrmlScene.AddNode(cursorModelDisplay)
-      cursor.SetAndObserveDisplayNodeID(cursorModelDisplay.GetID())
-      # Add to slicer.mrmlScene
-      cursorModelDisplay.SetInputPolyData(sphere.GetOutput())
-      slicer.mrmlScene.AddNode(cursor)
       # Create transform node
       transformNode = slicer.vtkMRMLLinearTransformNode()
       transformNode.SetName(transformName)
-      for i in xrange(3):
-        transformNode.GetMatrixTransformToParent().SetElement(i, i, 10)
+      handsmrml.setTransformMatrix(transformNode, handtransforms.handToTable((0,0,0)))
       slicer.mrmlScene.AddNode(transformNode)
-      cursor.SetAndObserveTransformNodeID(transformNode.GetID())
-    handLineNode = self.handLine(whichHand)
-    return transformNode,handLineNode
-
-  def handLine(self,whichHand='Left'):
-    """Create a line to show the path from the hand to the table
+    if whichHand == 'Left':
+      color = (1,.84313725490196079,0) # gold (wedding ring hand)
+    else:
+      color = (0.69411764705882351, 0.47843137254901963, 0.396078431372549) # slicer skin tone
+    cursorName = 'Cursor-%s' % whichHand
+    # the hand, then its fingertips (hidden until the driver sends joints)
+    def makeCursors():
+      cursors = cursorpool.CursorPool(cursorName, 'sphere', 1 + handprotocol.FINGERTIPS,
+                                      color, scale=handtransforms.HAND_SCALE)
+      cursors.shapes[1:] = 0.
+      cursors.update()
+      return cursors
+    cursors = self.cursorPool(cursorName, makeCursors)
+    # parented here too, since updateCamera only does it when the camera moves
+    self.parentToTable(transformNode)
+    self.parentToTable(cursors.modelNode)
+    self.nodeCache[whichHand] = (transformNode,cursors)
+    return transformNode,cursors
+
+  def dropLines(self):
+    """The lines from each hand down to the table, one segment per hand
     """
-    handLineName = 'DropLine-%s' % whichHand
-    handLineNode = slicer.util.getNode(handLineName)
-    if not handLineNode:
-      points = vtk.vtkPoints()
-      polyData = vtk.vtkPolyData()
-      polyData.SetPoints(points)
-
-      lines = vtk.vtkCellArray()
-      polyData.SetLines(lines)
-      linesIDArray = lines.GetData()
-      linesIDArray.Reset()
-      linesIDArray.InsertNextTuple1(0)
-
-      polygons = vtk.vtkCellArray()
-      polyData.SetPolys( polygons )
-      idArray = polygons.GetData()
-      idArray.Reset()
-      idArray.InsertNextTuple1(0)
-
-      for point in ( (0,0,0), (1,1,1) ):
-        pointIndex = points.InsertNextPoint(*point)
-        linesIDArray.InsertNextTuple1(pointIndex)
-        linesIDArray.SetTuple1( 0, linesIDArray.GetNumberOfTuples() - 1 )
-        lines.SetNumberOfCells(1)
-        
-      # Create handLineNode model node
-      handLineNode = slicer.vtkMRMLModelNode()
-      handLineNode.SetScene(slicer.mrmlScene)
-      handLineNode.SetName("DropLine-%s" % whichHand)
-      handLineNode.SetAndObservePolyData(polyData)
-
-      # Create display node
-      modelDisplay = slicer.vtkMRMLModelDisplayNode()
-      modelDisplay.SetColor(1,1,0) # yellow
-      modelDisplay.SetScene(slicer.mrmlScene)
-      slicer.mrmlScene.AddNode(modelDisplay)
-      handLineNode.SetAndObserveDisplayNodeID(modelDisplay.GetID())
-
-      # Add to slicer.mrmlScene
-      modelDisplay.SetInputPolyData(handLineNode.GetPolyData())
-      slicer.mrmlScene.AddNode(handLineNode)
-    return handLineNode
-
+    def makeLines():
+      lines = cursorpool.LinePool('DropLines', len(handprotocol.HANDS), (1,1,0)) # yellow
+      self.parentToTable(lines.modelNode)
+      return lines
+    return self.cursorPool('DropLines', makeLines)
+
+  def parentToTable(self,node):
+    """Put a node under the Table-To-Camera transform"""
+    tableToCamera = self.tableCursor()
+    if node.GetTransformNodeID() != tableToCamera.GetID():
+      node.SetAndObserveTransformNodeID(tableToCamera.GetID())
 
   def tableCursor(self,dimensions=(900,30,600)):
     """Create the mrml structure to represent the table if needed
     otherwise return the current transform
     dimensions : left-right, up-down, in-out size of table
     """
+    try:
+      transformNode = self.nodeCache['Table']
+      self.nodeCacheHits += 1
+      return transformNode
+    except KeyError:
+      self.nodeCacheMisses += 1
     transformName = 'Table-To-Camera'
     transformNode = slicer.util.getNode(transformName)
     if not transformNode:
-      # make the mrml 
-      box = vtk.vtkCubeSource()
-      box.SetXLength(dimensions[0])
-      box.SetYLength(dimensions[1])
-      box.SetZLength(dimensions[2])
-      box.SetCenter(0,-dimensions[1]/2.,0)
-
-      box.Update()
-      # Create model node
-      cursor = slicer.vtkMRMLModelNode()
-      cursor.SetScene(slicer.mrmlScene)
-      cursor.SetName("Cursor-Table")
-      cursor.SetAndObservePolyData(box.GetOutput())
-      # Create display node
-      cursorModelDisplay = slicer.vtkMRMLModelDisplayNode()
-      cursorModelDisplay.SetColor((0.86274509803921573,)*3) # 'gainsboro'
-      cursorModelDisplay.SetOpacity(0.5)
-      cursorModelDisplay.SetScene(slicer.mrmlScene)
-      slicer.mrmlScene.AddNode(cursorModelDisplay)
-      cursor.SetAndObserveDisplayNodeID(cursorModelDisplay.GetID())
-      # Add to slicer.mrmlScene
-      cursorModelDisplay.SetInputPolyData(box.GetOutput())
-      slicer.mrmlScene.AddNode(cursor)
       # Create transform node
       transformNode = slicer.vtkMRMLLinearTransformNode()
       transformNode.SetName(transformName)
       slicer.mrmlScene.AddNode(transformNode)
-      tableToCamera = vtk.vtkMatrix4x4()
-      tableToCamera.SetElement(1, 3, -100)
-      transformNode.GetMatrixTransformToParent().DeepCopy(tableToCamera)
-      cursor.SetAndObserveTransformNodeID(transformNode.GetID())
+      handsmrml.setTransformMatrix(transformNode, handtransforms.tableToCamera(0))
+    def makeTable():
+      table = cursorpool.CursorPool('Cursor-Table', 'cube', 1,
+          (0.86274509803921573,)*3, opacity=0.5) # 'gainsboro'
+      table.shapes[0] = numpy.diag(dimensions)
+      table.positions[0] = (0,-dimensions[1]/2.,0)
+      table.update()
+      return table
+    table = self.cursorPool('Table', makeTable)
+    if table.modelNode.GetTransformNodeID() != transformNode.GetID():
+      table.modelNode.SetAndObserveTransformNodeID(transformNode.GetID())
+    self.nodeCache['Table'] = transformNode
     return transformNode
 
 
@@ -486,6 +1242,35 @@ class SlicerHandsTest(unittest.TestCase):
     """
     self.setUp()
     self.test_SlicerHands1()
+    self.test_HandParser()
+    self.test_LatestWins()
+    self.test_Skeleton()
+    self.test_HandReader()
+    self.test_MalformedPose()
+    self.test_Reconnect()
+    self.test_HandBroker()
+    self.test_BrokerMissing()
+    self.test_DriverSupervisor()
+    self.test_DatagramSource()
+    self.test_DatagramSourceOrdering()
+    self.test_NodeCache()
+    self.test_CursorPool()
+    self.test_CursorParenting()
+    self.test_ApplyPoseEvents()
+    self.test_PoseFilter()
+    self.test_RecordAndReplay()
+    self.test_HandSession()
+    self.test_Latency()
+    self.test_FrameScheduler()
+    self.test_SliceJumperCoalescing()
+    self.test_AttributeRegistry()
+    self.test_CameraFollowing()
+    self.test_CoreTransforms()
+    self.test_Gestures()
+    self.test_TwoHandedManipulator()
+    self.test_UndoHistory()
+    self.test_RayPicking()
+    self.test_Benchmarks()
 
   def test_SlicerHands1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -501,24 +1286,856 @@ class SlicerHandsTest(unittest.TestCase):
 
     self.delayDisplay("Starting the test")
     #
-    # first, get some data
+    # drive the logic with a recorded pinch instead of the driver
     #
-    import urllib
-    downloads = (
-        ('http://slicer.kitware.com/midas3/download?items=5767', 'FA.nrrd', slicer.util.loadVolume),
-        )
-
-    for url,name,loader in downloads:
-      filePath = slicer.app.temporaryPath + '/' + name
-      if not os.path.exists(filePath) or os.stat(filePath).st_size == 0:
-        print('Requesting download %s from %s...\n' % (name, url))
-        urllib.urlretrieve(url, filePath)
-      if loader:
-        print('Loading %s...\n' % (name,))
-        loader(filePath)
-    self.delayDisplay('Finished with download and loading\n')
-
-    volumeNode = slicer.util.getNode(pattern="FA")
     logic = SlicerHandsLogic()
-    self.assertTrue( logic.hasImageData(volumeNode) )
+    logic.updateCamera()
+    tableToCamera = logic.tableCursor()
+    for whichHand in ('Left', 'Right'):
+      transform,line = logic.handCursor(whichHand)
+      self.assertEqual(transform.GetTransformNodeID(), tableToCamera.GetID())
+    logic.parser.parseBuffer(b'POSE 1 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0\nPRESSED 1 2 3 LEFT\n')
+    logic.handleEvents(logic.parser.popEvents())
+    logic.filterPoses = False
+    logic.applyPose(None, None)
+    leftTransform = logic.handCursor('Left')[0]
+    self.assertEqual(leftTransform.GetAttribute('SlicerHands.gesture'), 'pinch')
+    self.assertEqual(leftTransform.GetMatrixTransformToParent().GetElement(1, 3), 2.)
+    logic.cleanup()
     self.delayDisplay('Test passed!')
+
+
+  def test_HandParser(self):
+    """Parse a short recorded stream without a driver"""
+    parser = handprotocol.HandParser()
+    positions = parser.positions
+    lines = (
+      b'MOVED 1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 LEFT',
+      b'POSE 1 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0 7 7 7 7 7 7 7',
+      b'PRESSED 1 2 3 LEFT',
+      b'POSE 10 20 30 0 0 0 1 0 40 50 60 0 0 0 1 1',
+      b'RELEASED 1 2 3 LEFT',
+      b'WHATEVER',
+      )
+    for line in lines:
+      parser.parseLine(line)
+    self.assertEqual(parser.poseCount, 2)
+    self.assertEqual(parser.skippedCount, 2)
+    self.assertTrue(positions is parser.positions)
+    self.assertEqual(list(positions[0]), [10., 20., 30.])
+    self.assertEqual(list(positions[1]), [40., 50., 60.])
+    self.assertEqual(parser.popEvents(), [('PRESSED', 'Left'), ('RELEASED', 'Left')])
+    self.assertEqual(parser.popEvents(), [])
+    benchmark = handprotocol.benchmarkParser(handprotocol.sampleTraffic(1000), repeat=1)
+    self.delayDisplay('Parser: %d messages/second' % benchmark['parser']['messagesPerSecond'])
+
+  def test_LatestWins(self):
+    """A backlog of poses is cleared in one pass with gestures kept in order"""
+    parser = handprotocol.HandParser()
+    pose = b'POSE %d 0 0 0 0 0 1 0 0 0 0 0 0 0 1 0\n'
+    data = b''.join([pose % i for i in range(1000)])
+    data += b'PRESSED 1 2 3 LEFT\n' + pose % 1000 + b'RELEASED 1 2 3 LEFT\n' + b'POSE 1001'
+    self.assertEqual(parser.parseBuffer(data), 1000)
+    self.assertEqual(parser.poseCount, 1)
+    self.assertEqual(parser.positions[0][0], 1000.)
+    self.assertEqual(parser.popEvents(), [('PRESSED', 'Left'), ('RELEASED', 'Left')])
+    self.assertEqual(parser.parseBuffer(b' 0 0 0 0 0 1 0 0 0 0 0 0 0 1 0\n'), 0)
+    self.assertEqual(parser.positions[0][0], 1001.)
+    self.assertEqual(parser.droppedPoseCount, 1000)
+    # a bad newest pose falls back to the one before it, which is not dropped
+    data = pose % 2000 + pose % 2001 + b'POSE 2002 2\n'
+    self.assertEqual(parser.parseBuffer(data), 1)
+    self.assertEqual(parser.positions[0][0], 2001.)
+    self.assertEqual(parser.malformedCount, 1)
+    self.assertEqual(parser.droppedPoseCount, 1001)
+
+  def test_Skeleton(self):
+    """The whole POSE record is decoded in place and drives the cursors"""
+    parser = handprotocol.HandParser()
+    line = [line for line in handprotocol.sampleTraffic(10) if line.startswith(b'POSE')][0]
+    fields = line.split()
+    parser.parseLine(line)
+    self.assertTrue(parser.decodeJoints())
+    self.assertEqual(parser.skeletonBuffer[-2], float(fields[-1]))
+    self.assertEqual(parser.jointOrientations[0, 0, 0], float(fields[17]))
+    self.assertEqual(parser.jointPositions[0, 0, 0], float(fields[21]))
+    for view in (parser.pose, parser.positions, parser.jointPositions, parser.fingertips):
+      self.assertTrue(numpy.shares_memory(view, parser.skeleton))
+    parser.parseLine(b'POSE 1 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0')
+    self.assertFalse(parser.decodeJoints())
+    # a left hand turned a quarter turn about z, with fingertips
+    logic = SlicerHandsLogic()
+    logic.filterPoses = False
+    half = 0.5 ** 0.5
+    hands = b'10 20 30 0 0 %f %f 0 40 50 60 0 0 0 1 0 ' % (half, half)
+    joints = b' '.join([b'0 0 0 1 0 0 0'] * (2 * handprotocol.JOINTS))
+    tips = b' '.join([b'%d 20 30' % (10 + i) for i in range(2 * handprotocol.FINGERTIPS)])
+    logic.parser.parseLine(b'POSE ' + hands + joints + b' ' + tips)
+    logic.applyPose(None, None)
+    transform,cursors = logic.handCursor('Left')
+    matrix = handsmrml.transformMatrix(transform)
+    self.assertTrue(numpy.allclose(matrix[:3, :3], [[0, -10, 0], [10, 0, 0], [0, 0, 10]]))
+    self.assertTrue(numpy.allclose(cursors.shapes[0], matrix[:3, :3]))
+    self.assertEqual(list(cursors.positions[1]), [10., 20., 30.])
+    self.assertEqual(cursors.shapes[1, 0, 0], logic.fingertipScale)
+    self.assertEqual(list(logic.handCursor('Right')[1].positions[5]), [19., 20., 30.])
+    logic.cleanup()
+
+  def test_HandReader(self):
+    """Read from a fake driver on the threegear port with the reader thread"""
+    import socket, threading, time
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('localhost', 1988))
+    server.listen(1)
+    def fakeDriver():
+      connection,address = server.accept()
+      for i in range(100):
+        connection.sendall(b'POSE %d 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0\n' % i)
+      connection.sendall(b'PRESSED 1 2 3 RIGHT\nRELEASED 1 2 3 RIGHT\n')
+      time.sleep(0.5)
+      connection.close()
+    driverThread = threading.Thread(target=fakeDriver)
+    driverThread.start()
+    reader = handreader.HandReader('localhost', 1988)
+    reader.start()
+    driverThread.join()
+    reader.stop()
+    server.close()
+    self.assertEqual(reader.error, None)
+    poseCount,poseTime,skeleton,readTime = reader.latestPose()
+    self.assertEqual(list(skeleton['hands'][0, 0:3]), [99., 2., 3.])
+    self.assertEqual(list(skeleton['hands'][1, 0:3]), [4., 5., 6.])
+    self.assertEqual(poseCount + reader.droppedPoseCount(), 100)
+    self.assertEqual(reader.popEvents(), [('PRESSED', 'Right'), ('RELEASED', 'Right')])
+
+  def test_MalformedPose(self):
+    """A truncated POSE is counted and skipped, and the reader thread
+    goes on to apply the next one"""
+    import socket, threading
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('localhost', 0))
+    server.listen(1)
+    def fakeDriver():
+      connection,address = server.accept()
+      connection.sendall(b'POSE 1 2\n')
+      time.sleep(0.2)
+      connection.sendall(b'POSE 5 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0\n')
+      time.sleep(0.2)
+      connection.close()
+    driverThread = threading.Thread(target=fakeDriver)
+    driverThread.start()
+    logic = SlicerHandsLogic()
+    logic.filterPoses = False
+    logic.useReaderThread = True
+    logic.port = server.getsockname()[1]
+    logic.connectToHands()
+    driverThread.join()
+    server.close()
+    reader = logic.reader
+    self.assertEqual(reader.error, None)
+    self.assertEqual(reader.parser.malformedCount, 1)
+    logic.applyPose(None, None)
+    transform = logic.handCursor('Left')[0]
+    self.assertEqual(transform.GetMatrixTransformToParent().GetElement(0, 3), 5.)
+    logic.cleanup()
+
+  def test_Reconnect(self):
+    """The first pose of a new connection is applied even though its
+    reader counts from the same pose number as the last one"""
+    import socket, threading
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('localhost', 0))
+    server.listen(1)
+    def fakeDriver(x):
+      connection,address = server.accept()
+      connection.sendall(b'POSE %d 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0\n' % x)
+      time.sleep(0.2)
+      connection.close()
+    logic = SlicerHandsLogic()
+    logic.filterPoses = False
+    logic.useReaderThread = True
+    logic.port = server.getsockname()[1]
+    transform = logic.handCursor('Left')[0]
+    for x in (5, 9):
+      driverThread = threading.Thread(target=fakeDriver, args=(x,))
+      driverThread.start()
+      logic.connectToHands()
+      driverThread.join()
+      self.assertEqual(logic.reader.latestPose()[0], 1)
+      logic.applyPose(None, None)
+      self.assertEqual(transform.GetMatrixTransformToParent().GetElement(0, 3), x)
+      logic.disconnectFromHands()
+    server.close()
+    logic.cleanup()
+
+  def test_HandBroker(self):
+    """One replayed driver shared by several clients, one of them stalled"""
+    import socket
+    lines = handprotocol.sampleTraffic(600)
+    records = [(0.5 + index / 600., line) for index,line in enumerate(lines)]
+    driver = handrecording.HandReplayServer(records, port=0)
+    driver.start()
+    path = slicer.app.temporaryPath + '/SlicerHands-test-pose'
+    broker = handbroker.HandBroker('localhost', driver.port, streamPort=0, eventPort=0,
+                                   sharedPosePath=path, sendTimeout=0.5)
+    broker.start()
+    clients = [handbroker.BrokerClient('localhost', broker.eventPort, path) for i in range(2)]
+    for client in clients:
+      client.start()
+    stream = socket.create_connection(('localhost', broker.streamPort))
+    stream.settimeout(0.1)
+    stalled = socket.create_connection(('localhost', broker.streamPort))
+    received = b''
+    deadline = time.time() + 2.5
+    while time.time() < deadline:
+      try:
+        received += stream.recv(65536)
+      except socket.timeout:
+        pass
+    gestures = [line for line in lines if line.split()[0] in (b'PRESSED', b'RELEASED', b'DRAGGED')]
+    for client in clients:
+      self.assertEqual(len(client.popEvents()), len(gestures))
+      poseCount,poseTime,skeleton,readTime = client.latestPose()
+      self.assertEqual(poseCount, broker.parser.poseCount)
+      self.assertTrue(numpy.array_equal(skeleton, broker.parser.skeleton))
+    newestPose = [line for line in lines if line.startswith(b'POSE')][-1]
+    self.assertTrue(received.endswith(newestPose + b'\n'))
+    self.assertEqual(received.count(b'RELEASED'), len([line for line in gestures if line.startswith(b'RELEASED')]))
+    statistics = broker.statistics()
+    self.assertEqual(statistics['subscribers'], 4)
+    self.assertEqual(statistics['sharedPoseRetries'], 0)
+    stalled.close()
+    stream.close()
+    for client in clients:
+      client.stop()
+    broker.stop()
+    driver.stop()
+    self.assertFalse(os.path.exists(path))
+
+  def test_BrokerMissing(self):
+    """Connecting through a broker that is not running reports a lost
+    connection instead of raising"""
+    logic = SlicerHandsLogic()
+    logic.useBroker = True
+    logic.connectToHands()
+    deadline = time.time() + 6.
+    while not logic.connectionLost() and time.time() < deadline:
+      time.sleep(0.05)
+    self.assertTrue(logic.connectionLost())
+    self.assertNotEqual(logic.reader.error, None)
+    logic.applyPose(None, None)
+    logic.cleanup()
+
+  def test_DriverSupervisor(self):
+    """Launch the stub driver, connect once it listens, and reconnect
+    each time it drops the connection"""
+    import socket
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(('localhost', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    logic = SlicerHandsLogic()
+    logic.port = port
+    logic.useReaderThread = True
+    command = handdriver.stubCommand(port, delay=0.3, poses=20)
+    logic.startDriver(command, os.path.dirname(os.path.abspath(__file__)))
+    logic.driver.initialBackoff = logic.driver.backoff = 0.05
+    self.assertEqual(logic.superviseDriver(), 'starting')
+    deadline = time.time() + 20.
+    while logic.driver.reconnectCount < 2 and time.time() < deadline:
+      logic.superviseDriver()
+      time.sleep(0.02)
+    statistics = logic.driverStatistics()
+    self.assertEqual(statistics['reconnects'], 2)
+    self.assertEqual(statistics['launches'], 1)
+    self.assertTrue(statistics['startupSeconds'] >= 0.3)
+    self.assertTrue(logic.isConnected())
+    process = logic.driver.process
+    logic.disconnectFromHands()
+    logic.stopDriver()
+    self.assertNotEqual(process.poll(), None)
+    logic.cleanup()
+
+  def test_DatagramSource(self):
+    """Loopback datagrams: stale poses are dropped, their gestures kept,
+    and loss, reordering and duplicates are counted"""
+    logic = SlicerHandsLogic()
+    logic.filterPoses = False
+    logic.sourceName = 'datagram'
+    logic.sourceOptions = {'datagram': {'port': 0}}
+    logic.connectToHands()
+    sender = handsources.DatagramSender('localhost', logic.reader.port)
+    pose = b'POSE %d 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0'
+    datagrams = [sender.datagram([pose % i] + ([b'PRESSED 1 2 3 LEFT'] if i == 3 else [])) for i in range(10)]
+    # 3 arrives late, 6 and 8 never, 9 twice
+    for index in (0, 1, 2, 4, 5, 3, 7, 9, 9):
+      sender.sendDatagram(datagrams[index])
+    deadline = time.time() + 2.
+    while logic.reader.datagramCount + logic.reader.duplicateCount < 9 and time.time() < deadline:
+      time.sleep(0.01)
+    sender.close()
+    logic.applyPose(None, None)
+    transform = logic.handCursor('Left')[0]
+    self.assertEqual(transform.GetMatrixTransformToParent().GetElement(0, 3), 9.)
+    self.assertEqual(transform.GetAttribute('SlicerHands.gesture'), 'pinch')
+    statistics = logic.sourceStatistics()
+    self.assertEqual(statistics['datagrams'], 8)
+    self.assertEqual(statistics['lost'], 2)
+    self.assertEqual(statistics['reordered'], 1)
+    self.assertEqual(statistics['stalePoses'], 1)
+    self.assertEqual(statistics['duplicates'], 1)
+    self.assertEqual(statistics['transit']['count'], 8)
+    logic.cleanup()
+
+  def test_DatagramSourceOrdering(self):
+    """A stream that starts out of order loses nothing, and bad
+    datagrams are counted without stopping the source"""
+    source = handsources.DatagramSource(port=0)
+    source.start()
+    sender = handsources.DatagramSender('localhost', source.port)
+    pose = b'POSE %d 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0'
+    datagrams = [sender.datagram([pose % i]) for i in range(3)]
+    datagrams += [b'short', sender.datagram([b'POSE 1 2']), sender.datagram([pose % 4])]
+    for index in (1, 0, 2, 3, 4, 5):
+      sender.sendDatagram(datagrams[index])
+    deadline = time.time() + 2.
+    while source.datagramCount < 5 and time.time() < deadline:
+      time.sleep(0.01)
+    sender.close()
+    source.stop()
+    self.assertEqual(source.error, None)
+    self.assertEqual(source.latestPose()[2]['hands'][0, 0], 4.)
+    statistics = source.statistics()
+    self.assertEqual((statistics['lost'], statistics['lossFraction']), (0, 0.))
+    self.assertEqual(statistics['reordered'], 1)
+    self.assertEqual(statistics['malformedDatagrams'], 2)
+
+  def test_NodeCache(self):
+    """Hand cursors are looked up once and forgotten when the scene changes"""
+    logic = SlicerHandsLogic()
+    leftNodes = logic.handCursor('Left')
+    for i in range(10):
+      self.assertEqual(logic.handCursor('Left'), leftNodes)
+    statistics = logic.nodeCacheStatistics()
+    self.assertEqual(statistics['misses'], 1)
+    self.assertEqual(statistics['hits'], 10)
+    slicer.mrmlScene.RemoveNode(leftNodes[1].modelNode)
+    self.assertEqual(logic.nodeCache, {})
+    transform,cursors = logic.handCursor('Left')
+    self.assertEqual(transform, leftNodes[0])
+    self.assertNotEqual(cursors, leftNodes[1])
+    self.assertTrue(cursors.inScene())
+    slicer.mrmlScene.Clear(0)
+    self.assertEqual(logic.nodeCache, {})
+    self.assertEqual(logic.nodeCacheStatistics()['misses'], 2)
+    logic.cleanup()
+
+  def test_CursorParenting(self):
+    """Cursors made again after their nodes were deleted are drawn in
+    table coordinates right away, without a camera move"""
+    logic = SlicerHandsLogic()
+    logic.filterPoses = False
+    logic.updateCamera()
+    tableToCamera = logic.tableCursor()
+    transform,cursors = logic.handCursor('Left')
+    slicer.mrmlScene.RemoveNode(cursors.modelNode)
+    slicer.mrmlScene.RemoveNode(transform)
+    slicer.mrmlScene.RemoveNode(logic.dropLines().modelNode)
+    logic.parser.parseLine(b'POSE 1 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0')
+    logic.applyPose(None, None)
+    transform,cursors = logic.handCursor('Left')
+    for node in (transform, cursors.modelNode, logic.dropLines().modelNode):
+      self.assertEqual(node.GetTransformNodeID(), tableToCamera.GetID())
+    logic.cleanup()
+
+  def test_CursorPool(self):
+    """Many cursors share one template and redraw as one model modification"""
+    pools = [cursorpool.CursorPool('Cursor-Test-%d' % i, 'sphere', 22, scale=5.) for i in range(2)]
+    self.assertEqual(pools[0].glyph.GetInputConnection(1, 0).GetProducer(),
+                     pools[1].glyph.GetInputConnection(1, 0).GetProducer())
+    pool = pools[0]
+    counts = []
+    tag = pool.modelNode.AddObserver(vtk.vtkCommand.ModifiedEvent, lambda caller,event: counts.append(event))
+    pool.positions[:] = numpy.arange(66).reshape(22, 3)
+    pool.shapes[21] = 0
+    pool.update()
+    pool.modelNode.RemoveObserver(tag)
+    self.assertEqual(len(counts), 1)
+    templatePoints = cursorpool.shapeTemplate('sphere').GetOutput().GetNumberOfPoints()
+    polyData = pool.modelNode.GetPolyData()
+    self.assertEqual(polyData.GetNumberOfPoints(), 22 * templatePoints)
+    bounds = polyData.GetBounds()
+    self.assertAlmostEqual(bounds[1], 63., 4)
+    lines = cursorpool.LinePool('DropLines-Test', 3)
+    lines.segments[2] = ((1, 0, 2), (1, 5, 2))
+    lines.update()
+    self.assertEqual(lines.modelNode.GetPolyData().GetNumberOfLines(), 3)
+    self.assertEqual(lines.modelNode.GetPolyData().GetPoint(5), (1., 5., 2.))
+    for pool in pools + [lines]:
+      pool.remove()
+      self.assertFalse(pool.inScene())
+
+  def test_ApplyPoseEvents(self):
+    """Each hand transform is modified at most once per applied pose"""
+    logic = SlicerHandsLogic()
+    logic.filterPoses = False
+    counts = {}
+    def countEvent(caller,event):
+      counts[caller.GetName()] = counts.get(caller.GetName(), 0) + 1
+    observations = []
+    for whichHand in ('Left', 'Right'):
+      transform,line = logic.handCursor(whichHand)
+      event = slicer.vtkMRMLTransformNode.TransformModifiedEvent
+      observations.append((transform, transform.AddObserver(event, countEvent)))
+    logic.parser.parseLine(b'POSE 1 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0')
+    logic.applyPose(None, None)
+    self.assertEqual(counts, {'Left-To-Table': 1, 'Right-To-Table': 1})
+    # an unchanged pose does not touch the scene
+    logic.applyPose(None, None)
+    self.assertEqual(counts, {'Left-To-Table': 1, 'Right-To-Table': 1})
+    transform = logic.handCursor('Right')[0]
+    self.assertEqual(transform.GetMatrixTransformToParent().GetElement(1, 3), 5.)
+    self.assertEqual(transform.GetMatrixTransformToParent().GetElement(1, 1), 10.)
+    for node,tag in observations:
+      node.RemoveObserver(tag)
+    logic.cleanup()
+
+  def test_PoseFilter(self):
+    """Filtering reduces the jitter of a noisy recorded motion"""
+    import numpy
+    times = numpy.arange(300) / 60.
+    positions = numpy.zeros((300, 2, 3))
+    positions[:, 0, 0] = 100 * numpy.sin(times)
+    positions += numpy.random.RandomState(1988).normal(0, 1, positions.shape)
+    pipeline = posefilter.FilterPipeline((posefilter.OneEuroFilter(),))
+    result = posefilter.evaluatePipeline(pipeline, times, positions)
+    for raw,filtered in zip(result['rawJitter'], result['filteredJitter']):
+      self.assertTrue(filtered < raw / 2.)
+    self.assertTrue(result['lag'] >= 0)
+
+  def test_RecordAndReplay(self):
+    """Record a stream, replay it on the driver port and read it back"""
+    lines = handprotocol.sampleTraffic(600)
+    recordingPath = slicer.app.temporaryPath + '/SlicerHandsTest-recording.txt'
+    recorder = handrecording.HandRecorder(recordingPath)
+    for t,line in handrecording.recordsFromLines(lines):
+      recorder.write(line + b'\n', recorder.startTime + t)
+    recorder.close()
+    records = handrecording.readRecording(recordingPath)
+    self.assertEqual([line for t,line in records], lines)
+    server = handrecording.HandReplayServer(records, port=1988, speed=0, maxClients=1)
+    server.start()
+    reader = handreader.HandReader('localhost', server.port)
+    reader.start()
+    server.join(10)
+    reader.join(10)
+    self.assertEqual(server.sentCount, len(lines))
+    self.assertEqual(reader.error, None)
+    self.assertEqual(reader.parser.poseCount + reader.droppedPoseCount(), 360)
+    lastPose = [line for line in lines if line.startswith(b'POSE')][-1]
+    self.assertEqual(reader.latestPose()[2][1, 0], float(lastPose.split()[9]))
+    # closing a recording the reader thread is writing to is harmless
+    recorder = handrecording.HandRecorder(recordingPath + '.tee')
+    server = handrecording.HandReplayServer(records, port=0, speed=0, maxClients=1)
+    server.start()
+    reader = handreader.HandReader('localhost', server.port)
+    reader.recorder = recorder
+    reader.start()
+    recorder.close()
+    server.join(10)
+    reader.join(10)
+    self.assertEqual(reader.error, None)
+    self.assertEqual(reader.parser.poseCount + reader.droppedPoseCount(), 360)
+    recorder.write(b'POSE 1\n')
+
+  def test_HandSession(self):
+    """Convert a text recording to the binary session format and seek in it"""
+    lines = handprotocol.sampleTraffic(600)
+    recordingPath = slicer.app.temporaryPath + '/SlicerHandsTest-session.txt'
+    fp = open(recordingPath, 'wb')
+    fp.write(b'\n'.join(lines))
+    fp.close()
+    sessionPath = slicer.app.temporaryPath + '/SlicerHandsTest-session'
+    session = handsession.convertRecording(recordingPath, sessionPath, rate=60.)
+    self.assertEqual(len(session), 360)
+    self.assertEqual(len(session.events), 60)
+    self.assertTrue(abs(session.statistics()['rate'] - 60.) < 1e-6)
+    times,positions,orientations,events = session.window(1., 2.)
+    self.assertEqual(len(times), 60)
+    self.assertTrue(times[0] >= 1. and times[-1] < 2.)
+    records = session.records()
+    self.assertEqual(len(records), len([line for line in lines if not line.startswith((b'MOVED', b'POINT'))]))
+    self.assertEqual(records[-1][1], lines[-1].split()[0] + b' RIGHT')
+    # malformed poses and gestures of unknown hands are left out, not
+    # converted into empty rows or errors
+    fp = open(recordingPath, 'wb')
+    fp.write(b'\n'.join(lines + [b'POSE 1 2', b'PRESSED 1 2 3 MIDDLE', b'POSE 9 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0']))
+    fp.close()
+    session = handsession.convertRecording(recordingPath, sessionPath + '-bad', rate=60.)
+    self.assertEqual((len(session), len(session.events)), (361, 60))
+    self.assertEqual(session.positions[-1][0][0], 9.)
+    self.assertTrue((numpy.diff(session.times) >= 0).all())
+
+  def test_Latency(self):
+    """Each stage gets a sample per applied pose once timing is on"""
+    logic = SlicerHandsLogic()
+    logic.parser.parseLine(b'POSE 1 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0')
+    logic.applyPose(None, None)
+    self.assertEqual(logic.latencyStatistics()['apply']['count'], 0)
+    logic.latency.enabled = True
+    flushed = []
+    for i in range(10):
+      manipulator.deferFlush(lambda: flushed.append(i))
+      logic.parser.readTime = time.time()
+      logic.parser.parseLine(b'POSE %d 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0' % (10 * (i + 1)))
+      logic.applyPose(None, None)
+      logic.onRenderEnd(None, None)
+    # coalesced manipulator work runs inside the pose that queued it
+    self.assertEqual(flushed, list(range(10)))
+    statistics = logic.latencyStatistics()
+    for stage in handlatency.STAGES:
+      self.assertEqual(statistics[stage]['count'], 10)
+      self.assertTrue(0 <= statistics[stage]['p50'] <= statistics[stage]['p99'])
+    logic.cleanup()
+
+  def test_FrameScheduler(self):
+    """Jitter inside the dead-band is not applied and sends the scheduler
+    idle; a real move or a gesture brings back the full rate"""
+    scheduler = handscheduler.FrameScheduler(targetFPS=50., epsilon=0.5, idleFrames=5, idleFPS=5.)
+    self.assertTrue(scheduler.tick(numpy.zeros((2, 3))))
+    for i in range(5):
+      self.assertFalse(scheduler.tick(numpy.full((2, 3), 0.1 * (i % 2))))
+    self.assertTrue(scheduler.idle)
+    self.assertAlmostEqual(scheduler.interval(), 0.2)
+    self.assertTrue(scheduler.tick(numpy.full((2, 3), 2.)))
+    self.assertFalse(scheduler.idle)
+    self.assertAlmostEqual(scheduler.interval(), 0.02)
+    turned = numpy.array(((0., 0., 0., 1.), (0., 0., 0.1, 1.)))
+    self.assertTrue(scheduler.tick(numpy.full((2, 3), 2.), turned))
+    self.assertFalse(scheduler.tick(numpy.full((2, 3), 2.), turned))
+    statistics = scheduler.statistics()
+    self.assertEqual((statistics['ticks'], statistics['applied'], statistics['wakes']), (9, 3, 1))
+    scheduler.updateReport(time.time() + 10.)
+    for key in ('framesPerSecond', 'appliedPerSecond', 'cpuPercent'):
+      self.assertTrue(key in scheduler.statistics())
+
+    logic = SlicerHandsLogic()
+    logic.filterPoses = False
+    logic.scheduler.idleFrames = 3
+    logic.parser.parseLine(b'POSE 1 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0')
+    logic.applyPose(None, None)
+    transform = logic.handCursor('Left')[0]
+    modifiedTime = transform.GetMTime()
+    logic.parser.parseLine(b'POSE 1.2 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0')
+    for i in range(3):
+      logic.applyPose(None, None)
+    self.assertEqual(transform.GetMTime(), modifiedTime)
+    self.assertEqual(transform.GetMatrixTransformToParent().GetElement(0, 3), 1.)
+    self.assertTrue(logic.scheduler.idle)
+    logic.parser.parseLine(b'PRESSED 1 2 3 LEFT')
+    logic.handleEvents(logic.parser.popEvents())
+    self.assertFalse(logic.scheduler.idle)
+    logic.parser.parseLine(b'POSE 5 2 3 0 0 0 1 0 4 5 6 0 0 0 1 0')
+    logic.applyPose(None, None)
+    self.assertEqual(transform.GetMatrixTransformToParent().GetElement(0, 3), 5.)
+    logic.cleanup()
+
+  def test_SliceJumperCoalescing(self):
+    """A burst of hand moves reslices once, tiny moves not at all
+    unless the slices were moved by something else"""
+    transform = slicer.vtkMRMLLinearTransformNode()
+    slicer.mrmlScene.AddNode(transform)
+    jumper = manipulator.SliceJumper(transform, minimumJumpVoxels=0.5)
+    transform.SetAttribute('SlicerHands.gesture', 'pinch')
+    for i in range(10):
+      transform.GetMatrixTransformToParent().SetElement(0, 3, 10. * i)
+    slicer.app.processEvents()
+    self.assertEqual(jumper.requestedJumps, 10)
+    self.assertEqual(jumper.performedJumps, 1)
+    transform.GetMatrixTransformToParent().SetElement(0, 3, 90.1)
+    slicer.app.processEvents()
+    self.assertEqual(jumper.performedJumps, 1)
+    self.assertEqual(jumper.reslicesSaved(), 10)
+    # once something else moves the slices a tiny move jumps back
+    sliceLogic = jumper.sliceWidget().sliceLogic()
+    sliceLogic.SetSliceOffset(sliceLogic.GetSliceOffset() + 20.)
+    transform.GetMatrixTransformToParent().SetElement(0, 3, 90.2)
+    slicer.app.processEvents()
+    self.assertEqual(jumper.performedJumps, 2)
+    transform.SetAttribute('SlicerHands.gesture', None)
+    jumper.cleanup()
+
+  def test_AttributeRegistry(self):
+    """Manipulators share one observation per node and only hear
+    about the attributes they watch"""
+    class Recorder(manipulator.Manipulator):
+      def __init__(self,registry):
+        super(Recorder,self).__init__(registry)
+        self.changes = []
+      def onAttributeChanged(self,node,attribute,newValue,oldValue):
+        self.changes.append((attribute,newValue,oldValue))
+    registry = manipulator.AttributeWatchRegistry()
+    node = slicer.vtkMRMLLinearTransformNode()
+    pinchers = [Recorder(registry) for i in range(5)]
+    for pincher in pinchers:
+      pincher.observeAttributes( ((node, ('SlicerHands.gesture',)),) )
+    other = Recorder(registry)
+    other.observeAttributes( ((node, ('Other',)),) )
+    self.assertEqual(len(registry.observerTags), 1)
+    wasSuspended = registry.suspend(node)
+    node.GetMatrixTransformToParent().SetElement(0, 3, 1)
+    node.Modified()
+    registry.resume(node, wasSuspended)
+    self.assertEqual(registry.scanCount, 0)
+    node.SetAttribute('SlicerHands.gesture', 'pinch')
+    for pincher in pinchers:
+      self.assertEqual(pincher.changes, [('SlicerHands.gesture', 'pinch', None)])
+      self.assertEqual(pincher.nodeStates[node]['SlicerHands.gesture'], 'pinch')
+    self.assertEqual(other.changes, [])
+    for m in pinchers + [other]:
+      m.cleanup()
+    self.assertEqual(registry.observerTags, {})
+    results = manipulator.benchmarkDispatch((1,10), (1,10), frames=20)
+    for result in results:
+      self.assertEqual(result['changes'], 2 * result['manipulators'] * result['nodes'])
+
+  def test_CameraFollowing(self):
+    """The table follows camera moves, also after a scene close, and
+    ignores unrelated camera node changes"""
+    logic = SlicerHandsLogic()
+    logic.followCameras()
+    cameraNode = logic.cameraNode()
+    tableToCamera = logic.tableCursor()
+    camera = cameraNode.GetCamera()
+    camera.SetPosition(0, -500, 0)
+    camera.SetFocalPoint(0, 0, 0)
+    camera.SetViewUp(0, 0, 1)
+    cameraNode.Modified()
+    self.assertEqual(tableToCamera.GetMatrixTransformToParent().GetElement(2, 3), -500.)
+    cameraToRAS = logic.cameraTransform(camera)[0].GetMatrixTransformToParent()
+    self.assertEqual([cameraToRAS.GetElement(row, 3) for row in range(3)], [0., -500., 0.])
+    self.assertTrue(abs(cameraToRAS.GetElement(2, 1) - 1.) < 1e-9)
+    misses = logic.nodeCacheStatistics()['misses']
+    for i in range(10):
+      cameraNode.Modified()
+      logic.cameraNode()
+    self.assertEqual(logic.nodeCacheStatistics()['misses'], misses)
+    # after a scene close the cameras the views have then are followed
+    slicer.mrmlScene.Clear(0)
+    slicer.app.processEvents()
+    observed = [node for node,tag in logic.cameraObserverTags]
+    self.assertTrue(observed)
+    self.assertTrue(all([node.GetScene() for node in observed]))
+    cameraNode = logic.cameraNode()
+    camera = cameraNode.GetCamera()
+    camera.SetPosition(0, -300, 0)
+    camera.SetFocalPoint(0, 0, 0)
+    camera.SetViewUp(0, 0, 1)
+    cameraNode.Modified()
+    self.assertEqual(logic.tableCursor().GetMatrixTransformToParent().GetElement(2, 3), -300.)
+    logic.disconnectFromHands()
+    self.assertEqual(logic.cameraObserverTags, [])
+    logic.cleanup()
+
+  def test_CoreTransforms(self):
+    """The NumPy transform chain in handscore matches the MRML one"""
+    import numpy
+    logic = SlicerHandsLogic()
+    camera = logic.cameraNode().GetCamera()
+    camera.SetPosition(100, -400, 50)
+    camera.SetFocalPoint(10, 20, 30)
+    camera.SetViewUp(0, 0, 1)
+    cameraToRAS,distance = handtransforms.cameraToRAS(
+        camera.GetPosition(), camera.GetFocalPoint(), camera.GetViewUp())
+    cameraNode,cameraDistance = logic.cameraTransform(camera)
+    self.assertTrue(numpy.allclose(cameraToRAS, handsmrml.transformMatrix(cameraNode), atol=1e-6))
+    self.assertAlmostEqual(distance, cameraDistance, 6)
+    # a quarter turn about z, scaled up to cursor size
+    handToTable = handtransforms.handToTable((1, 2, 3), (0, 0, 0.5 ** 0.5, 0.5 ** 0.5))
+    self.assertTrue(numpy.allclose(handtransforms.transformPoints(handToTable, numpy.array([[1., 0, 0]])), [[1, 12, 3]]))
+    # round trip through a transform node
+    transform = slicer.vtkMRMLLinearTransformNode()
+    slicer.mrmlScene.AddNode(transform)
+    handsmrml.setTransformMatrix(transform, handToTable)
+    self.assertTrue(numpy.allclose(handsmrml.transformMatrix(transform), handToTable))
+    slicer.mrmlScene.RemoveNode(transform)
+    logic.cleanup()
+
+  def test_Gestures(self):
+    """A pinched two hand spread is published as a zoom on both hands"""
+    import numpy
+    times = numpy.arange(120) / 60.
+    positions = numpy.zeros((120, 2, 3))
+    positions[:, 1, 0] = 200
+    positions[60:, 0, 0] -= numpy.arange(60) * 2
+    positions[60:, 1, 0] += numpy.arange(60) * 2
+    engine = handgestures.GestureEngine()
+    pinches = [(1., 'Left', True), (1., 'Right', True)]
+    labels = [(0., 1., 'dwell'), (0., 1., 'dwell'), (1., 2., 'zoom')]
+    result = handgestures.evaluateRecognizer(engine, times, positions, labels, pinches)
+    self.assertEqual(result['precision'], 1.)
+    self.assertEqual(result['recall'], 1.)
+    self.assertTrue(handgestures.benchmarkGestureEngine(1000)['samplesPerSecond'] > 0)
+
+    logic = SlicerHandsLogic()
+    logic.publishGestures([('zoom', 'Both', 1.5)])
+    for whichHand in ('Left', 'Right'):
+      transform = logic.handCursor(whichHand)[0]
+      self.assertEqual(transform.GetAttribute('SlicerHands.recognized'), 'zoom')
+      self.assertEqual(transform.GetAttribute('SlicerHands.recognizedValue'), '1.5')
+    # a two handed gesture wins over a swipe, a swipe over a dwell,
+    # whatever order they come in
+    gestures = [('dwell', 'Left', 0.9), ('swipe-up', 'Right', 900.), ('rotate', 'Both', 12.),
+                ('dwell', 'Right', 0.9), ('swipe-in', 'Left', 850.)]
+    self.assertEqual(handgestures.winningGestures(gestures), {'Left': ('rotate', 12.), 'Right': ('rotate', 12.)})
+    logic.publishGestures(gestures[3:] + gestures[:2])
+    self.assertEqual(logic.handCursor('Left')[0].GetAttribute('SlicerHands.recognized'), 'swipe-in')
+    self.assertEqual(logic.handCursor('Right')[0].GetAttribute('SlicerHands.recognized'), 'swipe-up')
+    logic.publishGestures([])
+    self.assertEqual(logic.handCursor('Left')[0].GetAttribute('SlicerHands.recognized'), None)
+    logic.cleanup()
+
+  def test_TwoHandedManipulator(self):
+    """Spreading and turning pinched hands scales and turns the target once per pass"""
+    logic = SlicerHandsLogic()
+    model = slicer.vtkMRMLModelNode()
+    slicer.mrmlScene.AddNode(model)
+    grab = logic.manipulateWithBothHands(model)
+    self.assertTrue(model.GetParentTransformNode())
+    left,right = grab.leftTransform,grab.rightTransform
+    right.GetMatrixTransformToParent().SetElement(0, 3, 100)
+    left.SetAttribute('SlicerHands.gesture', 'pinch')
+    right.SetAttribute('SlicerHands.gesture', 'pinch')
+    self.assertTrue(grab.grabbing)
+    for step in range(1, 11):
+      right.GetMatrixTransformToParent().SetElement(0, 3, 100 - 10 * step)
+      right.GetMatrixTransformToParent().SetElement(1, 3, 20 * step)
+    slicer.app.processEvents()
+    self.assertEqual(grab.performedUpdates, 1)
+    # the hand line went from (100,0,0) to (0,200,0): twice as long, turned 90 degrees
+    m = grab.target.GetMatrixTransformToParent()
+    self.assertTrue(abs(m.GetElement(1, 0) - 2.) < 1e-6)
+    self.assertTrue(abs(m.GetElement(0, 0)) < 1e-6)
+    left.SetAttribute('SlicerHands.gesture', None)
+    self.assertFalse(grab.grabbing)
+    logic.cleanup()
+
+  def test_UndoHistory(self):
+    """Each pinch is one undo entry holding only what it changed;
+    swipes undo and redo it"""
+    logic = SlicerHandsLogic()
+    recorder = logic.recordHistory(capacity=2)
+    left,right = recorder.handTransforms
+    target = slicer.vtkMRMLLinearTransformNode()
+    slicer.mrmlScene.AddNode(target)
+    redLogic = slicer.app.layoutManager().sliceWidget('Red').sliceLogic()
+    redLogic.SetSliceOffset(0)
+    for step in (1, 2, 3):
+      left.SetAttribute('SlicerHands.gesture', 'pinch')
+      target.GetMatrixTransformToParent().SetElement(0, 3, 10. * step)
+      redLogic.SetSliceOffset(step)
+      left.SetAttribute('SlicerHands.gesture', None)
+      slicer.app.processEvents()
+    # a pinch that changes nothing is not an entry
+    left.SetAttribute('SlicerHands.gesture', 'pinch')
+    left.SetAttribute('SlicerHands.gesture', None)
+    slicer.app.processEvents()
+    statistics = logic.historyStatistics()
+    self.assertEqual((statistics['entries'], statistics['evicted'], statistics['unchanged']), (2, 1, 1))
+    self.assertEqual(statistics['statesPerEntry'], 2)
+    self.assertEqual(statistics['bytesPerEntry'], 2 * 17 * 8)
+    right.SetAttribute('SlicerHands.recognized', 'swipe-left')
+    right.SetAttribute('SlicerHands.recognized', None)
+    self.assertEqual(target.GetMatrixTransformToParent().GetElement(0, 3), 20.)
+    self.assertEqual(redLogic.GetSliceOffset(), 2)
+    self.assertTrue(logic.undo())
+    self.assertEqual(target.GetMatrixTransformToParent().GetElement(0, 3), 10.)
+    # only two entries fit
+    self.assertFalse(logic.undo())
+    right.SetAttribute('SlicerHands.recognized', 'swipe-right')
+    self.assertEqual(target.GetMatrixTransformToParent().GetElement(0, 3), 20.)
+    statistics = logic.historyStatistics()
+    self.assertEqual((statistics['undos'], statistics['redos']), (2, 1))
+    self.assertTrue(statistics['maxRestoreSeconds'] >= statistics['secondsPerRestore'])
+    logic.cleanup()
+
+  def test_RayPicking(self):
+    """Pointing rays pick the nearest visible model or segment; trees are
+    kept until the polydata changes and confidence has hysteresis"""
+    parser = handprotocol.HandParser()
+    parser.parseBuffer(b'POINT LEFT 1 2 3 0 0 -1 0.5\nPOINT RIGHT 4 5 6 0 0 -1 0.7\nPOINT LEFT 7 8 9 0 0 -1 0.9\n')
+    self.assertEqual(list(parser.points[0]), [7., 8., 9., 0., 0., -1., 0.9])
+    self.assertEqual(parser.points[1, 6], 0.7)
+    self.assertEqual(parser.pointCount, 2)
+    gate = raypicker.ConfidenceGate(0.8, 0.6)
+    self.assertEqual([gate.update(c) for c in (0.7, 0.85, 0.7, 0.5, 0.7)], [False, True, True, False, False])
+
+    slicer.mrmlScene.Clear(0)
+    logic = SlicerHandsLogic()
+    models = []
+    for z in (0., 50.):
+      sphere = vtk.vtkSphereSource()
+      sphere.SetRadius(10.)
+      sphere.SetCenter(0., 0., z)
+      sphere.Update()
+      models.append(cursorpool.addModel('Pickable', sphere.GetOutput(), (1, 0, 0)))
+    origin,down = (0., 0., 200.), (0., 0., -1.)
+    self.assertEqual(logic.updatePointing('Left', origin, down), models[1])
+    self.assertEqual(models[1].GetDisplayNode().GetSelected(), 1)
+    transform = logic.handCursor('Left')[0]
+    self.assertEqual(transform.GetAttribute('SlicerHands.picked'), models[1].GetID())
+    models[1].GetDisplayNode().SetVisibility(0)
+    self.assertEqual(logic.updatePointing('Left', origin, down), models[0])
+    self.assertEqual(models[1].GetDisplayNode().GetSelected(), 0)
+    # the scene is searched for models only when nodes come or go
+    scans = logic.pickNodeScans
+    for i in range(10):
+      logic.updatePointing('Left', origin, down)
+    self.assertEqual(logic.pickNodeScans, scans)
+    builds = logic.picker.buildCount
+    moved = slicer.vtkMRMLLinearTransformNode()
+    slicer.mrmlScene.AddNode(moved)
+    translation = numpy.identity(4)
+    translation[0, 3] = 100.
+    handsmrml.setTransformMatrix(moved, translation)
+    models[0].SetAndObserveTransformNodeID(moved.GetID())
+    self.assertEqual(logic.updatePointing('Left', origin, down), None)
+    self.assertEqual(transform.GetAttribute('SlicerHands.picked'), None)
+    self.assertEqual(logic.updatePointing('Left', (100., 0., 200.), down), models[0])
+    self.assertEqual(logic.picker.buildCount, builds)
+    self.assertEqual(logic.pickNodeScans, scans + 1)
+    models[0].GetPolyData().GetPoints().Modified()
+    self.assertEqual(logic.updatePointing('Left', (100., 0., 200.), down), models[0])
+    self.assertEqual(logic.picker.buildCount, builds + 1)
+    # segments are picked by their closed surface
+    sphere = vtk.vtkSphereSource()
+    sphere.SetRadius(10.)
+    sphere.SetCenter(100., 0., 100.)
+    sphere.Update()
+    segmentationNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode')
+    segmentationNode.CreateDefaultDisplayNodes()
+    segmentID = segmentationNode.AddSegmentFromClosedSurfaceRepresentation(sphere.GetOutput(), 'Ball', (0, 1, 0))
+    self.assertEqual(logic.updatePointing('Left', (100., 0., 200.), down), segmentationNode)
+    self.assertEqual(transform.GetAttribute('SlicerHands.picked'), segmentationNode.GetID())
+    self.assertEqual(transform.GetAttribute('SlicerHands.pickedSegment'), segmentID)
+    self.assertEqual(models[0].GetDisplayNode().GetSelected(), 0)
+    segmentationNode.GetDisplayNode().SetSegmentVisibility(segmentID, False)
+    self.assertEqual(logic.updatePointing('Left', (100., 0., 200.), down), models[0])
+    self.assertEqual(transform.GetAttribute('SlicerHands.pickedSegment'), None)
+    logic.setPicked('Left', None)
+    self.assertEqual(models[0].GetDisplayNode().GetSelected(), 0)
+    logic.cleanup()
+    self.delayDisplay('Picking: %.3f ms per query' % (1000. * logic.picker.statistics()['secondsPerQuery']))
+
+  def test_Benchmarks(self):
+    """The benchmark suite runs headless and writes JSON"""
+    import json
+    output = slicer.app.temporaryPath + '/SlicerHandsBenchmark.json'
+    handbenchmark.runBenchmarks(output, quick=True)
+    fp = open(output)
+    results = json.load(fp)
+    fp.close()
+    for key in ('parser', 'handleRead', 'applyPose', 'handCursor', 'cursorPool', 'manipulatorDispatch', 'gestures', 'picking'):
+      self.assertTrue(key in results)
+    self.assertTrue(results['handleRead']['latestWins']['messagesPerSecond'] > 0)
@@ -0,0 +1,203 @@
+import numpy
+
+#
+# Pooled cursor geometry
+#
+# Each cursor shape has one template source, shared by every pool.  A
+# pool draws any number of cursors of one shape as a single model node:
+# the cursor centers and 3x3 shape matrices live in NumPy arrays that VTK
+# reads without copying, and a vtkTensorGlyph puts a copy of the template
+# at each center.  Moving N cursors is then a write into the arrays and
+# one polydata modification instead of N transform and model updates.
+# LinePool does the same for line segments.
+#
+# vtk and slicer are imported on first use, as in handsmrml.
+#
+
+templates = {}
+
+def shapeTemplate(shape):
+  """The shared source for a cursor shape, made on first use:
+  'sphere' of unit diameter or 'cube' of unit side, both centered"""
+  try:
+    return templates[shape]
+  except KeyError:
+    pass
+  import vtk
+  if shape == 'sphere':
+    source = vtk.vtkSphereSource()
+    source.SetRadius(0.5)
+  elif shape == 'cube':
+    source = vtk.vtkCubeSource()
+  else:
+    raise ValueError('unknown cursor shape %s' % shape)
+  source.Update()
+  templates[shape] = source
+  return source
+
+def setInputData(algorithm,data):
+  if hasattr(algorithm, 'SetInputData'):
+    algorithm.SetInputData(data)
+  else:
+    algorithm.SetInput(data)
+
+def addModel(name,polyData,color,opacity=1.):
+  """Add a model node and its display node showing polyData"""
+  import slicer
+  modelNode = slicer.vtkMRMLModelNode()
+  modelNode.SetScene(slicer.mrmlScene)
+  modelNode.SetName(name)
+  modelNode.SetAndObservePolyData(polyData)
+  modelDisplay = slicer.vtkMRMLModelDisplayNode()
+  modelDisplay.SetColor(color)
+  modelDisplay.SetOpacity(opacity)
+  modelDisplay.SetScene(slicer.mrmlScene)
+  slicer.mrmlScene.AddNode(modelDisplay)
+  modelNode.SetAndObserveDisplayNodeID(modelDisplay.GetID())
+  modelDisplay.SetInputPolyData(polyData)
+  slicer.mrmlScene.AddNode(modelNode)
+  return modelNode
+
+
+class GeometryPool(object):
+  """Common part of the pools: a model node showing polydata that is
+  regenerated from NumPy arrays.  Write into the arrays, then call
+  update(), or modified() and later flush() to batch several writes."""
+
+  def __init__(self):
+    self.modelNode = None
+    self.pending = False
+    self.updateCount = 0
+
+  def output(self):
+    raise NotImplementedError
+
+  def addModel(self,name,color,opacity=1.):
+    self.modelNode = addModel(name, self.output(), color, opacity)
+
+  def inScene(self):
+    return bool(self.modelNode and self.modelNode.GetScene())
+
+  def modified(self):
+    self.pending = True
+
+  def flush(self):
+    if self.pending:
+      self.update()
+
+  def regenerate(self):
+    raise NotImplementedError
+
+  def update(self):
+    """Regenerate the polydata from the arrays, as one modification
+    of the model node"""
+    wasModifying = self.modelNode.StartModify() if self.modelNode else None
+    self.regenerate()
+    if self.modelNode:
+      self.modelNode.EndModify(wasModifying)
+    self.pending = False
+    self.updateCount += 1
+
+  def remove(self):
+    """Take the model and its display node out of the scene"""
+    if self.inScene():
+      scene = self.modelNode.GetScene()
+      displayNode = self.modelNode.GetDisplayNode()
+      if displayNode:
+        scene.RemoveNode(displayNode)
+      scene.RemoveNode(self.modelNode)
+
+
+class CursorPool(GeometryPool):
+  """count cursors of one shape drawn as one model node.
+  positions (count,3) are the cursor centers and shapes (count,3,3) the
+  linear part of each cursor's transform (scale and orientation), both
+  in the coordinates of the model's parent transform.  A cursor with an
+  all zero shape collapses to a point, which is how to hide it."""
+
+  def __init__(self,name,shape='sphere',count=1,color=(1,1,1),opacity=1.,scale=1.):
+    super(CursorPool,self).__init__()
+    import vtk
+    self.shape = shape
+    self.scale = scale
+    self.polyData = vtk.vtkPolyData()
+    self.glyph = vtk.vtkTensorGlyph()
+    self.glyph.SetSourceConnection(shapeTemplate(shape).GetOutputPort())
+    self.glyph.ExtractEigenvaluesOff()
+    self.glyph.ColorGlyphsOff()
+    self.glyph.ClampScalingOff()
+    setInputData(self.glyph, self.polyData)
+    self.setCount(count)
+    self.glyph.Update()
+    self.addModel(name, color, opacity)
+
+  def output(self):
+    return self.glyph.GetOutput()
+
+  def setCount(self,count):
+    """(Re)allocate the arrays for count cursors, all at the origin
+    with the pool's scale.  Existing cursor values are kept."""
+    import vtk
+    from vtk.util import numpy_support
+    positions = numpy.zeros((count, 3))
+    # vtkTensorGlyph reads each tensor column by column, so shapes is
+    # a transposed view of the buffer VTK sees
+    tensors = numpy.zeros((count, 3, 3))
+    shapes = tensors.transpose(0, 2, 1)
+    shapes[:] = self.scale * numpy.identity(3)
+    if hasattr(self, 'positions'):
+      kept = min(count, len(self.positions))
+      positions[:kept] = self.positions[:kept]
+      shapes[:kept] = self.shapes[:kept]
+    self.positions = positions
+    self.shapes = shapes
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(positions))
+    self.polyData.SetPoints(points)
+    tensorArray = numpy_support.numpy_to_vtk(tensors.reshape(count, 9))
+    tensorArray.SetName('Shapes')
+    self.polyData.GetPointData().SetTensors(tensorArray)
+    self.polyData.Modified()
+
+  def __len__(self):
+    return len(self.positions)
+
+  def regenerate(self):
+    self.polyData.Modified()
+    self.glyph.Update()
+
+
+class LinePool(GeometryPool):
+  """count line segments drawn as one model node.  segments is a
+  (count,2,3) array of end points, written in place."""
+
+  def __init__(self,name,count=1,color=(1,1,0),opacity=1.):
+    super(LinePool,self).__init__()
+    import vtk
+    from vtk.util import numpy_support
+    self.segments = numpy.zeros((count, 2, 3))
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(self.segments.reshape(2 * count, 3)))
+    # every cell is (2, start, end), built at once instead of per point
+    ids = vtk.vtkIdTypeArray()
+    ids.SetNumberOfValues(3 * count)
+    cells = numpy_support.vtk_to_numpy(ids).reshape(count, 3)
+    cells[:, 0] = 2
+    cells[:, 1] = numpy.arange(0, 2 * count, 2)
+    cells[:, 2] = cells[:, 1] + 1
+    lines = vtk.vtkCellArray()
+    lines.SetCells(count, ids)
+    self.polyData = vtk.vtkPolyData()
+    self.polyData.SetPoints(points)
+    self.polyData.SetLines(lines)
+    self.addModel(name, color, opacity)
+
+  def output(self):
+    return self.polyData
+
+  def __len__(self):
+    return len(self.segments)
+
+  def regenerate(self):
+    self.polyData.GetPoints().Modified()
+    self.polyData.Modified()
@@ -0,0 +1,228 @@
+import json
+import sys
+import time
+
+from handscore import handprotocol
+from handscore import handgestures
+
+#
+# Benchmarks for the SlicerHands interaction hot path
+#
+# Everything is driven from recorded or synthetic traffic through an
+# in-memory socket, so no network, camera or GPU is needed.  Run it in
+# Slicer without a main window, for example
+#
+#   Slicer --no-main-window --python-script handbenchmark.py --output results.json
+#
+# The results are written as JSON so runs can be compared over time.
+#
+
+class RecordedSocket(object):
+  """Just enough of qt.QTcpSocket for SlicerHandsLogic.handleRead,
+  serving a fixed burst of lines"""
+
+  class Bytes(object):
+    def __init__(self,data):
+      self.bytes = data
+    def data(self):
+      return self.bytes
+
+  def __init__(self,lines):
+    self.lines = [line + b'\n' for line in lines]
+    self.index = 0
+
+  def rewind(self):
+    self.index = 0
+
+  def canReadLine(self):
+    return self.index < len(self.lines)
+
+  def readLine(self):
+    line = self.lines[self.index]
+    self.index += 1
+    return self.Bytes(line)
+
+  def readAll(self):
+    data = b''.join(self.lines[self.index:])
+    self.index = len(self.lines)
+    return self.Bytes(data)
+
+
+def timeCalls(function,count):
+  """Mean seconds per call of function over count calls"""
+  start = time.time()
+  for index in range(count):
+    function()
+  return (time.time() - start) / count
+
+
+def benchmarkHandleRead(logic,lines,burst=100):
+  """Messages per second through handleRead in both reading modes,
+  with the driver sending bursts of the given number of lines"""
+  results = {}
+  bursts = [lines[start:start+burst] for start in range(0, len(lines), burst)]
+  for latestWins in (False, True):
+    logic.latestWins = latestWins
+    sockets = [RecordedSocket(chunk) for chunk in bursts]
+    start = time.time()
+    for socket in sockets:
+      logic.socket = socket
+      logic.handleRead()
+    elapsed = time.time() - start
+    results['latestWins' if latestWins else 'lineByLine'] = {
+        'messagesPerSecond': len(lines) / max(elapsed, 1e-9),
+        'burst': burst,
+        }
+  logic.socket = None
+  return results
+
+
+def benchmarkApplyPose(logic,frames=1000):
+  """Seconds per applyPose call with a new pose every frame, and with
+  a resting hand whose jitter the scheduler keeps out of the scene"""
+  poses = [b'POSE %d 2 3 0 0 0 1 0 4 %d 6 0 0 0 1 0' % (frame % 100, frame % 50) for frame in range(frames)]
+  results = {}
+  for filterPoses in (False, True):
+    logic.filterPoses = filterPoses
+    state = {'frame': 0}
+    def frame():
+      logic.parser.parseLine(poses[state['frame']])
+      logic.applyPose(None, None)
+      state['frame'] += 1
+    results['filtered' if filterPoses else 'unfiltered'] = {'secondsPerFrame': timeCalls(frame, frames)}
+  # a resting hand jitters inside the scheduler's dead-band, so only
+  # the first of these poses reaches the scene
+  jitter = [b'POSE %g 2 3 0 0 0 1 0 4 %g 6 0 0 0 1 0' % (0.1 * (frame % 3), 0.1 * (frame % 2)) for frame in range(frames)]
+  applied = logic.scheduler.appliedCount
+  state = {'frame': 0}
+  def restingFrame():
+    logic.parser.parseLine(jitter[state['frame']])
+    logic.applyPose(None, None)
+    state['frame'] += 1
+  results['resting'] = {
+      'secondsPerFrame': timeCalls(restingFrame, frames),
+      'appliedFrames': logic.scheduler.appliedCount - applied,
+      'idle': logic.scheduler.idle,
+      }
+  return results
+
+
+def benchmarkHandCursor(logicClass,sceneSizes=(0,100,1000),lookups=1000):
+  """Cost of handCursor with a warm cache and with a lookup by name
+  every call, as the number of other nodes in the scene grows"""
+  import slicer
+  results = []
+  for sceneSize in sceneSizes:
+    slicer.mrmlScene.Clear(0)
+    for index in range(sceneSize):
+      node = slicer.vtkMRMLModelNode()
+      node.SetName('Filler-%d' % index)
+      slicer.mrmlScene.AddNode(node)
+    logic = logicClass()
+    logic.handCursor('Left')
+    cached = timeCalls(lambda: logic.handCursor('Left'), lookups)
+    def uncached():
+      logic.nodeCache = {}
+      logic.handCursor('Left')
+    results.append({
+        'sceneNodes': slicer.mrmlScene.GetNumberOfNodes(),
+        'cachedSeconds': cached,
+        'uncachedSeconds': timeCalls(uncached, max(lookups // 10, 1)),
+        })
+    logic.cleanup()
+  slicer.mrmlScene.Clear(0)
+  return results
+
+
+def benchmarkCursorPool(counts=(2,22,100),frames=100):
+  """Seconds per frame to move N cursors drawn by one CursorPool, and
+  N transform nodes moved one by one as the per-hand cursors were"""
+  import numpy
+  import slicer
+  import cursorpool
+  results = []
+  for count in counts:
+    pool = cursorpool.CursorPool('Cursor-Benchmark', 'sphere', count, scale=10.)
+    positions = numpy.random.RandomState(count).uniform(-100, 100, (frames, count, 3))
+    state = {'frame': 0}
+    def poolFrame():
+      pool.positions[:] = positions[state['frame']]
+      pool.update()
+      state['frame'] += 1
+    pooled = timeCalls(poolFrame, frames)
+    pool.remove()
+    transforms = []
+    for index in range(count):
+      transform = slicer.vtkMRMLLinearTransformNode()
+      slicer.mrmlScene.AddNode(transform)
+      transforms.append(transform)
+    state['frame'] = 0
+    def nodeFrame():
+      for transform,p in zip(transforms, positions[state['frame']]):
+        wasModifying = transform.StartModify()
+        matrix = transform.GetMatrixTransformToParent()
+        for row in range(3):
+          matrix.SetElement(row, 3, p[row])
+        transform.EndModify(wasModifying)
+      state['frame'] += 1
+    perNode = timeCalls(nodeFrame, frames)
+    for transform in transforms:
+      slicer.mrmlScene.RemoveNode(transform)
+    results.append({
+        'cursors': count,
+        'pooledSecondsPerFrame': pooled,
+        'perNodeSecondsPerFrame': perNode,
+        })
+  return results
+
+
+def runBenchmarks(output=None,quick=False):
+  """Run the whole suite and return (and optionally write) the results"""
+  import slicer
+  import manipulator
+  import raypicker
+  import SlicerHands
+  scale = 10 if quick else 1
+  lines = handprotocol.sampleTraffic(20000 // scale)
+  slicer.mrmlScene.Clear(0)
+  logic = SlicerHands.SlicerHandsLogic()
+  results = {
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'python': sys.version.split()[0],
+      'quick': quick,
+      'parser': handprotocol.benchmarkParser(lines, repeat=3),
+      'handleRead': benchmarkHandleRead(logic, lines),
+      'applyPose': benchmarkApplyPose(logic, 1000 // scale),
+      'handCursor': benchmarkHandCursor(SlicerHands.SlicerHandsLogic,
+                                        (0, 100) if quick else (0, 100, 1000), 1000 // scale),
+      'cursorPool': benchmarkCursorPool((2, 22) if quick else (2, 22, 100), 100 // scale),
+      'manipulatorDispatch': manipulator.benchmarkDispatch(
+          (1, 10) if quick else (1, 10, 100), (1, 10) if quick else (1, 10, 100), 100 // scale),
+      'gestures': handgestures.benchmarkGestureEngine(20000 // scale),
+      'picking': raypicker.benchmarkPicking((1, 10) if quick else (1, 10, 100),
+                                            (16, 64) if quick else (16, 64, 256), 200 // scale),
+      }
+  logic.cleanup()
+  try:
+    results['slicerRevision'] = slicer.app.repositoryRevision
+  except AttributeError:
+    pass
+  if output:
+    fp = open(output, 'w')
+    json.dump(results, fp, indent=2, sort_keys=True)
+    fp.close()
+  return results
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Benchmark the SlicerHands hot path')
+  parser.add_argument('--output', default='SlicerHandsBenchmark.json')
+  parser.add_argument('--quick', action='store_true')
+  args = parser.parse_args()
+  runBenchmarks(args.output, args.quick)
+  try:
+    import slicer
+    slicer.app.exit(0)
+  except (ImportError, AttributeError):
+    pass
@@ -0,0 +1,22 @@
+#
+# handscore: the parts of SlicerHands that do not need Slicer
+#
+#   handprotocol    threegear protocol parser
+#   handreader      background socket reader thread
+#   handsources     input sources by name, and a UDP datagram source
+#   handbroker      one driver connection shared by several clients
+#   handdriver      launching and reconnecting to the driver process
+#   posefilter      smoothing and prediction of hand positions
+#   handgestures    gesture recognition on the pose stream
+#   handtransforms  camera / table / hand matrices as NumPy 4x4 arrays
+#   handrecording   recording and replay of driver traffic
+#   handsession     columnar sessions converted from recordings
+#   handlatency     per stage latency statistics
+#   handscheduler   frame cap, dead-band and idle mode for applying poses
+#   handhistory     undo/redo ring of what each gesture changed
+#
+# Only NumPy and the standard library are used, so everything here can
+# be imported and tested in a plain Python.  The submodules are not
+# imported here, so importing the package costs nothing until one of
+# them is used.  See handsmrml for the binding to MRML nodes.
+#
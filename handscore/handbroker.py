@@ -0,0 +1,429 @@
+import collections
+import os
+import select
+import socket
+import tempfile
+import threading
+import time
+
+import numpy
+
+from . import handprotocol
+from . import handreader
+
+#
+# Fan-out broker: one driver connection shared by several clients
+#
+# The driver only serves one client, so the broker holds that connection
+# and parses the stream once (it is a HandReader).  The newest pose goes
+# into a shared memory slot (SharedPose) that any number of local
+# processes read without talking to the broker, and gesture events are
+# broadcast over TCP.  Every subscriber has its own sender thread and
+# bounded queue, so a slow client only falls behind itself: its pending
+# pose is replaced by newer ones, the oldest of its events are dropped
+# (and counted) when its queue is full, and a client that stops reading
+# altogether is disconnected after sendTimeout.
+#
+# Two ports are served:
+#
+#   EVENT_PORT   gesture lines only; poses are read from the SharedPose
+#   STREAM_PORT  plain threegear protocol, the gesture lines and the
+#                newest POSE line, for clients that connect to the
+#                driver directly (SlicerHands with its port changed, a
+#                logger, HandRecorder...)
+#
+# Run it next to the driver with
+#
+#   python -m handscore.handbroker
+#
+
+STREAM_PORT = 1989
+EVENT_PORT = 1990
+
+# the shared slot: a sequence number that is odd while the broker is
+# writing, the pose bookkeeping, then the whole skeleton
+SHARED_POSE_DTYPE = numpy.dtype([
+    ('sequence', 'u8'),
+    ('poseCount', 'u8'),
+    ('poseTime', 'f8'),
+    ('readTime', 'f8'),
+    ('skeleton', handprotocol.SKELETON_DTYPE),
+    ])
+
+def defaultSharedPosePath():
+  directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+  return os.path.join(directory, 'SlicerHands-pose')
+
+
+class SharedPose(object):
+  """The newest pose in a memory mapped file, written by one process and
+  read by any number of others without locks: the writer makes the
+  sequence number odd, writes, and makes it even again, and a reader
+  that sees the number change (or odd) under it just reads again"""
+
+  def __init__(self,path=None,create=False):
+    self.path = path or defaultSharedPosePath()
+    self.created = create
+    self.slot = numpy.memmap(self.path, SHARED_POSE_DTYPE, 'w+' if create else 'r', shape=(1,))
+    self.sequence = self.slot['sequence']
+    self.writeCount = 0
+    self.retryCount = 0
+
+  def write(self,poseCount,poseTime,readTime,skeleton):
+    slot = self.slot
+    self.sequence += 1
+    slot['poseCount'] = poseCount
+    slot['poseTime'] = poseTime
+    slot['readTime'] = readTime
+    slot['skeleton'] = skeleton
+    self.sequence += 1
+    self.writeCount += 1
+
+  def read(self,skeleton,tries=100):
+    """Copy the newest pose into skeleton (a SKELETON_DTYPE record) and
+    return (poseCount, poseTime, readTime), or None if there is no pose
+    yet or no consistent copy could be made in the given tries"""
+    slot = self.slot
+    for attempt in range(tries):
+      sequence = int(self.sequence[0])
+      if not sequence & 1:
+        poseCount = int(slot['poseCount'][0])
+        poseTime = float(slot['poseTime'][0])
+        readTime = float(slot['readTime'][0])
+        skeleton[...] = slot['skeleton'][0]
+        if int(self.sequence[0]) == sequence:
+          return (poseCount, poseTime, readTime) if poseCount else None
+      self.retryCount += 1
+    return None
+
+  def close(self):
+    self.sequence = None
+    self.slot = None
+    if self.created and os.path.exists(self.path):
+      os.remove(self.path)
+
+
+class Subscriber(threading.Thread):
+  """One client of the broker, fed by its own sender thread"""
+
+  def __init__(self,connection,address,poses=True,maxEvents=256,sendTimeout=5.):
+    threading.Thread.__init__(self, name='HandBrokerSubscriber')
+    self.daemon = True
+    self.connection = connection
+    self.connection.settimeout(sendTimeout)
+    self.address = address
+    self.poses = poses
+    self.events = collections.deque(maxlen=maxEvents)
+    self.poseLine = None
+    self.poseLock = threading.Lock()
+    self.wake = threading.Event()
+    self.running = False
+    self.error = None
+    self.sentEventCount = 0
+    self.droppedEventCount = 0
+    self.sentPoseCount = 0
+    self.replacedPoseCount = 0
+
+  def start(self):
+    self.running = True
+    threading.Thread.start(self)
+
+  def stop(self,timeout=1.):
+    self.running = False
+    self.wake.set()
+    if self.is_alive():
+      self.join(timeout)
+
+  def publish(self,eventLines,poseLine):
+    """Queue a burst for this client (called by the broker thread)"""
+    for line in eventLines:
+      if len(self.events) == self.events.maxlen:
+        self.droppedEventCount += 1
+      self.events.append(line)
+    if poseLine is not None and self.poses:
+      with self.poseLock:
+        if self.poseLine is not None:
+          self.replacedPoseCount += 1
+        self.poseLine = poseLine
+    self.wake.set()
+
+  def run(self):
+    try:
+      while self.running:
+        self.wake.wait(0.1)
+        self.wake.clear()
+        lines = []
+        try:
+          while True:
+            lines.append(self.events.popleft())
+        except IndexError:
+          pass
+        self.sentEventCount += len(lines)
+        with self.poseLock:
+          poseLine,self.poseLine = self.poseLine,None
+        if poseLine is not None:
+          lines.append(poseLine)
+          self.sentPoseCount += 1
+        if lines:
+          self.connection.sendall(b'\n'.join(lines) + b'\n')
+    except (socket.error, socket.timeout) as e:
+      self.error = e
+    finally:
+      self.running = False
+      self.connection.close()
+
+  def statistics(self):
+    return {
+        'address': '%s:%d' % self.address[:2],
+        'poses': self.poses,
+        'sentEvents': self.sentEventCount,
+        'droppedEvents': self.droppedEventCount,
+        'sentPoses': self.sentPoseCount,
+        'replacedPoses': self.replacedPoseCount,
+        'error': str(self.error) if self.error else None,
+        }
+
+
+class HandBroker(handreader.HandReader):
+  """Share one driver connection between several clients.
+  start() binds the listening ports (0 picks free ones, see
+  self.streamPort and self.eventPort) before connecting upstream."""
+
+  def __init__(self,host='localhost',port=1988,listenHost='localhost',
+               streamPort=STREAM_PORT,eventPort=EVENT_PORT,sharedPosePath=None,
+               maxEvents=256,sendTimeout=5.):
+    handreader.HandReader.__init__(self, host, port, maxEvents)
+    self.name = 'HandBroker'
+    self.listenHost = listenHost
+    self.streamPort = streamPort
+    self.eventPort = eventPort
+    self.sharedPosePath = sharedPosePath
+    self.sendTimeout = sendTimeout
+    self.sharedPose = None
+    self.parser.eventLines = []
+    self.listeners = {}
+    self.subscribers = []
+    self.subscribersLock = threading.Lock()
+    self.serving = False
+    self.acceptThread = None
+    self.subscriberCount = 0
+    self.disconnectedCount = 0
+
+  def listen(self,port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((self.listenHost, port))
+    listener.listen(8)
+    return listener
+
+  def start(self):
+    self.sharedPose = SharedPose(self.sharedPosePath, create=True)
+    self.sharedPosePath = self.sharedPose.path
+    streamListener = self.listen(self.streamPort)
+    eventListener = self.listen(self.eventPort)
+    self.streamPort = streamListener.getsockname()[1]
+    self.eventPort = eventListener.getsockname()[1]
+    self.listeners = {streamListener: True, eventListener: False}
+    self.serving = True
+    self.acceptThread = threading.Thread(target=self.accept, name='HandBrokerAccept')
+    self.acceptThread.daemon = True
+    self.acceptThread.start()
+    handreader.HandReader.start(self)
+
+  def accept(self):
+    """Take on new subscribers until stopped"""
+    try:
+      while self.serving:
+        readable,writable,failed = select.select(list(self.listeners.keys()), [], [], 0.1)
+        for listener in readable:
+          connection,address = listener.accept()
+          subscriber = Subscriber(connection, address, self.listeners[listener],
+                                  self.events.maxlen, self.sendTimeout)
+          subscriber.start()
+          with self.subscribersLock:
+            self.subscribers.append(subscriber)
+          self.subscriberCount += 1
+    finally:
+      for listener in self.listeners:
+        listener.close()
+
+  def activeSubscribers(self):
+    """The connected subscribers, forgetting the ones that went away"""
+    with self.subscribersLock:
+      active = [subscriber for subscriber in self.subscribers if subscriber.running]
+      self.disconnectedCount += len(self.subscribers) - len(active)
+      self.subscribers = active
+    return active
+
+  def handleData(self,data):
+    """Parse one burst once and pass it on to every subscriber"""
+    self.readCount += 1
+    parser = self.parser
+    parser.readTime = time.time()
+    recorder = self.recorder
+    if recorder:
+      recorder.write(data)
+    poseCount = parser.poseCount
+    parser.parseBuffer(data)
+    parser.events.clear()
+    eventLines = parser.eventLines
+    parser.eventLines = []
+    poseLine = None
+    if parser.poseCount != poseCount:
+      parser.decodeJoints()
+      self.sharedPose.write(parser.poseCount, parser.poseTime, parser.poseReadTime, parser.skeleton)
+      poseLine = parser.poseLine
+    if eventLines or poseLine is not None:
+      for subscriber in self.activeSubscribers():
+        subscriber.publish(eventLines, poseLine)
+
+  def stop(self,timeout=1.):
+    handreader.HandReader.stop(self, timeout)
+    self.serving = False
+    if self.acceptThread:
+      self.acceptThread.join(timeout)
+    with self.subscribersLock:
+      subscribers,self.subscribers = self.subscribers,[]
+    for subscriber in subscribers:
+      subscriber.stop(timeout)
+    if self.sharedPose:
+      self.sharedPose.close()
+
+  def statistics(self):
+    return {
+        'reads': self.readCount,
+        'poses': self.parser.poseCount,
+        'droppedPoses': self.parser.droppedPoseCount,
+        'subscribers': self.subscriberCount,
+        'disconnected': self.disconnectedCount,
+        'sharedPoseRetries': self.sharedPose.retryCount if self.sharedPose else 0,
+        'clients': [subscriber.statistics() for subscriber in self.activeSubscribers()],
+        }
+
+
+class BrokerClient(threading.Thread):
+  """Read from a broker the way HandReader reads from the driver, so it
+  can stand in for one: latestPose comes from the shared memory slot
+  (read when asked, on the caller's thread) and the gesture events from
+  the broker's event port.  The slot is mapped once the broker has made
+  it; with no broker running the event port refuses the connection,
+  which ends the thread with error set, as for HandReader."""
+
+  def __init__(self,host='localhost',port=EVENT_PORT,sharedPosePath=None,maxEvents=256):
+    threading.Thread.__init__(self, name='BrokerClient')
+    self.daemon = True
+    self.host = host
+    self.port = port
+    self.sharedPosePath = sharedPosePath
+    self.sharedPose = None
+    self.sharedPoseError = None
+    self.parser = handprotocol.HandParser()
+    self.scratch = numpy.zeros((), handprotocol.SKELETON_DTYPE)
+    self.latest = None
+    self.skippedPoseCount = 0
+    self.events = collections.deque(maxlen=maxEvents)
+    self.overflowCount = 0
+    self.error = None
+    self.running = False
+    self.socket = None
+    self.recorder = None
+
+  def start(self):
+    self.openSharedPose()
+    self.running = True
+    threading.Thread.start(self)
+
+  def openSharedPose(self):
+    """Map the broker's shared pose if it exists yet; returns it or None"""
+    try:
+      self.sharedPose = SharedPose(self.sharedPosePath)
+      self.sharedPoseError = None
+    except (IOError, OSError, ValueError) as e:
+      # missing, or still empty if the broker is just starting
+      self.sharedPose = None
+      self.sharedPoseError = e
+    return self.sharedPose
+
+  def stop(self,timeout=1.):
+    self.running = False
+    if self.is_alive():
+      self.join(timeout)
+
+  def run(self):
+    try:
+      self.socket = socket.create_connection((self.host, self.port), 5.)
+      self.socket.settimeout(0.1)
+      while self.running:
+        try:
+          data = self.socket.recv(65536)
+        except socket.timeout:
+          continue
+        if not data:
+          break
+        self.parser.parseBuffer(data)
+        for event in self.parser.popEvents():
+          if len(self.events) == self.events.maxlen:
+            self.overflowCount += 1
+          self.events.append(event)
+    except Exception as e:
+      self.error = e
+    finally:
+      self.running = False
+      if self.socket:
+        self.socket.close()
+
+  def latestPose(self):
+    """Return (poseCount, poseTime, skeleton, readTime) for the newest
+    pose or None, like HandReader.latestPose"""
+    if self.sharedPose is None and not self.openSharedPose():
+      return self.latest
+    pose = self.sharedPose.read(self.scratch)
+    if pose is None:
+      return self.latest
+    poseCount,poseTime,readTime = pose
+    if not self.latest or poseCount != self.latest[0]:
+      if self.latest:
+        self.skippedPoseCount += max(poseCount - self.latest[0] - 1, 0)
+      self.latest = (poseCount, poseTime, self.scratch.copy(), readTime)
+    return self.latest
+
+  def latestPoints(self):
+    """The broker passes on poses and gestures only, so there are no
+    pointing rays for its clients"""
+    return None
+
+  def popEvents(self):
+    events = []
+    try:
+      while True:
+        events.append(self.events.popleft())
+    except IndexError:
+      pass
+    return events
+
+  def droppedPoseCount(self):
+    """Poses the broker published that this client never saw"""
+    return self.skippedPoseCount
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Share one hand driver connection between several clients')
+  parser.add_argument('--host', default='localhost', help='driver host')
+  parser.add_argument('--port', type=int, default=1988, help='driver port')
+  parser.add_argument('--stream-port', type=int, default=STREAM_PORT)
+  parser.add_argument('--event-port', type=int, default=EVENT_PORT)
+  parser.add_argument('--shared-pose', default=None, help='path of the shared pose slot')
+  args = parser.parse_args()
+  broker = HandBroker(args.host, args.port, streamPort=args.stream_port,
+                      eventPort=args.event_port, sharedPosePath=args.shared_pose)
+  broker.start()
+  try:
+    while broker.is_alive():
+      broker.join(5.)
+      print(broker.statistics())
+  except KeyboardInterrupt:
+    pass
+  broker.stop()
+  if broker.error:
+    print(broker.error)
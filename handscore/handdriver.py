@@ -0,0 +1,272 @@
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+#
+# Supervision of the hand driver process
+#
+# DriverSupervisor launches the driver without waiting for it and is
+# then stepped by poll(), from a timer on the GUI thread, so nothing
+# blocks for longer than one probe of the driver port:
+#
+#   stopped    not supervising (never started, or stop() was called)
+#   starting   driver launched (or expected), its port is not open yet
+#   ready      the port is open: the owner should connect and call connected()
+#   connected  the owner's connection is up
+#   waiting    the connection was lost; the port is probed again after a
+#              backoff that doubles per failed probe, up to maxBackoff
+#   exited     the driver process ended (relaunched if restartOnExit)
+#   failed     the port did not open within startupTimeout
+#
+# With no command the supervisor only waits for a driver started some
+# other way, and still reconnects.  The probe is a plain connect and
+# close, which the threegear driver treats like a client that left.
+#
+# Run as a script with --stub for a stand-in driver that serves sample
+# traffic on a port, one short session per client, so the whole
+# launch / connect / drop / reconnect cycle can be exercised:
+#
+#   python -m handscore.handdriver --stub --port 1988 --delay 0.5
+#
+# Inside Slicer sys.executable is the Slicer application, not a Python
+# interpreter, so stubCommand runs the stub with the PythonSlicer that
+# ships next to it.
+#
+
+STATES = ('stopped', 'starting', 'ready', 'connected', 'waiting', 'exited', 'failed')
+
+
+def splitCommand(command):
+  """A command line as an argument list; lists are passed through"""
+  if command is None or isinstance(command, (list, tuple)):
+    return command
+  return shlex.split(command, posix=(os.name != 'nt'))
+
+
+class DriverSupervisor(object):
+  """Launch the hand driver, tell when to connect and when to reconnect"""
+
+  def __init__(self,command=None,directory=None,host='localhost',port=1988,
+               startupTimeout=30.,probeTimeout=0.05,backoff=0.25,maxBackoff=8.,
+               restartOnExit=False,logPath=None):
+    self.command = splitCommand(command)
+    self.directory = directory
+    self.host = host
+    self.port = port
+    self.startupTimeout = startupTimeout
+    self.probeTimeout = probeTimeout
+    self.initialBackoff = backoff
+    self.maxBackoff = maxBackoff
+    self.restartOnExit = restartOnExit
+    self.logPath = logPath
+    self.process = None
+    self.log = None
+    self.state = 'stopped'
+    self.backoff = backoff
+    self.nextProbe = 0.
+    self.launchTime = None
+    self.startupSeconds = None
+    self.launchCount = 0
+    self.probeCount = 0
+    self.connectCount = 0
+    self.reconnectCount = 0
+    self.disconnectCount = 0
+    self.exitCode = None
+    self.error = None
+
+  def start(self,now=None):
+    """Launch the driver (if there is a command) and start probing"""
+    if now is None:
+      now = time.time()
+    self.launch(now)
+    self.state = 'starting'
+    self.nextProbe = now
+
+  def launch(self,now):
+    self.launchTime = now
+    self.startupSeconds = None
+    self.exitCode = None
+    if not self.command:
+      return
+    if self.logPath:
+      self.log = open(self.logPath, 'ab')
+    else:
+      self.log = open(os.devnull, 'wb')
+    try:
+      self.process = subprocess.Popen(self.command, cwd=self.directory,
+                                      stdout=self.log, stderr=subprocess.STDOUT)
+    except OSError as e:
+      self.error = e
+      self.process = None
+      self.closeLog()
+      raise
+    self.launchCount += 1
+
+  def closeLog(self):
+    if self.log:
+      self.log.close()
+      self.log = None
+
+  def running(self):
+    """True while the launched driver is alive (always with no command)"""
+    if not self.command:
+      return True
+    return bool(self.process) and self.process.poll() is None
+
+  def probe(self):
+    """Is anything accepting connections on the driver port"""
+    self.probeCount += 1
+    try:
+      connection = socket.create_connection((self.host, self.port), self.probeTimeout)
+    except socket.error:
+      return False
+    connection.close()
+    return True
+
+  def poll(self,now=None):
+    """Advance the state machine and return the state"""
+    if now is None:
+      now = time.time()
+    state = self.state
+    if state == 'stopped':
+      return state
+    if self.command and not self.running() and state != 'exited':
+      self.exitCode = self.process.poll() if self.process else None
+      self.state = 'exited'
+      if self.restartOnExit:
+        self.start(now)
+      return self.state
+    if state == 'starting':
+      if now >= self.nextProbe:
+        if self.probe():
+          self.startupSeconds = now - self.launchTime
+          self.state = 'ready'
+        elif now - self.launchTime > self.startupTimeout:
+          self.state = 'failed'
+        else:
+          self.nextProbe = now + self.initialBackoff
+    elif state == 'waiting':
+      if now >= self.nextProbe:
+        if self.probe():
+          self.state = 'ready'
+        else:
+          self.backoff = min(2. * self.backoff, self.maxBackoff)
+          self.nextProbe = now + self.backoff
+    return self.state
+
+  def connected(self):
+    """The owner connected after poll() said 'ready'"""
+    if self.connectCount:
+      self.reconnectCount += 1
+    self.connectCount += 1
+    self.backoff = self.initialBackoff
+    self.state = 'connected'
+
+  def disconnected(self,now=None):
+    """The owner lost its connection: probe again after the backoff"""
+    if now is None:
+      now = time.time()
+    self.disconnectCount += 1
+    if self.state in ('stopped', 'exited'):
+      return
+    self.state = 'waiting'
+    self.nextProbe = now + self.backoff
+
+  def stop(self,terminate=True,timeout=2.):
+    """Stop supervising and, unless terminate is False, end the driver
+    this supervisor launched"""
+    self.state = 'stopped'
+    process = self.process
+    if terminate and process and process.poll() is None:
+      process.terminate()
+      deadline = time.time() + timeout
+      while process.poll() is None and time.time() < deadline:
+        time.sleep(0.02)
+      if process.poll() is None:
+        process.kill()
+        process.wait()
+      self.exitCode = process.returncode
+    if terminate:
+      self.process = None
+      self.closeLog()
+
+  def statistics(self):
+    return {
+        'state': self.state,
+        'startupSeconds': self.startupSeconds,
+        'launches': self.launchCount,
+        'probes': self.probeCount,
+        'connects': self.connectCount,
+        'reconnects': self.reconnectCount,
+        'disconnects': self.disconnectCount,
+        'backoff': self.backoff,
+        'exitCode': self.exitCode,
+        }
+
+
+def pythonExecutable():
+  """A Python interpreter for child processes: PythonSlicer when
+  running inside Slicer, otherwise the current interpreter"""
+  name = os.path.basename(sys.executable).lower()
+  if name.startswith('python'):
+    return sys.executable
+  for candidate in ('PythonSlicer.exe', 'PythonSlicer'):
+    path = os.path.join(os.path.dirname(sys.executable), candidate)
+    if os.path.isfile(path):
+      return path
+  return shutil.which('PythonSlicer') or sys.executable
+
+
+def stubCommand(port,delay=0.,poses=60):
+  """Command line that runs the stub driver, from the directory
+  that holds handscore"""
+  return [pythonExecutable(), '-m', 'handscore.handdriver', '--stub',
+          '--port', str(port), '--delay', str(delay), '--poses', str(poses)]
+
+
+def runStub(port,delay=0.,poses=60,rate=60.):
+  """Stand-in driver: after delay seconds serve poses of sample traffic
+  at rate to each client, then drop it"""
+  from . import handprotocol
+  from . import handrecording
+  time.sleep(delay)
+  lines = [line for line in handprotocol.sampleTraffic(2 * poses) if line.startswith(b'POSE')][:poses]
+  server = handrecording.HandReplayServer(handrecording.recordsFromLines(lines, rate), port=port)
+  server.start()
+  try:
+    while server.is_alive():
+      server.join(0.5)
+  except KeyboardInterrupt:
+    server.stop()
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Supervise the hand driver, or stand in for it')
+  parser.add_argument('command', nargs='*', help='driver command line')
+  parser.add_argument('--port', type=int, default=1988)
+  parser.add_argument('--stub', action='store_true', help='be a stub driver instead')
+  parser.add_argument('--delay', type=float, default=0., help='stub: seconds before listening')
+  parser.add_argument('--poses', type=int, default=60, help='stub: poses per client before dropping it')
+  args = parser.parse_args()
+  if args.stub:
+    runStub(args.port, args.delay, args.poses)
+  else:
+    supervisor = DriverSupervisor(args.command or None, port=args.port)
+    supervisor.start()
+    state = None
+    try:
+      while True:
+        if supervisor.poll() != state:
+          state = supervisor.state
+          print('%s %s' % (state, supervisor.statistics()))
+        if state == 'ready':
+          # nothing to connect here, so just report it
+          supervisor.connected()
+        time.sleep(0.1)
+    except KeyboardInterrupt:
+      supervisor.stop()
@@ -0,0 +1,229 @@
+import math
+import time
+
+import numpy
+
+from . import posefilter
+
+#
+# Gesture recognition over a sliding window of hand positions
+#
+# The engine keeps its own ring buffer of the last `window` samples and
+# running sums of the positions and their squares, updated by adding
+# the new sample and subtracting the one that falls out of the window,
+# so each sample costs the same no matter how long the window is.
+#
+#   dwell       a hand has stayed within dwellRadius (RMS, mm) for the
+#               whole window, which spans at least dwellTime seconds
+#   swipe-*     over the last swipeSamples samples a hand moved faster
+#               than swipeSpeed (mm/s), mostly along one axis
+#               (left/right, down/up, out/in)
+#   zoom        both hands pinched and their distance has changed by
+#               more than zoomThreshold (value is the scale factor)
+#   rotate      both hands pinched and the line between them has turned
+#               about the vertical axis by more than rotateThreshold
+#               (value is the angle in degrees)
+#
+# Recognized gestures are returned as (name, hand, value) tuples; hand
+# is 'Left', 'Right' or 'Both'.
+#
+# One sample can give a hand more than one gesture, for example a dwell
+# and, with both hands pinched, a zoom.  Where only one can be shown per
+# hand, the one earliest in GESTURE_PRIORITY wins (see winningGestures):
+# the two handed gestures, which need both hands pinched, then swipes,
+# then dwell.
+#
+
+HANDS = ('Left', 'Right')
+
+SWIPE_NAMES = (('swipe-left', 'swipe-right'), ('swipe-down', 'swipe-up'), ('swipe-out', 'swipe-in'))
+
+GESTURE_PRIORITY = ('zoom', 'rotate') + sum(SWIPE_NAMES, ()) + ('dwell',)
+
+
+def winningGestures(gestures):
+  """The gesture that wins for each hand by GESTURE_PRIORITY, as a dict
+  of hand: (name, value); a 'Both' gesture counts for each hand.  Of
+  gestures with the same priority the first one wins."""
+  ranks = {}
+  winners = {}
+  for name,hand,value in gestures:
+    rank = GESTURE_PRIORITY.index(name) if name in GESTURE_PRIORITY else len(GESTURE_PRIORITY)
+    for whichHand in (HANDS if hand == 'Both' else (hand,)):
+      if rank < ranks.get(whichHand, len(GESTURE_PRIORITY) + 1):
+        ranks[whichHand] = rank
+        winners[whichHand] = (name, value)
+  return winners
+
+
+class GestureEngine(object):
+  """Incremental recognizer of one and two hand gestures"""
+
+  def __init__(self,window=60,dwellTime=0.8,dwellRadius=5.,swipeSamples=10,swipeSpeed=800.,
+               swipeStraightness=0.8,zoomThreshold=0.1,rotateThreshold=10.,refractoryTime=0.5):
+    self.window = window
+    self.dwellTime = dwellTime
+    self.dwellRadius = dwellRadius
+    self.swipeSamples = min(swipeSamples, window - 1)
+    self.swipeSpeed = swipeSpeed
+    self.swipeStraightness = swipeStraightness
+    self.zoomThreshold = zoomThreshold
+    self.rotateThreshold = rotateThreshold
+    self.refractoryTime = refractoryTime
+    self.samples = posefilter.PoseRingBuffer(window)
+    self.sums = numpy.zeros((2, 3))
+    self.squareSums = numpy.zeros((2, 3))
+    self.pinched = [False, False]
+    self.twoHandStart = None
+    self.dwelling = [False, False]
+    self.quietUntil = [0., 0.]
+    self.sampleCount = 0
+
+  def reset(self):
+    self.samples.clear()
+    self.sums[:] = 0
+    self.squareSums[:] = 0
+    self.pinched = [False, False]
+    self.twoHandStart = None
+    self.dwelling = [False, False]
+    self.quietUntil = [0., 0.]
+
+  def setPinch(self,hand,pinched):
+    """Feed the driver's PRESSED/RELEASED state for a hand ('Left'/'Right')"""
+    self.pinched[HANDS.index(hand)] = pinched
+    if not all(self.pinched):
+      self.twoHandStart = None
+
+  def update(self,t,positions):
+    """Add a (2,3) positions sample taken at time t and return
+    the gestures recognized with it"""
+    self.sampleCount += 1
+    samples = self.samples
+    if samples.count == samples.capacity:
+      evicted = samples.positions[samples.head]
+      self.sums -= evicted
+      self.squareSums -= evicted * evicted
+    samples.append(t, positions)
+    self.sums += positions
+    self.squareSums += positions * positions
+    if self.sampleCount % 10000 == 0:
+      # start the running sums afresh now and then so rounding cannot build up
+      stored = samples.positions[:samples.count]
+      self.sums[:] = stored.sum(axis=0)
+      self.squareSums[:] = (stored * stored).sum(axis=0)
+
+    gestures = []
+    if samples.count == samples.capacity:
+      oldest = samples.index(samples.count - 1)
+      self.recognizeDwell(t, t - samples.times[oldest], gestures)
+    if samples.count > self.swipeSamples:
+      older = samples.index(self.swipeSamples)
+      self.recognizeSwipes(t, t - samples.times[older], positions - samples.positions[older], gestures)
+    if all(self.pinched):
+      self.recognizeTwoHanded(positions, gestures)
+    return gestures
+
+  def recognizeDwell(self,t,span,gestures):
+    count = float(self.samples.count)
+    means = self.sums / count
+    variances = (self.squareSums / count - means * means).sum(axis=1)
+    for hand in (0, 1):
+      still = span >= self.dwellTime and variances[hand] < self.dwellRadius ** 2
+      if still and not self.dwelling[hand]:
+        gestures.append(('dwell', HANDS[hand], span))
+      self.dwelling[hand] = still
+
+  def recognizeSwipes(self,t,span,displacements,gestures):
+    if span <= 0:
+      return
+    for hand in (0, 1):
+      if t < self.quietUntil[hand]:
+        continue
+      displacement = displacements[hand]
+      distance = math.sqrt((displacement * displacement).sum())
+      if distance / span < self.swipeSpeed:
+        continue
+      axis = int(numpy.abs(displacement).argmax())
+      if abs(displacement[axis]) < self.swipeStraightness * distance:
+        continue
+      name = SWIPE_NAMES[axis][int(displacement[axis] > 0)]
+      gestures.append((name, HANDS[hand], distance / span))
+      self.quietUntil[hand] = t + self.refractoryTime
+
+  def recognizeTwoHanded(self,positions,gestures):
+    between = positions[1] - positions[0]
+    distance = math.sqrt((between * between).sum())
+    angle = math.degrees(math.atan2(between[2], between[0]))
+    if self.twoHandStart is None:
+      self.twoHandStart = (distance, angle)
+      return
+    startDistance,startAngle = self.twoHandStart
+    if startDistance > 0:
+      scale = distance / startDistance
+      if abs(scale - 1.) > self.zoomThreshold:
+        gestures.append(('zoom', 'Both', scale))
+    turn = (angle - startAngle + 180.) % 360. - 180.
+    if abs(turn) > self.rotateThreshold:
+      gestures.append(('rotate', 'Both', turn))
+
+
+#
+# Offline evaluation and throughput
+#
+
+def recognize(engine,times,positions,pinches=(),onsetsOnly=True):
+  """Run the engine over recorded samples.
+  pinches is a list of (time, hand, pinched) changes in time order.
+  Zoom and rotate are reported on every sample while they last; with
+  onsetsOnly only the first sample of each run is kept.
+  Returns a list of (time, name, hand, value)"""
+  engine.reset()
+  recognized = []
+  previous = set()
+  pinchIndex = 0
+  for index in range(len(times)):
+    t = times[index]
+    while pinchIndex < len(pinches) and pinches[pinchIndex][0] <= t:
+      engine.setPinch(pinches[pinchIndex][1], pinches[pinchIndex][2])
+      pinchIndex += 1
+    current = set()
+    for name,hand,value in engine.update(t, positions[index]):
+      current.add((name, hand))
+      if not onsetsOnly or (name, hand) not in previous:
+        recognized.append((t, name, hand, value))
+    previous = current
+  return recognized
+
+def evaluateRecognizer(engine,times,positions,labels,pinches=()):
+  """Precision and recall against labelled (start, stop, name) intervals.
+  A recognized gesture is a true positive if it falls inside an interval
+  with the same name that has not been matched yet."""
+  recognized = recognize(engine, times, positions, pinches)
+  matched = [False] * len(labels)
+  truePositives = 0
+  for t,name,hand,value in recognized:
+    for index,(start,stop,label) in enumerate(labels):
+      if not matched[index] and label == name and start <= t <= stop:
+        matched[index] = True
+        truePositives += 1
+        break
+  return {
+      'recognized': len(recognized),
+      'labels': len(labels),
+      'precision': truePositives / float(len(recognized)) if recognized else 1.,
+      'recall': sum(matched) / float(len(labels)) if labels else 1.,
+      }
+
+def benchmarkGestureEngine(samples=20000,rate=60.):
+  """Samples per second through the engine for a random walk"""
+  random = numpy.random.RandomState(1988)
+  positions = numpy.cumsum(random.normal(0, 2, (samples, 2, 3)), axis=0)
+  times = numpy.arange(samples) / rate
+  engine = GestureEngine()
+  engine.setPinch('Left', True)
+  engine.setPinch('Right', True)
+  start = time.time()
+  for index in range(samples):
+    engine.update(times[index], positions[index])
+  elapsed = time.time() - start
+  return {'samples': samples, 'samplesPerSecond': samples / max(elapsed, 1e-9)}
@@ -0,0 +1,165 @@
+import time
+
+import numpy
+
+#
+# Undo and redo of hand manipulations
+#
+# Hands move slices and transforms many times a second, so rather than
+# snapshots of the scene the history keeps one entry per gesture: the
+# values that differ between the press that started it and the release
+# that ended it.  A state is a key (anything hashable, such as a node
+# ID) and a flat array of values, 16 for a 4x4 matrix or 1 for a slice
+# offset; states that did not change are not stored.
+#
+# Entries live in a ring of capacity entries over two preallocated
+# (capacity, maxValues) arrays of values before and after, so memory is
+# fixed however long the session.  When the ring is full the oldest
+# entry is overwritten; recording after an undo drops the entries that
+# could have been redone, as in any editor.  An entry with more than
+# maxValues values is not kept (counted as oversized) rather than kept
+# in part, since undoing part of a gesture would leave a view that never
+# existed.
+#
+# undo and redo hand each stored state to an apply(key, values)
+# callback and time the whole restore.
+#
+
+class ManipulationHistory(object):
+  """Fixed memory undo/redo ring of gesture deltas"""
+
+  def __init__(self,capacity=64,maxValues=256):
+    self.capacity = capacity
+    self.maxValues = maxValues
+    self.before = numpy.zeros((capacity, maxValues))
+    self.after = numpy.zeros((capacity, maxValues))
+    # per entry a tuple of (key, start, size) into its row of values
+    self.items = [None] * capacity
+    self.sizes = numpy.zeros(capacity, dtype=int)
+    self.started = None
+    self.clear()
+
+  def clear(self):
+    self.first = 0
+    self.count = 0
+    # entries before position can be undone, the rest redone
+    self.position = 0
+    self.started = None
+    self.recordedCount = 0
+    self.unchangedCount = 0
+    self.evictedCount = 0
+    self.oversizedCount = 0
+    self.undoCount = 0
+    self.redoCount = 0
+    self.restoreSeconds = 0.
+    self.maxRestoreSeconds = 0.
+
+  def begin(self,states):
+    """States (key, values) at the start of a gesture"""
+    self.started = dict([(key, numpy.array(values, dtype=float).ravel()) for key,values in states])
+
+  def end(self,states):
+    """States at the end of the gesture: record the ones that changed
+    since begin.  Returns True if an entry was recorded."""
+    started = self.started
+    self.started = None
+    if started is None:
+      return False
+    changed = []
+    for key,values in states:
+      before = started.get(key)
+      if before is None:
+        continue
+      values = numpy.ravel(values)
+      if values.shape != before.shape or (values != before).any():
+        changed.append((key, before, values))
+    if not changed:
+      self.unchangedCount += 1
+      return False
+    if sum([before.size for key,before,values in changed]) > self.maxValues:
+      self.oversizedCount += 1
+      return False
+    self.push(changed)
+    return True
+
+  def push(self,changed):
+    """Store (key, before, after) states as the newest entry, dropping
+    what could be redone and, when full, the oldest entry"""
+    self.count = self.position
+    if self.count == self.capacity:
+      self.first = (self.first + 1) % self.capacity
+      self.count -= 1
+      self.evictedCount += 1
+    index = (self.first + self.count) % self.capacity
+    items = []
+    start = 0
+    for key,before,after in changed:
+      size = before.size
+      self.before[index, start:start+size] = before
+      self.after[index, start:start+size] = after
+      items.append((key, start, size))
+      start += size
+    self.items[index] = tuple(items)
+    self.sizes[index] = start
+    self.count += 1
+    self.position = self.count
+    self.recordedCount += 1
+
+  def canUndo(self):
+    return self.position > 0
+
+  def canRedo(self):
+    return self.position < self.count
+
+  def undo(self,apply):
+    """Put back the states from before the last recorded gesture.
+    Returns False if there is nothing to undo."""
+    if not self.canUndo():
+      return False
+    self.position -= 1
+    self.restore(self.before, (self.first + self.position) % self.capacity, apply)
+    self.undoCount += 1
+    return True
+
+  def redo(self,apply):
+    """Apply again the gesture that was undone last.
+    Returns False if there is nothing to redo."""
+    if not self.canRedo():
+      return False
+    self.restore(self.after, (self.first + self.position) % self.capacity, apply)
+    self.position += 1
+    self.redoCount += 1
+    return True
+
+  def restore(self,values,index,apply):
+    start = time.time()
+    row = values[index]
+    for key,offset,size in self.items[index]:
+      apply(key, row[offset:offset+size])
+    elapsed = time.time() - start
+    self.restoreSeconds += elapsed
+    self.maxRestoreSeconds = max(self.maxRestoreSeconds, elapsed)
+
+  def entryBytes(self,index):
+    """Bytes of values (before and after) the entry at index uses"""
+    return 2 * self.sizes[index] * self.before.itemsize
+
+  def statistics(self):
+    live = [(self.first + offset) % self.capacity for offset in range(self.count)]
+    restores = self.undoCount + self.redoCount
+    return {
+        'entries': self.count,
+        'undoable': self.position,
+        'capacity': self.capacity,
+        'recorded': self.recordedCount,
+        'unchanged': self.unchangedCount,
+        'evicted': self.evictedCount,
+        'oversized': self.oversizedCount,
+        'reservedBytes': self.before.nbytes + self.after.nbytes,
+        'bytesPerEntry': float(sum([self.entryBytes(index) for index in live])) / len(live) if live else 0.,
+        'statesPerEntry': float(sum([len(self.items[index]) for index in live])) / len(live) if live else 0.,
+        'undos': self.undoCount,
+        'redos': self.redoCount,
+        'secondsPerRestore': self.restoreSeconds / restores if restores else 0.,
+        'maxRestoreSeconds': self.maxRestoreSeconds,
+        }
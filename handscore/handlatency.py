@@ -0,0 +1,75 @@
+import numpy
+
+#
+# Latency instrumentation for the hand -> scene -> render pipeline
+#
+# Each applied pose is timed through these stages:
+#
+#   read        socket data in hand to the pose being decoded
+#   wait        decoded to applyPose picking it up on the frame timer
+#   apply       writing the transforms, including the observer cascades
+#               (Manipulator.onNodeModified, SliceJumper.onTransform, ...)
+#   manipulate  the work manipulators coalesced from those cascades
+#               (SliceJumper.flushJump, TwoHandedManipulator.flushUpdate)
+#   render      end of applyPose to the end of the next render
+#   total       socket data in hand to the end of that render
+#
+# The monitor is off by default; callers check self.enabled before
+# taking any timestamps, so the cost when off is one attribute lookup.
+# Other parts of the pipeline can keep their own stages, see handsources.
+#
+
+STAGES = ('read', 'wait', 'apply', 'manipulate', 'render', 'total')
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyMonitor(object):
+  """Rolling window of the most recent stage times (seconds)"""
+
+  def __init__(self,capacity=1024,stages=STAGES):
+    self.enabled = False
+    self.capacity = capacity
+    self.stages = stages
+    self.samples = {}
+    self.counts = {}
+    for stage in stages:
+      self.samples[stage] = numpy.zeros(capacity)
+      self.counts[stage] = 0
+
+  def reset(self):
+    for stage in self.stages:
+      self.counts[stage] = 0
+
+  def record(self,stage,seconds):
+    count = self.counts[stage]
+    self.samples[stage][count % self.capacity] = seconds
+    self.counts[stage] = count + 1
+
+  def stageStatistics(self,stage):
+    """Sample count and p50/p95/p99 in milliseconds for one stage"""
+    count = self.counts[stage]
+    result = {'count': count}
+    if count:
+      window = self.samples[stage][:min(count, self.capacity)]
+      values = numpy.percentile(window, PERCENTILES) * 1000.
+      for percentile,value in zip(PERCENTILES, values):
+        result['p%d' % percentile] = float(value)
+    return result
+
+  def statistics(self):
+    result = {}
+    for stage in self.stages:
+      result[stage] = self.stageStatistics(stage)
+    return result
+
+  def summary(self):
+    """One line readout of the p50/p95 of each stage"""
+    parts = []
+    for stage in self.stages:
+      statistics = self.stageStatistics(stage)
+      if statistics['count']:
+        parts.append('%s %.1f/%.1f' % (stage, statistics['p50'], statistics['p95']))
+    if not parts:
+      return 'Hand latency: no samples'
+    return 'Hand latency ms (p50/p95): ' + ', '.join(parts)
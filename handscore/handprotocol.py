@@ -0,0 +1,353 @@
+import collections
+import time
+
+import numpy
+
+#
+# Parser for the threegear hand driver text protocol
+#
+# Each message is one line of whitespace separated fields, the first of
+# which is the message type.  Only the message types we act on have
+# handlers; everything else is counted and skipped without splitting
+# the rest of the line.  A line of a handled type that is short or has
+# fields that are not numbers is counted in malformedCount and leaves
+# the buffers as they were.
+#
+
+# fields per hand at the start of a POSE message:
+#  position (3), orientation quaternion (4), click count (1)
+POSE_HAND_FIELDS = 8
+POSE_FIELDS = 2 * POSE_HAND_FIELDS
+
+# after the hand fields a POSE carries the skeleton of both hands: for
+# each hand in turn the joint frames as orientation quaternion (4) and
+# position (3), and then for each hand in turn the fingertip positions
+JOINTS = 17
+FINGERTIPS = 5
+JOINT_FIELDS = 7
+
+# the whole POSE record in stream order, so a line is decoded straight
+# into it.  hasJoints is 1 when the latest pose carried the skeleton; it
+# is kept as a float so the record stays one flat float64 array.
+SKELETON_DTYPE = numpy.dtype([
+    ('hands', 'f8', (2, POSE_HAND_FIELDS)),
+    ('joints', 'f8', (2, JOINTS, JOINT_FIELDS)),
+    ('fingertips', 'f8', (2, FINGERTIPS, 3)),
+    ('hasJoints', 'f8'),
+    ])
+SKELETON_FIELDS = SKELETON_DTYPE.itemsize // 8 - 1
+
+HANDS = ('Left', 'Right')
+HAND_NAMES = {b'LEFT': 'Left', b'RIGHT': 'Right', b'Left': 'Left', b'Right': 'Right'}
+
+GESTURE_EVENTS = ('PRESSED', 'RELEASED', 'DRAGGED')
+
+# fields per hand of a POINT message after the hand name:
+#  ray origin (3), ray direction (3), confidence (1)
+POINT_FIELDS = 7
+
+
+class HandParser(object):
+  """Parse lines of the hand driver protocol into preallocated buffers.
+
+  The latest pose is kept in self.skeleton, a SKELETON_DTYPE record that
+  is overwritten in place.  self.pose is its (2,8) hand part (row 0 is the
+  left hand, row 1 the right), and self.positions, self.orientations,
+  self.jointPositions, self.jointOrientations and self.fingertips are
+  views into it too, so callers can hold on to them and read them without
+  copying.  The joints are decoded on demand by decodeJoints; with
+  parseJoints off they are never decoded.
+  Gesture events are appended to self.events as (messageType, hand) tuples
+  for the caller to drain.  For callers that pass the stream on (see
+  handbroker) the newest POSE line is kept in self.poseLine, and the
+  gesture lines are appended to self.eventLines when it is a list.
+  The newest POINT ray of each hand is kept in self.points (2,7), one row
+  per hand as origin, direction and confidence, with the time it arrived
+  in self.pointTimes.
+  """
+
+  def __init__(self):
+    self.skeletonBuffer = numpy.zeros(SKELETON_FIELDS + 1)
+    self.skeleton = self.skeletonBuffer.view(SKELETON_DTYPE).reshape(())
+    self.poseBuffer = self.skeletonBuffer[:POSE_FIELDS]
+    self.pose = self.skeleton['hands']
+    self.positions = self.pose[:, 0:3]
+    self.orientations = self.pose[:, 3:7]
+    self.jointOrientations = self.skeleton['joints'][:, :, 0:4]
+    self.jointPositions = self.skeleton['joints'][:, :, 4:7]
+    self.fingertips = self.skeleton['fingertips']
+    self.parseJoints = True
+    self.jointData = None
+    self.skeletonCount = 0
+    self.poseLine = None
+    self.eventLines = None
+    self.points = numpy.zeros((len(HANDS), POINT_FIELDS))
+    self.pointTimes = numpy.zeros(len(HANDS))
+    self.pointCount = 0
+    self.poseCount = 0
+    self.poseTime = 0.
+    # callers may set readTime when data arrives, it is kept with each pose
+    self.readTime = 0.
+    self.poseReadTime = 0.
+    self.events = collections.deque()
+    self.messageCount = 0
+    self.skippedCount = 0
+    self.malformedCount = 0
+    self.droppedPoseCount = 0
+    # lines are decoded here first so a bad field cannot leave half a pose
+    self.scratch = numpy.zeros(max(POSE_FIELDS, POINT_FIELDS))
+    self.pending = b''
+    self.gestureTypes = [messageType.encode('ascii') for messageType in GESTURE_EVENTS]
+    self.handlers = {
+        b'POSE': ('POSE', self.parsePose),
+        b'PRESSED': ('PRESSED', self.parseGesture),
+        b'RELEASED': ('RELEASED', self.parseGesture),
+        b'DRAGGED': ('DRAGGED', self.parseGesture),
+        b'POINT': ('POINT', self.parsePoint),
+        }
+
+  def parseLine(self,line):
+    """Dispatch one protocol line on its message type.
+    Returns the message type if it was handled, otherwise None"""
+    self.messageCount += 1
+    end = line.find(b' ')
+    if end < 0:
+      messageType = line.strip()
+    else:
+      messageType = line[:end]
+    try:
+      name,handler = self.handlers[messageType]
+    except KeyError:
+      self.skippedCount += 1
+      return None
+    try:
+      handler(name, line)
+    except ValueError:
+      self.malformedCount += 1
+      return None
+    return name
+
+  def parsePose(self,name,line):
+    """Fill the hand part of the skeleton from a POSE line.  The joint
+    data at the end of the line is kept untokenized until decodeJoints
+    asks for it, so poses that are never shown cost no more to parse."""
+    fields = line.split(None, POSE_FIELDS + 1)
+    if len(fields) < POSE_FIELDS + 1:
+      raise ValueError('POSE needs %d fields, got %d' % (POSE_FIELDS, len(fields) - 1))
+    scratch = self.scratch[:POSE_FIELDS]
+    scratch[:] = fields[1:POSE_FIELDS+1]
+    self.poseBuffer[:] = scratch
+    self.poseLine = line
+    self.skeletonBuffer[SKELETON_FIELDS] = 0.
+    if self.parseJoints and len(fields) > POSE_FIELDS + 1:
+      self.jointData = fields[POSE_FIELDS+1]
+    else:
+      self.jointData = None
+    self.poseCount += 1
+    self.poseTime = time.time()
+    self.poseReadTime = self.readTime
+
+  def decodeJoints(self):
+    """Decode the joint data of the latest pose into the skeleton (once
+    per pose).  Returns True if the latest pose has a skeleton."""
+    if self.jointData is not None:
+      fields = self.jointData.split()
+      self.jointData = None
+      if len(fields) >= SKELETON_FIELDS - POSE_FIELDS:
+        try:
+          self.skeletonBuffer[POSE_FIELDS:SKELETON_FIELDS] = fields[:SKELETON_FIELDS-POSE_FIELDS]
+        except ValueError:
+          # hasJoints stays 0, so the partly written joints are not used
+          self.malformedCount += 1
+        else:
+          self.skeletonBuffer[SKELETON_FIELDS] = 1.
+          self.skeletonCount += 1
+    return self.skeletonBuffer[SKELETON_FIELDS] == 1.
+
+  def parseGesture(self,name,line):
+    """Gesture messages end with the name of the hand"""
+    handField = line[line.rstrip().rfind(b' ')+1:].strip()
+    try:
+      hand = HAND_NAMES[handField]
+    except KeyError:
+      hand = handField.decode('ascii', 'replace').title()
+    self.events.append((name, hand))
+    if self.eventLines is not None:
+      self.eventLines.append(line)
+
+  def parsePoint(self,name,line):
+    """POINT messages name the hand first, then the ray"""
+    fields = line.split()
+    hand = HAND_NAMES.get(fields[1]) if len(fields) > 1 else None
+    if hand is None or len(fields) < POINT_FIELDS + 2:
+      return
+    row = HANDS.index(hand)
+    scratch = self.scratch[:POINT_FIELDS]
+    scratch[:] = fields[2:POINT_FIELDS+2]
+    self.points[row] = scratch
+    self.pointTimes[row] = time.time()
+    self.pointCount += 1
+
+  def parseBuffer(self,data):
+    """Latest-wins parsing of a burst of socket data.
+    Only the newest complete POSE line that parses, and the newest POINT
+    line of each hand, is decoded, the others are just counted; gesture lines
+    are parsed in the order they arrived.
+    A trailing partial line is kept for the next call.
+    Returns the number of POSE lines that were dropped."""
+    if self.pending:
+      data = self.pending + data
+    end = data.rfind(b'\n')
+    if end < 0:
+      self.pending = data
+      return 0
+    self.pending = data[end+1:]
+
+    # gesture lines, in stream order
+    gestures = []
+    for messageType in self.gestureTypes:
+      start = data.find(messageType, 0, end)
+      while start >= 0:
+        if start == 0 or data[start-1:start] == b'\n':
+          gestures.append(start)
+        start = data.find(messageType, start + 1, end)
+    if gestures:
+      gestures.sort()
+      for start in gestures:
+        self.parseLine(data[start:data.find(b'\n', start)])
+
+    # newest pose
+    poses = data.count(b'\nPOSE ', 0, end)
+    if data.startswith(b'POSE '):
+      poses += 1
+    # newest pose that parses, walking back past malformed ones; only
+    # the poses before it count as dropped
+    parsed = 0
+    dropped = 0
+    searchEnd = end
+    while parsed < poses:
+      start = data.rfind(b'\nPOSE ', 0, searchEnd) + 1
+      parsed += 1
+      if self.parseLine(data[start:data.find(b'\n', start)]) == 'POSE':
+        dropped = poses - parsed
+        break
+      searchEnd = start - 1
+    self.droppedPoseCount += dropped
+
+    # newest point of each hand, looking back from the end
+    pointHands = set()
+    start = data.rfind(b'POINT ', 0, end)
+    while start >= 0 and len(pointHands) < len(HANDS):
+      if start == 0 or data[start-1:start] == b'\n':
+        handEnd = data.find(b' ', start + 6)
+        hand = HAND_NAMES.get(data[start+6:handEnd])
+        if hand not in pointHands:
+          pointHands.add(hand)
+          self.parseLine(data[start:data.find(b'\n', start)])
+      start = data.rfind(b'POINT ', 0, start)
+
+    # lines passed to parseLine have been counted there
+    lines = data.count(b'\n', 0, end) + 1
+    self.messageCount += lines - len(gestures) - parsed - len(pointHands)
+    return dropped
+
+  def popEvents(self):
+    """Return and clear the pending gesture events, oldest first"""
+    events = list(self.events)
+    self.events.clear()
+    return events
+
+
+#
+# Microbenchmark against recorded or synthetic traffic
+#
+
+def loadTraffic(path):
+  """Read a recorded protocol stream, one message per line"""
+  fp = open(path, 'rb')
+  lines = [line for line in fp.read().split(b'\n') if line.strip()]
+  fp.close()
+  return lines
+
+def sampleTraffic(count=10000, joints=17, fingertips=5):
+  """Make a plausible stream: mostly POSE with POINT/MOVED chatter
+  and an occasional pinch"""
+  import random
+  random.seed(1988)
+  def numbers(n):
+    return b' '.join([('%.6f' % random.uniform(-300, 300)).encode('ascii') for i in range(n)])
+  lines = []
+  for index in range(count):
+    kind = index % 10
+    if kind < 6:
+      hand = numbers(7) + b' 0'
+      lines.append(b'POSE ' + hand + b' ' + hand + b' ' + numbers(2 * (joints * 7 + fingertips * 3)))
+    elif kind < 8:
+      lines.append(b'MOVED ' + numbers(15) + b' LEFT')
+    elif kind == 8:
+      lines.append(b'POINT LEFT ' + numbers(6) + b' 0.9')
+    else:
+      event = (b'PRESSED', b'DRAGGED', b'RELEASED')[(index // 10) % 3]
+      lines.append(event + b' ' + numbers(15) + b' RIGHT')
+  return lines
+
+def splitParse(lines):
+  """The original handleRead approach, kept as a baseline"""
+  latestPose = None
+  for line in lines:
+    m = line.split()
+    if m[0] == b'POSE':
+      latestPose = m
+  return latestPose
+
+def benchmarkParser(lines=None, repeat=5):
+  """Report messages/second and allocation figures for HandParser
+  (and the split based baseline) over the given lines.
+
+  Allocations are measured with tracemalloc where available:
+  retainedBlocksPerMessage is the net number of memory blocks left behind
+  per message (should be zero once the buffers exist) and
+  peakBytesPerMessage is the transient high water mark divided by the
+  number of messages in one pass.
+  """
+  if lines is None:
+    lines = sampleTraffic()
+  results = {'messages': len(lines)}
+  for name,run in (('parser', None), ('split', splitParse)):
+    if run is None:
+      parser = HandParser()
+      def run(lines, parser=parser):
+        for line in lines:
+          parser.parseLine(line)
+        parser.events.clear()
+    best = None
+    for r in range(repeat):
+      start = time.time()
+      run(lines)
+      elapsed = time.time() - start
+      if best is None or elapsed < best:
+        best = elapsed
+    results[name] = {'messagesPerSecond': len(lines) / max(best, 1e-9)}
+    try:
+      import tracemalloc
+    except ImportError:
+      continue
+    tracemalloc.start()
+    run(lines)
+    before = tracemalloc.take_snapshot()
+    if hasattr(tracemalloc, 'reset_peak'):
+      tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run(lines)
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum([stat.count_diff for stat in after.compare_to(before, 'filename')])
+    results[name]['retainedBlocksPerMessage'] = retained / float(len(lines))
+    results[name]['peakBytesPerMessage'] = max(peak - baseline, 0) / float(len(lines))
+  return results
+
+if __name__ == '__main__':
+  import sys
+  lines = loadTraffic(sys.argv[1]) if len(sys.argv) > 1 else None
+  print(benchmarkParser(lines))
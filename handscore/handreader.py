@@ -0,0 +1,119 @@
+import collections
+import socket
+import threading
+import time
+
+from . import handprotocol
+
+#
+# Background reader for the hand driver socket
+#
+# The reader thread owns the socket and a HandParser.  After each read
+# burst it publishes the newest pose into a single slot (self.latest) by
+# rebinding one attribute to a fresh tuple, which is atomic in Python, so
+# the GUI thread never waits on a lock.  Gesture events go into a bounded
+# deque; if the GUI falls far enough behind the oldest events are dropped
+# and counted in overflowCount.
+#
+# Any error ends the thread with self.error set, so the owner sees the
+# connection as lost (is_alive() is False) and can tell why.
+#
+
+class HandReader(threading.Thread):
+  """Read and parse the driver stream off the GUI thread"""
+
+  def __init__(self,host='localhost',port=1988,maxEvents=256):
+    threading.Thread.__init__(self, name='HandReader')
+    self.daemon = True
+    self.host = host
+    self.port = port
+    self.parser = handprotocol.HandParser()
+    self.latest = None
+    self.latestPointing = None
+    self.events = collections.deque(maxlen=maxEvents)
+    self.overflowCount = 0
+    self.readCount = 0
+    self.error = None
+    self.running = False
+    self.socket = None
+    self.recorder = None
+
+  def start(self):
+    self.running = True
+    threading.Thread.start(self)
+
+  def stop(self,timeout=1.):
+    """Ask the thread to finish and wait for it"""
+    self.running = False
+    if self.is_alive():
+      self.join(timeout)
+
+  def run(self):
+    try:
+      self.socket = socket.create_connection((self.host, self.port), 5.)
+      self.socket.settimeout(0.1)
+      while self.running:
+        try:
+          data = self.socket.recv(65536)
+        except socket.timeout:
+          continue
+        if not data:
+          break
+        self.handleData(data)
+    except Exception as e:
+      # socket errors, and anything unexpected from parsing or recording
+      self.error = e
+    finally:
+      self.running = False
+      if self.socket:
+        self.socket.close()
+
+  def handleData(self,data):
+    """Parse one burst and publish the results"""
+    self.readCount += 1
+    self.parser.readTime = time.time()
+    # read once, the GUI thread may take it away at any time
+    recorder = self.recorder
+    if recorder:
+      recorder.write(data)
+    parser = self.parser
+    poseCount = parser.poseCount
+    pointCount = parser.pointCount
+    parser.parseBuffer(data)
+    self.queueEvents(parser.popEvents())
+    if parser.poseCount != poseCount:
+      parser.decodeJoints()
+      self.latest = (parser.poseCount, parser.poseTime, parser.skeleton.copy(), parser.poseReadTime)
+    if parser.pointCount != pointCount:
+      self.latestPointing = (parser.points.copy(), parser.pointTimes.copy())
+
+  def queueEvents(self,events):
+    for event in events:
+      if len(self.events) == self.events.maxlen:
+        self.overflowCount += 1
+      self.events.append(event)
+
+  def latestPose(self):
+    """Return (poseCount, poseTime, skeleton, readTime) for the newest
+    pose or None.  skeleton is a copy of HandParser.skeleton that the
+    reader never writes again; skeleton['hands'] is laid out like
+    HandParser.pose"""
+    return self.latest
+
+  def latestPoints(self):
+    """Return (points, pointTimes) laid out like HandParser.points and
+    HandParser.pointTimes, or None before the first POINT"""
+    return self.latestPointing
+
+  def popEvents(self):
+    """Return the pending gesture events, oldest first"""
+    events = []
+    try:
+      while True:
+        events.append(self.events.popleft())
+    except IndexError:
+      pass
+    return events
+
+  def droppedPoseCount(self):
+    return self.parser.droppedPoseCount
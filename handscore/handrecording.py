@@ -0,0 +1,177 @@
+import socket
+import threading
+import time
+
+#
+# Recording and replay of hand driver sessions
+#
+# A recording is a text file with one protocol line per line, prefixed by
+# the seconds since the start of the recording:
+#
+#   0.0167 POSE 12.5 ...
+#
+# HandReplayServer plays a recording back on a local port (1988 by
+# default, like the driver) so the rest of the module can be exercised
+# without the camera.
+#
+
+class HandRecorder(object):
+  """Tee raw driver data into a timestamped recording.
+  A reader thread may be writing while the GUI thread closes it, so both
+  take the lock, and writes after close are ignored."""
+
+  def __init__(self,path):
+    self.path = path
+    self.lock = threading.Lock()
+    self.fp = open(path, 'wb')
+    self.startTime = time.time()
+    self.pending = b''
+    self.lineCount = 0
+
+  def write(self,data,now=None):
+    """Record a chunk of raw socket data; partial lines wait for the next chunk"""
+    if now is None:
+      now = time.time()
+    with self.lock:
+      if self.fp:
+        self.writeLines(data, now)
+
+  def writeLines(self,data,now):
+    data = self.pending + data
+    end = data.rfind(b'\n')
+    if end < 0:
+      self.pending = data
+      return
+    self.pending = data[end+1:]
+    stamp = ('%.4f ' % (now - self.startTime)).encode('ascii')
+    lines = [line for line in data[:end].split(b'\n') if line]
+    self.fp.write(b''.join([stamp + line + b'\n' for line in lines]))
+    self.lineCount += len(lines)
+
+  def close(self):
+    with self.lock:
+      if self.fp:
+        self.fp.close()
+        self.fp = None
+
+
+def readRecording(path):
+  """Return a list of (time, line) pairs from a recording"""
+  records = []
+  fp = open(path, 'rb')
+  for line in fp:
+    stamp,sep,message = line.rstrip(b'\r\n').partition(b' ')
+    if message:
+      records.append((float(stamp), message))
+  fp.close()
+  return records
+
+
+def recordsFromLines(lines,rate=60.):
+  """Spread plain protocol lines evenly in time, one POSE per 1/rate seconds"""
+  records = []
+  t = 0.
+  for line in lines:
+    if line.startswith(b'POSE'):
+      t += 1. / rate
+    records.append((t, line))
+  return records
+
+
+class HandReplayServer(threading.Thread):
+  """Serve recorded (time, line) pairs to clients of a local port.
+  speed is a multiple of real time; 0 sends as fast as possible.
+  Each client that connects gets the whole recording (loop=True repeats it)."""
+
+  def __init__(self,records,host='localhost',port=1988,speed=1.,loop=False,maxClients=None):
+    threading.Thread.__init__(self, name='HandReplayServer')
+    self.daemon = True
+    self.records = records
+    self.host = host
+    self.port = port
+    self.speed = speed
+    self.loop = loop
+    self.maxClients = maxClients
+    self.running = False
+    self.clientCount = 0
+    self.sentCount = 0
+    self.error = None
+    self.server = None
+
+  def start(self):
+    """Listen on the port (0 picks a free one) and start serving"""
+    self.running = True
+    self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.server.bind((self.host, self.port))
+    self.port = self.server.getsockname()[1]
+    self.server.listen(1)
+    self.server.settimeout(0.1)
+    threading.Thread.start(self)
+
+  def stop(self,timeout=1.):
+    self.running = False
+    if self.is_alive():
+      self.join(timeout)
+
+  def run(self):
+    try:
+      while self.running:
+        if self.maxClients is not None and self.clientCount >= self.maxClients:
+          break
+        try:
+          connection,address = self.server.accept()
+        except socket.timeout:
+          continue
+        self.clientCount += 1
+        try:
+          self.serve(connection)
+        except socket.error:
+          # the client went away
+          pass
+        connection.close()
+    except socket.error as e:
+      self.error = e
+    finally:
+      self.server.close()
+
+  def serve(self,connection):
+    """Send the recording, batching the lines that are due together"""
+    while self.running:
+      startTime = time.time()
+      index = 0
+      count = len(self.records)
+      while self.running and index < count:
+        if self.speed > 0:
+          elapsed = (time.time() - startTime) * self.speed
+          due = self.records[index][0]
+          if due > elapsed:
+            time.sleep(min((due - elapsed) / self.speed, 0.1))
+            continue
+        batch = []
+        while index < count and (self.speed <= 0 or self.records[index][0] <= elapsed):
+          batch.append(self.records[index][1])
+          index += 1
+          if self.speed <= 0 and len(batch) == 1000:
+            break
+        connection.sendall(b'\n'.join(batch) + b'\n')
+        self.sentCount += len(batch)
+      if not self.loop:
+        break
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Replay a recorded hand driver session')
+  parser.add_argument('recording')
+  parser.add_argument('--port', type=int, default=1988)
+  parser.add_argument('--speed', type=float, default=1., help='multiple of real time, 0 for as fast as possible')
+  parser.add_argument('--loop', action='store_true')
+  args = parser.parse_args()
+  server = HandReplayServer(readRecording(args.recording), port=args.port, speed=args.speed, loop=args.loop)
+  server.start()
+  try:
+    while server.is_alive():
+      server.join(0.5)
+  except KeyboardInterrupt:
+    server.stop()
@@ -0,0 +1,153 @@
+import os
+import time
+
+import numpy
+
+#
+# Demand driven pacing of the pose -> scene -> render cycle
+#
+# The logic ticks a timer at targetFPS and asks the scheduler on every
+# tick whether the newest pose is worth applying.  Hand moves smaller
+# than epsilon (mm) and turns smaller than epsilonAngle (radians) are
+# not written, so a resting hand causes no scene changes and so no
+# renders.  After idleFrames ticks without a move the scheduler goes
+# idle and the timer slows to idleFPS until the hands move again or a
+# gesture arrives (wake).
+#
+# Achieved frame and render rates and the CPU time of the whole process
+# (all threads, as a percentage of one core) are reported per
+# reportInterval so the settings can be tuned for a site.
+#
+
+def cpuTime():
+  """User plus system seconds used by this process"""
+  times = os.times()
+  return times[0] + times[1]
+
+
+class FrameScheduler(object):
+  """Frame cap, dead-band and idle mode for applying poses"""
+
+  def __init__(self,targetFPS=60.,epsilon=0.5,epsilonAngle=0.01,idleFrames=30,idleFPS=4.,reportInterval=1.):
+    self.targetFPS = targetFPS
+    self.epsilon = epsilon
+    self.epsilonAngle = epsilonAngle
+    self.idleFrames = idleFrames
+    self.idleFPS = idleFPS
+    self.reportInterval = reportInterval
+    self.positions = numpy.zeros((2, 3))
+    self.orientations = numpy.zeros((2, 4))
+    self.orientations[:, 3] = 1.
+    self.reset()
+
+  def reset(self):
+    self.applied = False
+    self.idle = False
+    self.stillFrames = 0
+    self.tickCount = 0
+    self.appliedCount = 0
+    self.stillCount = 0
+    self.renderCount = 0
+    self.wakeCount = 0
+    self.report = {}
+    self.reportStart = None
+    self.reportCounts = (0, 0, 0)
+    self.reportCPU = 0.
+
+  def interval(self):
+    """Seconds until the next tick"""
+    return 1. / (self.idleFPS if self.idle else self.targetFPS)
+
+  def wake(self):
+    """Back to the full frame rate, for example when a gesture arrives"""
+    self.stillFrames = 0
+    if self.idle:
+      self.idle = False
+      self.wakeCount += 1
+
+  def tick(self,positions=None,orientations=None):
+    """One timer tick with the pose that would be applied (None when
+    there is no pose yet).  Returns True if it has moved or turned
+    beyond the dead-band since the last pose that was applied, in which
+    case it becomes the applied pose."""
+    self.tickCount += 1
+    moved = positions is not None and self.moved(positions, orientations)
+    if moved:
+      self.positions[:] = positions
+      if orientations is not None:
+        self.orientations[:] = orientations
+      self.applied = True
+      self.appliedCount += 1
+      self.wake()
+    else:
+      self.stillCount += 1
+      self.stillFrames += 1
+      if self.stillFrames >= self.idleFrames:
+        self.idle = True
+    self.updateReport()
+    return moved
+
+  def moved(self,positions,orientations=None):
+    if not self.applied:
+      return True
+    if numpy.abs(positions - self.positions).max() > self.epsilon:
+      return True
+    if orientations is not None:
+      # |q1.q2| is the cosine of half the angle between two rotations
+      cosines = numpy.abs((orientations * self.orientations).sum(axis=1))
+      norms = numpy.linalg.norm(orientations, axis=1) * numpy.linalg.norm(self.orientations, axis=1)
+      if (cosines < numpy.cos(self.epsilonAngle / 2.) * norms).any():
+        return True
+    return False
+
+  def rendered(self):
+    """Count a finished render of the views"""
+    self.renderCount += 1
+
+  def updateReport(self,now=None):
+    """Roll the rates over once per reportInterval"""
+    if now is None:
+      now = time.time()
+    if self.reportStart is None:
+      self.reportStart = now
+      self.reportCPU = cpuTime()
+      self.reportCounts = (self.tickCount, self.appliedCount, self.renderCount)
+      return
+    elapsed = now - self.reportStart
+    if elapsed < self.reportInterval:
+      return
+    cpu = cpuTime()
+    counts = (self.tickCount, self.appliedCount, self.renderCount)
+    ticks,applied,renders = [(new - old) / elapsed for new,old in zip(counts, self.reportCounts)]
+    self.report = {
+        'ticksPerSecond': ticks,
+        'appliedPerSecond': applied,
+        'framesPerSecond': renders,
+        'cpuPercent': 100. * (cpu - self.reportCPU) / elapsed,
+        'idle': self.idle,
+        }
+    self.reportStart = now
+    self.reportCPU = cpu
+    self.reportCounts = counts
+
+  def statistics(self):
+    """The last report plus the running totals"""
+    statistics = dict(self.report)
+    statistics.update({
+        'ticks': self.tickCount,
+        'applied': self.appliedCount,
+        'still': self.stillCount,
+        'renders': self.renderCount,
+        'wakes': self.wakeCount,
+        'idle': self.idle,
+        })
+    return statistics
+
+  def summary(self):
+    """One line for the status bar"""
+    report = self.report
+    if not report:
+      return 'frames: no report yet'
+    return 'frames: %.1f fps, %.1f poses/s, cpu %.0f%%%s' % (
+        report['framesPerSecond'], report['appliedPerSecond'], report['cpuPercent'],
+        ', idle' if self.idle else '')
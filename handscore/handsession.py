@@ -0,0 +1,221 @@
+import os
+
+import numpy
+
+from . import handprotocol
+
+#
+# Columnar binary storage for recorded hand sessions
+#
+# A session is a directory of .npy files that are opened memory mapped,
+# so seeking and statistics only touch the pages they need:
+#
+#   times.npy         float64 (N,)      seconds since the start of the session
+#   positions.npy     float32 (N,2,3)   hand positions, left then right
+#   orientations.npy  float32 (N,2,4)   hand orientation quaternions
+#   events.npy        (M,) records of time (float64), type and hand (uint8)
+#
+# Event types and hands are indices into handprotocol.GESTURE_EVENTS
+# and handprotocol.HANDS.
+#
+
+EVENT_DTYPE = numpy.dtype([('time', 'f8'), ('type', 'u1'), ('hand', 'u1')])
+
+COLUMNS = ('times', 'positions', 'orientations', 'events')
+
+
+def scanLines(path,rate=60.):
+  """Yield (time, line) from either a timestamped recording
+  (handrecording.HandRecorder) or a plain protocol stream,
+  which is given times at the assumed pose rate"""
+  fp = open(path, 'rb')
+  timestamped = None
+  t = 0.
+  for line in fp:
+    line = line.rstrip(b'\r\n')
+    if not line:
+      continue
+    if timestamped is None:
+      try:
+        float(line.split(None, 1)[0])
+        timestamped = True
+      except ValueError:
+        timestamped = False
+    if timestamped:
+      stamp,sep,line = line.partition(b' ')
+      yield float(stamp),line
+    else:
+      if line.startswith(b'POSE'):
+        t += 1. / rate
+      yield t,line
+  fp.close()
+
+
+def parseMessage(parser,line):
+  """'POSE' for a pose that parsed, (type, hand) indices for a gesture
+  of a known hand, otherwise None (other messages, malformed poses and
+  gestures of unknown hands are left out of sessions)"""
+  messageType = parser.parseLine(line)
+  if messageType == 'POSE':
+    return messageType
+  if messageType in handprotocol.GESTURE_EVENTS:
+    name,hand = parser.events.popleft()
+    if hand in handprotocol.HANDS:
+      return handprotocol.GESTURE_EVENTS.index(name),handprotocol.HANDS.index(hand)
+  return None
+
+
+def convertRecording(recordingPath,sessionPath,rate=60.):
+  """Convert a text recording into a session directory.
+  The text is read twice (count, then fill) so memory use does
+  not grow with the length of the session.  Both passes parse the
+  lines the same way, so the counts match what is filled."""
+  poseCount = 0
+  eventCount = 0
+  parser = handprotocol.HandParser()
+  parser.parseJoints = False
+  for t,line in scanLines(recordingPath, rate):
+    message = parseMessage(parser, line)
+    if message == 'POSE':
+      poseCount += 1
+    elif message:
+      eventCount += 1
+
+  if not os.path.exists(sessionPath):
+    os.makedirs(sessionPath)
+  openMemmap = numpy.lib.format.open_memmap
+  def column(name,dtype,shape):
+    return openMemmap(os.path.join(sessionPath, name + '.npy'), mode='w+', dtype=dtype, shape=shape)
+  times = column('times', 'f8', (poseCount,))
+  positions = column('positions', 'f4', (poseCount, 2, 3))
+  orientations = column('orientations', 'f4', (poseCount, 2, 4))
+  events = column('events', EVENT_DTYPE, (eventCount,))
+
+  parser = handprotocol.HandParser()
+  parser.parseJoints = False
+  poseIndex = 0
+  eventIndex = 0
+  for t,line in scanLines(recordingPath, rate):
+    message = parseMessage(parser, line)
+    if message == 'POSE':
+      times[poseIndex] = t
+      positions[poseIndex] = parser.positions
+      orientations[poseIndex] = parser.orientations
+      poseIndex += 1
+    elif message:
+      events[eventIndex] = (t,) + message
+      eventIndex += 1
+  for array in (times, positions, orientations, events):
+    array.flush()
+  return HandSession(sessionPath)
+
+
+class HandSession(object):
+  """Read only, memory mapped view of a converted session"""
+
+  def __init__(self,path):
+    self.path = path
+    for name in COLUMNS:
+      setattr(self, name, numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+
+  def __len__(self):
+    return len(self.times)
+
+  def duration(self):
+    if not len(self.times):
+      return 0.
+    return float(self.times[-1] - self.times[0])
+
+  def seek(self,t):
+    """Index of the first pose at or after time t"""
+    return int(numpy.searchsorted(self.times, t))
+
+  def window(self,start,stop):
+    """Views of the pose columns and the events between two times"""
+    first,last = self.seek(start),self.seek(stop)
+    eventFirst,eventLast = numpy.searchsorted(self.events['time'], (start, stop))
+    return (self.times[first:last], self.positions[first:last],
+            self.orientations[first:last], self.events[eventFirst:eventLast])
+
+  def statistics(self,chunk=1<<16):
+    """Summary of the session, computed chunk by chunk"""
+    count = len(self.times)
+    result = {'poses': count, 'events': len(self.events), 'duration': self.duration()}
+    if not count:
+      return result
+    minimum = numpy.empty((2, 3))
+    minimum.fill(numpy.inf)
+    maximum = -minimum
+    total = numpy.zeros((2, 3))
+    pathLength = numpy.zeros(2)
+    previous = None
+    for start in range(0, count, chunk):
+      block = numpy.asarray(self.positions[start:start+chunk], dtype='f8')
+      numpy.minimum(minimum, block.min(axis=0), minimum)
+      numpy.maximum(maximum, block.max(axis=0), maximum)
+      total += block.sum(axis=0)
+      if previous is not None:
+        block = numpy.concatenate((previous[numpy.newaxis], block))
+      pathLength += numpy.sqrt((numpy.diff(block, axis=0) ** 2).sum(axis=2)).sum(axis=0)
+      previous = block[-1]
+    result['rate'] = (count - 1) / result['duration'] if result['duration'] else 0.
+    result['minimum'] = minimum.tolist()
+    result['maximum'] = maximum.tolist()
+    result['mean'] = (total / count).tolist()
+    result['pathLength'] = pathLength.tolist()
+    return result
+
+  def records(self,start=None,stop=None):
+    """A lazy sequence of (time, protocol line) pairs for
+    handrecording.HandReplayServer, optionally for a time window"""
+    return SessionRecords(self, start, stop)
+
+
+class SessionRecords(object):
+  """Poses and events of a session merged in time order, with each
+  protocol line formatted only when it is asked for"""
+
+  def __init__(self,session,start=None,stop=None):
+    self.session = session
+    times = session.times
+    self.first = session.seek(start) if start is not None else 0
+    self.last = session.seek(stop) if stop is not None else len(times)
+    eventTimes = session.events['time']
+    self.eventFirst,self.eventLast = 0,len(eventTimes)
+    if start is not None:
+      self.eventFirst = int(numpy.searchsorted(eventTimes, start))
+    if stop is not None:
+      self.eventLast = int(numpy.searchsorted(eventTimes, stop))
+    eventTimes = eventTimes[self.eventFirst:self.eventLast]
+    # merged index of each event: poses before it plus the events before it
+    posesBefore = numpy.searchsorted(times[self.first:self.last], eventTimes, 'right')
+    self.eventIndices = posesBefore + numpy.arange(len(eventTimes))
+
+  def __len__(self):
+    return (self.last - self.first) + len(self.eventIndices)
+
+  def __getitem__(self,index):
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError(index)
+    session = self.session
+    k = int(numpy.searchsorted(self.eventIndices, index))
+    if k < len(self.eventIndices) and self.eventIndices[k] == index:
+      event = session.events[self.eventFirst + k]
+      line = '%s %s' % (handprotocol.GESTURE_EVENTS[event['type']], handprotocol.HANDS[event['hand']].upper())
+      return float(event['time']),line.encode('ascii')
+    pose = self.first + index - k
+    fields = []
+    for hand in (0, 1):
+      fields.extend(session.positions[pose, hand])
+      fields.extend(session.orientations[pose, hand])
+      fields.append(0)
+    line = 'POSE ' + ' '.join(['%.6g' % value for value in fields])
+    return float(session.times[pose]),line.encode('ascii')
+
+
+if __name__ == '__main__':
+  import sys
+  session = convertRecording(sys.argv[1], sys.argv[2])
+  print(session.statistics())
@@ -0,0 +1,240 @@
+import collections
+import socket
+import struct
+import time
+
+from . import handlatency
+from . import handreader
+
+#
+# Input sources the logic can read hands from
+#
+# A source is anything with the interface of handreader.HandReader:
+#
+#   start() / stop()        run and end its reader thread
+#   is_alive()              False once the connection has ended
+#   latestPose()            (poseCount, poseTime, skeleton, readTime) or None
+#   latestPoints()          (points, pointTimes) or None
+#   popEvents()             pending (messageType, hand) gesture events
+#   droppedPoseCount()      poses that were never shown
+#
+# and sources are made by name from SOURCES, so other trackers can be
+# added with registerSource.  Two ship here:
+#
+#   threegear   the driver's TCP line stream (HandReader)
+#   datagram    the same protocol lines in sequence numbered UDP
+#               datagrams (DatagramSource)
+#
+# Over TCP one stalled segment holds back every pose behind it.  A
+# datagram carries a header of a sequence number and the send time,
+# then whole protocol lines; one that arrives after a newer one is stale
+# and its poses are dropped instead of applied late (its gestures are
+# still delivered, since a lost RELEASED would leave a hand pinching).
+# Loss, reordering and transit time are counted; a datagram that is too
+# short or carries lines the parser cannot read is counted as malformed
+# and the source keeps receiving, since anything on the host can send to
+# the port.  The transit time
+# compares two clocks, so it is only meaningful on one host or with
+# synchronized clocks.
+#
+
+DATAGRAM_PORT = 1991
+
+# sequence number, send time (seconds since the epoch)
+HEADER = struct.Struct('!Qd')
+
+SOURCES = {}
+
+def registerSource(name,factory):
+  """factory(**options) makes a source, options like host and port"""
+  SOURCES[name] = factory
+
+def createSource(name,**options):
+  try:
+    factory = SOURCES[name]
+  except KeyError:
+    raise ValueError('unknown input source %s' % name)
+  return factory(**options)
+
+
+class DatagramSource(handreader.HandReader):
+  """Read sequence numbered datagrams of protocol lines off the GUI
+  thread, dropping the stale ones"""
+
+  def __init__(self,host='localhost',port=DATAGRAM_PORT,maxEvents=256,window=1024):
+    handreader.HandReader.__init__(self, host, port, maxEvents)
+    self.name = 'DatagramSource'
+    # sequence numbers seen lately, to tell duplicates from late arrivals
+    self.recent = collections.deque(maxlen=window)
+    self.recentSet = set()
+    # sequence numbers skipped lately, to tell a late datagram from one
+    # that was never counted as lost
+    self.missing = set()
+    self.firstSequence = None
+    self.highestSequence = None
+    self.datagramCount = 0
+    self.lostCount = 0
+    self.reorderedCount = 0
+    self.duplicateCount = 0
+    self.malformedDatagramCount = 0
+    self.stalePoseCount = 0
+    self.latency = handlatency.LatencyMonitor(stages=('transit',))
+    self.latency.enabled = True
+
+  def start(self):
+    """Bind the port (0 picks a free one) and start reading"""
+    self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.socket.bind((self.host, self.port))
+    self.port = self.socket.getsockname()[1]
+    self.socket.settimeout(0.1)
+    handreader.HandReader.start(self)
+
+  def run(self):
+    try:
+      while self.running:
+        try:
+          data = self.socket.recv(65536)
+        except socket.timeout:
+          continue
+        self.handleDatagram(data)
+    except Exception as e:
+      self.error = e
+    finally:
+      self.running = False
+      self.socket.close()
+
+  def handleDatagram(self,data,now=None):
+    """Check one datagram's place in the sequence and parse it"""
+    if now is None:
+      now = time.time()
+    if len(data) < HEADER.size:
+      self.malformedDatagramCount += 1
+      return
+    malformedCount = self.parser.malformedCount
+    try:
+      self.handleSequenced(data, now)
+    except (ValueError, IndexError, UnicodeError):
+      self.malformedDatagramCount += 1
+      return
+    if self.parser.malformedCount != malformedCount:
+      self.malformedDatagramCount += 1
+
+  def handleSequenced(self,data,now):
+    sequence,sendTime = HEADER.unpack_from(data)
+    if sequence in self.recentSet:
+      self.duplicateCount += 1
+      return
+    if len(self.recent) == self.recent.maxlen:
+      self.recentSet.discard(self.recent[0])
+    self.recent.append(sequence)
+    self.recentSet.add(sequence)
+    self.datagramCount += 1
+    self.latency.record('transit', now - sendTime)
+    payload = data[HEADER.size:]
+    if not payload.endswith(b'\n'):
+      payload += b'\n'
+    highest = self.highestSequence
+    if highest is None or sequence > highest:
+      if highest is None:
+        self.firstSequence = sequence
+      else:
+        self.lostCount += sequence - highest - 1
+        window = self.recent.maxlen
+        self.missing.update(range(max(highest + 1, sequence - window), sequence))
+        if len(self.missing) > window:
+          self.missing = set([number for number in self.missing if number > sequence - window])
+      self.highestSequence = sequence
+      self.handleData(payload)
+    else:
+      self.reorderedCount += 1
+      if sequence in self.missing:
+        # counted as lost when the gap opened
+        self.missing.discard(sequence)
+        self.lostCount -= 1
+      self.handleStale(payload)
+
+  def handleStale(self,payload):
+    """Keep the gestures of a late datagram, drop the rest"""
+    parser = self.parser
+    recorder = self.recorder
+    if recorder:
+      recorder.write(payload)
+    for line in payload.split(b'\n'):
+      messageType = line.split(None, 1)[:1]
+      if messageType == [b'POSE']:
+        self.stalePoseCount += 1
+      elif messageType and messageType[0] in parser.gestureTypes:
+        parser.parseLine(line)
+    self.queueEvents(parser.popEvents())
+
+  def droppedPoseCount(self):
+    """Poses skipped by latest-wins parsing or dropped as stale"""
+    return self.parser.droppedPoseCount + self.stalePoseCount
+
+  def statistics(self):
+    """Datagram counts, loss and transit time (ms percentiles)"""
+    expected = 0
+    if self.highestSequence is not None:
+      expected = self.highestSequence - self.firstSequence + 1
+    return {
+        'datagrams': self.datagramCount,
+        'lost': self.lostCount,
+        'lossFraction': float(self.lostCount) / expected if expected else 0.,
+        'reordered': self.reorderedCount,
+        'stalePoses': self.stalePoseCount,
+        'duplicates': self.duplicateCount,
+        'malformedDatagrams': self.malformedDatagramCount,
+        'transit': self.latency.stageStatistics('transit'),
+        }
+
+
+class DatagramSender(object):
+  """Send protocol lines as sequence numbered datagrams, for trackers
+  that feed a DatagramSource and for loopback tests"""
+
+  def __init__(self,host='localhost',port=DATAGRAM_PORT):
+    self.address = (host, port)
+    self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.sequence = 0
+
+  def datagram(self,lines,sendTime=None):
+    """The next datagram of the sequence, without sending it"""
+    if sendTime is None:
+      sendTime = time.time()
+    data = HEADER.pack(self.sequence, sendTime) + b'\n'.join(lines) + b'\n'
+    self.sequence += 1
+    return data
+
+  def sendDatagram(self,data):
+    self.socket.sendto(data, self.address)
+
+  def send(self,lines):
+    self.sendDatagram(self.datagram(lines))
+
+  def close(self):
+    self.socket.close()
+
+
+registerSource('threegear', handreader.HandReader)
+registerSource('datagram', DatagramSource)
+
+
+if __name__ == '__main__':
+  import argparse
+  from . import handprotocol
+  parser = argparse.ArgumentParser(description='Send sample hand traffic as datagrams, one pose each')
+  parser.add_argument('--host', default='localhost')
+  parser.add_argument('--port', type=int, default=DATAGRAM_PORT)
+  parser.add_argument('--rate', type=float, default=60., help='datagrams per second')
+  parser.add_argument('--count', type=int, default=6000, help='sample lines to send')
+  args = parser.parse_args()
+  sender = DatagramSender(args.host, args.port)
+  lines = []
+  for line in handprotocol.sampleTraffic(args.count):
+    lines.append(line)
+    if line.startswith(b'POSE'):
+      sender.send(lines)
+      lines = []
+      time.sleep(1. / args.rate)
+  sender.close()
@@ -0,0 +1,167 @@
+import numpy
+
+#
+# The transform chain behind the hand cursors, as NumPy 4x4 matrices
+#
+#   Hand-To-Table    hand position (and orientation) in driver millimeters
+#   Table-To-Camera  the table sits below and in front of the camera
+#   Camera-To-RAS    the camera's right, up, normal and position
+#
+# so a hand point in RAS is cameraToRAS . tableToCamera . handToTable.
+# Functions that build a matrix take an optional out array to fill in
+# place, so the per-frame updates need not allocate.
+#
+
+# size of a hand cursor, and height of the table below the camera axis
+HAND_SCALE = 10.
+TABLE_HEIGHT = -100.
+
+
+def identity(out=None):
+  if out is None:
+    return numpy.identity(4)
+  out[:] = 0.
+  out[0, 0] = out[1, 1] = out[2, 2] = out[3, 3] = 1.
+  return out
+
+def quaternionToMatrix(q,out=None):
+  """Rotation (3x3) of a unit quaternion given as (x, y, z, w), the
+  order the driver sends them in"""
+  if out is None:
+    out = numpy.empty((3, 3))
+  x,y,z,w = q
+  out[0, 0] = 1. - 2. * (y * y + z * z)
+  out[0, 1] = 2. * (x * y - z * w)
+  out[0, 2] = 2. * (x * z + y * w)
+  out[1, 0] = 2. * (x * y + z * w)
+  out[1, 1] = 1. - 2. * (x * x + z * z)
+  out[1, 2] = 2. * (y * z - x * w)
+  out[2, 0] = 2. * (x * z - y * w)
+  out[2, 1] = 2. * (y * z + x * w)
+  out[2, 2] = 1. - 2. * (x * x + y * y)
+  return out
+
+def normalizedQuaternion(q):
+  """q scaled to unit length, or the identity (0,0,0,1) if q is zero"""
+  q = numpy.asarray(q, dtype=float)
+  length = numpy.linalg.norm(q)
+  if length < 1e-9:
+    return numpy.array((0., 0., 0., 1.))
+  return q / length
+
+def quaternionMultiply(a,b):
+  """The rotation b followed by a, for (x, y, z, w) quaternions"""
+  ax,ay,az,aw = a
+  bx,by,bz,bw = b
+  return numpy.array((aw * bx + ax * bw + ay * bz - az * by,
+                      aw * by - ax * bz + ay * bw + az * bx,
+                      aw * bz + ax * by - ay * bx + az * bw,
+                      aw * bw - ax * bx - ay * by - az * bz))
+
+def quaternionConjugate(q):
+  return numpy.array((-q[0], -q[1], -q[2], q[3]))
+
+def twistAngle(q,axis):
+  """Angle (radians) of the part of the rotation q that turns about
+  axis (the swing-twist decomposition)"""
+  axis = axis / numpy.linalg.norm(axis)
+  angle = 2. * numpy.arctan2(numpy.dot(q[:3], axis), q[3])
+  # the same turn the short way round
+  if angle > numpy.pi:
+    angle -= 2. * numpy.pi
+  elif angle < -numpy.pi:
+    angle += 2. * numpy.pi
+  return angle
+
+def rotationAbout(axis,angle):
+  """Rotation (3x3) by angle (radians) about axis"""
+  k = axis / numpy.linalg.norm(axis)
+  cross = numpy.array(((0., -k[2], k[1]), (k[2], 0., -k[0]), (-k[1], k[0], 0.)))
+  return numpy.identity(3) + numpy.sin(angle) * cross + (1. - numpy.cos(angle)) * numpy.dot(cross, cross)
+
+def cameraToRAS(position,focalPoint,viewUp,out=None):
+  """Camera-To-RAS for a camera, and the camera distance.
+  The columns are the view right, up and plane normal directions and the
+  camera position, which is the inverse of the camera's view transform
+  (vtkCamera::GetViewTransformMatrix)"""
+  position = numpy.asarray(position, dtype=float)
+  normal = position - focalPoint
+  distance = numpy.linalg.norm(normal)
+  normal /= distance
+  right = numpy.cross(viewUp, normal)
+  right /= numpy.linalg.norm(right)
+  up = numpy.cross(normal, right)
+  out = identity(out)
+  out[:3, 0] = right
+  out[:3, 1] = up
+  out[:3, 2] = normal
+  out[:3, 3] = position
+  return out,distance
+
+def tableToCamera(distance,height=TABLE_HEIGHT,out=None):
+  """Table-To-Camera: the table sits height below the camera and as far
+  in front of it as the focal point"""
+  out = identity(out)
+  out[1, 3] = height
+  out[2, 3] = -distance
+  return out
+
+def handToTable(position,orientation=None,scale=HAND_SCALE,out=None):
+  """Hand-To-Table for a hand position and, optionally, its orientation
+  quaternion (x, y, z, w); the cursor is scaled up by scale"""
+  out = identity(out)
+  if orientation is None:
+    out[0, 0] = out[1, 1] = out[2, 2] = scale
+  else:
+    quaternionToMatrix(orientation, out[:3, :3])
+    out[:3, :3] *= scale
+  out[:3, 3] = position
+  return out
+
+def handToRAS(cameraToRAS,tableToCamera,handToTable):
+  """The whole chain, for when a point is needed outside the scene"""
+  return numpy.dot(cameraToRAS, numpy.dot(tableToCamera, handToTable))
+
+def transformPoints(matrix,points):
+  """Apply a 4x4 matrix to an (N,3) array of points"""
+  return numpy.dot(points, matrix[:3, :3].T) + matrix[:3, 3]
+
+
+def rotationBetween(a,b):
+  """Smallest rotation (3x3) taking the direction of a to that of b"""
+  a = a / numpy.linalg.norm(a)
+  b = b / numpy.linalg.norm(b)
+  axis = numpy.cross(a, b)
+  sine = numpy.linalg.norm(axis)
+  cosine = numpy.dot(a, b)
+  if sine < 1e-12:
+    if cosine > 0:
+      return numpy.identity(3)
+    # half turn about any axis perpendicular to a
+    perpendicular = numpy.cross(a, (1., 0., 0.) if abs(a[0]) < 0.9 else (0., 1., 0.))
+    perpendicular /= numpy.linalg.norm(perpendicular)
+    return 2. * numpy.outer(perpendicular, perpendicular) - numpy.identity(3)
+  k = axis / sine
+  cross = numpy.array(((0., -k[2], k[1]), (k[2], 0., -k[0]), (-k[1], k[0], 0.)))
+  return numpy.identity(3) + sine * cross + (1. - cosine) * numpy.dot(cross, cross)
+
+def similarityFromHandPairs(left0,right0,left1,right1,allowScale=True,roll=0.):
+  """Closed form rotation + uniform scale + translation (4x4) that takes
+  the starting pair of hand positions to the current pair: the line
+  between the hands is turned and stretched onto the new line and the
+  midpoint follows the new midpoint.  Roll about that line cannot be
+  seen with two points; pass it (radians) if it is known from the hand
+  orientations."""
+  before = right0 - left0
+  after = right1 - left1
+  matrix = numpy.identity(4)
+  lengthBefore = numpy.linalg.norm(before)
+  if lengthBefore < 1e-6 or numpy.linalg.norm(after) < 1e-6:
+    return matrix
+  scale = numpy.linalg.norm(after) / lengthBefore if allowScale else 1.
+  linear = scale * rotationBetween(before, after)
+  if roll:
+    linear = numpy.dot(rotationAbout(after, roll), linear)
+  matrix[:3, :3] = linear
+  matrix[:3, 3] = 0.5 * (left1 + right1) - numpy.dot(linear, 0.5 * (left0 + right0))
+  return matrix
@@ -0,0 +1,204 @@
+import math
+
+import numpy
+
+#
+# Filtering of hand positions between the parser and applyPose
+#
+# A FilterPipeline keeps a ring buffer of the raw timestamped samples and
+# runs a list of stages over each new sample.  Stages work on all hands at
+# once: positions are (hands,3) arrays and are filtered in place.
+#
+
+class PoseRingBuffer(object):
+  """Fixed size ring of timestamped (hands,3) position samples"""
+
+  def __init__(self,capacity=64,hands=2):
+    self.capacity = capacity
+    self.times = numpy.zeros(capacity)
+    self.positions = numpy.zeros((capacity, hands, 3))
+    self.count = 0
+    self.head = 0
+
+  def append(self,t,positions):
+    self.times[self.head] = t
+    self.positions[self.head] = positions
+    self.head = (self.head + 1) % self.capacity
+    if self.count < self.capacity:
+      self.count += 1
+
+  def index(self,age=0):
+    """Ring index of the sample age steps before the newest"""
+    return (self.head - 1 - age) % self.capacity
+
+  def newest(self):
+    index = self.index()
+    return self.times[index],self.positions[index]
+
+  def ordered(self):
+    """Return copies of the stored samples, oldest first"""
+    indices = (self.head - self.count + numpy.arange(self.count)) % self.capacity
+    return self.times[indices],self.positions[indices]
+
+  def clear(self):
+    self.count = 0
+    self.head = 0
+
+
+class OneEuroFilter(object):
+  """The 1 Euro filter (Casiez, Roussel, Vogel 2012) applied to all hands.
+  The cutoff frequency of each hand rises with its filtered speed, so slow
+  motion is smoothed heavily and fast motion has little lag."""
+
+  def __init__(self,minCutoff=1.0,beta=0.01,derivativeCutoff=1.0):
+    self.minCutoff = minCutoff
+    self.beta = beta
+    self.derivativeCutoff = derivativeCutoff
+    self.reset()
+
+  def reset(self):
+    self.previousTime = None
+    self.previous = None
+    self.derivative = None
+
+  def alpha(self,cutoff,dt):
+    tau = 1. / (2. * math.pi * cutoff)
+    return 1. / (1. + tau / dt)
+
+  def apply(self,pipeline,t,positions,displayTime):
+    if self.previousTime is None or t <= self.previousTime:
+      if self.previous is None:
+        self.previous = positions.copy()
+        self.derivative = numpy.zeros_like(positions)
+      else:
+        self.previous[:] = positions
+      self.previousTime = t
+      return
+    dt = t - self.previousTime
+    derivativeAlpha = self.alpha(self.derivativeCutoff, dt)
+    derivative = self.derivative
+    derivative *= 1. - derivativeAlpha
+    derivative += derivativeAlpha * (positions - self.previous) / dt
+    speed = numpy.sqrt((derivative * derivative).sum(axis=1))
+    tau = 1. / (2. * math.pi * (self.minCutoff + self.beta * speed))
+    alpha = (1. / (1. + tau / dt))[:, numpy.newaxis]
+    positions *= alpha
+    positions += (1. - alpha) * self.previous
+    self.previous[:] = positions
+    self.previousTime = t
+
+
+class ConstantVelocityPredictor(object):
+  """Extrapolate each hand to the expected display time using the
+  least squares velocity over the last few (already filtered) samples"""
+
+  def __init__(self,window=4,maximumLookahead=0.1):
+    self.window = window
+    self.maximumLookahead = maximumLookahead
+    self.samples = PoseRingBuffer(window)
+    self.velocity = numpy.zeros((2, 3))
+
+  def reset(self):
+    self.samples.clear()
+    self.velocity[:] = 0
+
+  def apply(self,pipeline,t,positions,displayTime):
+    samples = self.samples
+    samples.append(t, positions)
+    if displayTime is None or samples.count < 2:
+      return
+    times = samples.times[:samples.count]
+    dt = times - times.mean()
+    denominator = (dt * dt).sum()
+    if denominator <= 0:
+      return
+    offsets = samples.positions[:samples.count] - samples.positions[:samples.count].mean(axis=0)
+    self.velocity[:] = numpy.tensordot(dt, offsets, axes=1) / denominator
+    lookahead = min(max(displayTime - t, 0.), self.maximumLookahead)
+    positions += self.velocity * lookahead
+
+
+class FilterPipeline(object):
+  """Run the filter stages over each new pose sample.
+  The raw samples are kept in self.samples for later stages
+  (gesture recognition) to look at."""
+
+  def __init__(self,stages=None,capacity=64):
+    self.samples = PoseRingBuffer(capacity)
+    self.stages = list(stages) if stages else []
+    self.output = numpy.zeros((2, 3))
+
+  def addStage(self,stage):
+    self.stages.append(stage)
+
+  def reset(self):
+    self.samples.clear()
+    for stage in self.stages:
+      stage.reset()
+
+  def process(self,t,positions,displayTime=None):
+    """Filter a sample taken at time t, predicting to displayTime if given.
+    Returns self.output, which is reused for every sample"""
+    self.samples.append(t, positions)
+    output = self.output
+    output[:] = positions
+    for stage in self.stages:
+      stage.apply(self, t, output, displayTime)
+    return output
+
+
+def defaultPipeline():
+  return FilterPipeline((OneEuroFilter(), ConstantVelocityPredictor()))
+
+
+#
+# Offline evaluation on recorded streams
+#
+
+def posesFromLines(lines,rate=60.):
+  """Positions (and synthetic times at the given rate) from protocol lines"""
+  from . import handprotocol
+  parser = handprotocol.HandParser()
+  positions = []
+  for line in lines:
+    if parser.parseLine(line) == 'POSE':
+      positions.append(parser.positions.copy())
+  positions = numpy.array(positions).reshape(-1, 2, 3)
+  return numpy.arange(len(positions)) / float(rate),positions
+
+def jitter(positions):
+  """RMS magnitude of the frame to frame second difference, per hand"""
+  if len(positions) < 3:
+    return numpy.zeros(positions.shape[1])
+  acceleration = positions[2:] - 2 * positions[1:-1] + positions[:-2]
+  return numpy.sqrt((acceleration ** 2).sum(axis=2).mean(axis=0))
+
+def lag(times,raw,filtered,maximumLag=30):
+  """Estimate the delay of filtered behind raw (seconds) as the sample
+  shift that best lines the two up; negative means filtered leads"""
+  best,bestShift = None,0
+  for shift in range(-maximumLag, maximumLag + 1):
+    if shift >= 0:
+      difference = filtered[shift:] - raw[:len(raw) - shift]
+    else:
+      difference = filtered[:shift] - raw[-shift:]
+    if not len(difference):
+      continue
+    error = (difference ** 2).mean()
+    if best is None or error < best:
+      best,bestShift = error,shift
+  period = numpy.diff(times).mean() if len(times) > 1 else 0.
+  return float(bestShift * period)
+
+def evaluatePipeline(pipeline,times,positions,lookahead=0.):
+  """Run a pipeline over recorded samples and report
+  jitter and lag before and after filtering"""
+  pipeline.reset()
+  filtered = numpy.empty_like(positions)
+  for index in range(len(times)):
+    filtered[index] = pipeline.process(times[index], positions[index], times[index] + lookahead)
+  return {
+      'rawJitter': jitter(positions).tolist(),
+      'filteredJitter': jitter(filtered).tolist(),
+      'lag': lag(times, positions, filtered),
+      }
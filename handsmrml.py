@@ -0,0 +1,59 @@
+import numpy
+
+#
+# Binding of the handscore NumPy matrices to MRML transform nodes
+#
+# This is the only place where the 4x4 arrays of handscore.handtransforms
+# meet vtkMatrix4x4.  vtk is imported when a scratch matrix is first
+# needed, so this module imports without Slicer too.
+#
+
+_scratch = []
+
+def scratchMatrix():
+  """A vtkMatrix4x4 reused by the calls below (the GUI thread only)"""
+  if not _scratch:
+    import vtk
+    _scratch.append(vtk.vtkMatrix4x4())
+  return _scratch[0]
+
+def arrayFromVTKMatrix(matrix,out=None):
+  """Copy a vtkMatrix4x4 into a (4,4) array"""
+  if out is None:
+    out = numpy.empty((4, 4))
+  for row in range(4):
+    for column in range(4):
+      out[row, column] = matrix.GetElement(row, column)
+  return out
+
+def updateVTKMatrix(matrix,array):
+  """Copy a (4,4) array into a vtkMatrix4x4"""
+  matrix.DeepCopy(numpy.ravel(array).tolist())
+  return matrix
+
+def transformMatrix(transformNode,out=None):
+  """The to-parent matrix of a linear transform node as a (4,4) array"""
+  return arrayFromVTKMatrix(transformNode.GetMatrixTransformToParent(), out)
+
+def worldMatrix(transformNode,out=None):
+  """The to-world matrix of a transformable node as a (4,4) array"""
+  matrix = scratchMatrix()
+  transformNode.GetMatrixTransformToWorld(matrix)
+  return arrayFromVTKMatrix(matrix, out)
+
+def worldPosition(transformNode):
+  """Translation of the to-world matrix"""
+  matrix = scratchMatrix()
+  transformNode.GetMatrixTransformToWorld(matrix)
+  return numpy.array( (matrix.GetElement(0,3),matrix.GetElement(1,3),matrix.GetElement(2,3)) )
+
+def setTransformMatrix(transformNode,array,registry=None):
+  """Write a (4,4) array into a linear transform node as one
+  modification.  Pass the manipulator attribute registry to spare its
+  watchers a scan, since only the matrix changes."""
+  wasSuspended = registry.suspend(transformNode) if registry else False
+  wasModifying = transformNode.StartModify()
+  transformNode.GetMatrixTransformToParent().DeepCopy(updateVTKMatrix(scratchMatrix(), array))
+  transformNode.EndModify(wasModifying)
+  if registry:
+    registry.resume(transformNode, wasSuspended)
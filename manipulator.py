@@ -1,4 +1,126 @@
-import numpy,vtk,slicer
+import time
+
+import numpy
+
+import handsmrml
+from handscore.handtransforms import similarityFromHandPairs
+from handscore.handtransforms import normalizedQuaternion, quaternionMultiply, quaternionConjugate, twistAngle
+from handscore import handhistory
+
+#
+# vtk, qt and slicer are imported where they are first needed, so the
+# watch and gesture state logic here can be imported outside Slicer.
+# Events are observed by name ('ModifiedEvent') for the same reason.
+#
+
+class AttributeWatchRegistry(object):
+  """Shared watch list of node attributes.
+  Each node is observed once no matter how many manipulators watch it;
+  on a ModifiedEvent each watched attribute is read once and only the
+  subscribers of an attribute that changed are called.
+  Code that modifies a node without touching its attributes (such as
+  the per-frame transform updates) can bracket the change with
+  suspend/resume so the ModifiedEvent does not trigger a scan at all.
+  """
+
+  def __init__(self):
+    self.observerTags = {}
+    self.values = {}
+    self.subscribers = {}
+    self.suspended = {}
+    self.scanCount = 0
+    self.skippedScanCount = 0
+    self.dispatchCount = 0
+
+  def subscribe(self,manipulator,node,attributes):
+    values = self.values.setdefault(node, {})
+    subscribers = self.subscribers.setdefault(node, {})
+    for attribute in attributes:
+      if attribute not in values:
+        values[attribute] = node.GetAttribute(attribute)
+      attributeSubscribers = subscribers.setdefault(attribute, [])
+      if manipulator not in attributeSubscribers:
+        attributeSubscribers.append(manipulator)
+    if not node in self.observerTags:
+      self.observerTags[node] = node.AddObserver('ModifiedEvent', self.onNodeModified)
+
+  def unsubscribe(self,manipulator):
+    """Drop all the watches of a manipulator, and the node
+    observations that nobody needs any more"""
+    for node in list(self.subscribers.keys()):
+      subscribers = self.subscribers[node]
+      for attribute in list(subscribers.keys()):
+        if manipulator in subscribers[attribute]:
+          subscribers[attribute].remove(manipulator)
+        if not subscribers[attribute]:
+          del subscribers[attribute]
+          del self.values[node][attribute]
+      if not subscribers:
+        node.RemoveObserver(self.observerTags.pop(node))
+        del self.subscribers[node]
+        del self.values[node]
+        self.suspended.pop(node, None)
+
+  def suspend(self,node):
+    """Ignore ModifiedEvents of node until resume (attributes untouched).
+    Returns the previous state to pass to resume, like StartModify."""
+    wasSuspended = self.suspended.get(node, False)
+    if node in self.values:
+      self.suspended[node] = True
+    return wasSuspended
+
+  def resume(self,node,wasSuspended=False):
+    if node in self.suspended:
+      self.suspended[node] = wasSuspended
+
+  def onNodeModified(self,caller,event):
+    if self.suspended.get(caller):
+      self.skippedScanCount += 1
+      return
+    values = self.values.get(caller)
+    if not values:
+      return
+    self.scanCount += 1
+    for attribute,oldValue in list(values.items()):
+      newValue = caller.GetAttribute(attribute)
+      if newValue != oldValue:
+        values[attribute] = newValue
+        self.dispatch(caller,attribute,newValue,oldValue)
+
+  def dispatch(self,node,attribute,newValue,oldValue):
+    for manipulator in list(self.subscribers[node].get(attribute, ())):
+      self.dispatchCount += 1
+      manipulator.onWatchedAttributeChanged(node,attribute,newValue,oldValue)
+
+# the registry used by default by all manipulators
+attributeRegistry = AttributeWatchRegistry()
+
+#
+# Work a manipulator coalesces (a slice jump, a two handed update, the
+# end of a history entry) waits for the next pass of the event loop so
+# that all the observers of one pose have fired first.  It is queued
+# here rather than on a timer of its own so SlicerHandsLogic.applyPose
+# can run it at the end of the pose and time it as the 'manipulate'
+# latency stage; the timer then finds nothing left to do.
+#
+
+pendingFlushes = []
+
+def deferFlush(flush):
+  """Call flush on the next event loop pass, or sooner from runFlushes"""
+  if not pendingFlushes:
+    import qt
+    qt.QTimer.singleShot(0, runFlushes)
+  pendingFlushes.append(flush)
+
+def runFlushes():
+  """Call the queued flushes, returning how many there were"""
+  flushes = pendingFlushes[:]
+  del pendingFlushes[:]
+  for flush in flushes:
+    flush()
+  return len(flushes)
+
 
 class Manipulator(object):
   '''A superclass for managing various slicer actions
@@ -8,12 +130,19 @@ class Manipulator(object):
   For now, you can set observations incrementally, 
   but cannot release them except by calling cleanup, which
   removes all.
+  Attribute watches go through a shared AttributeWatchRegistry
+  unless registry is None or the subclass overrides onNodeModified,
+  in which case the manipulator observes the nodes itself.
   '''
 
-  def __init__(self):
+  def __init__(self,registry=attributeRegistry):
     self.observerTags = {}
     self.nodeOldStates = {}
     self.nodeStates = {}
+    onNodeModified = getattr(type(self).onNodeModified, '__func__', type(self).onNodeModified)
+    if onNodeModified is not getattr(Manipulator.onNodeModified, '__func__', Manipulator.onNodeModified):
+      registry = None
+    self.registry = registry
 
   def __del__(self):
     self.cleanup()
@@ -22,6 +151,8 @@ class Manipulator(object):
     """Remove any pending observations"""
     for obj in self.observerTags:
       obj.RemoveObserver(self.observerTags[obj])
+    if self.registry:
+      self.registry.unsubscribe(self)
     self.observerTags = {}
     self.nodeOldStates = {}
     self.nodeStates = {}
@@ -36,10 +167,13 @@ class Manipulator(object):
     for attribute in self.nodeStates[caller]:
       newValue = caller.GetAttribute(attribute)
       if newValue != self.nodeStates[caller][attribute]:
-        oldValue = self.nodeStates[caller][attribute]
-        self.nodeOldStates[caller][attribute] = self.nodeStates[caller][attribute]
-        self.nodeStates[caller][attribute] = newValue
-        self.onAttributeChanged(caller,attribute,newValue,oldValue)
+        self.onWatchedAttributeChanged(caller,attribute,newValue,self.nodeStates[caller][attribute])
+
+  def onWatchedAttributeChanged(self,node,attribute,newValue,oldValue):
+    """Keep track of the old and current value and call the callback"""
+    self.nodeOldStates[node][attribute] = oldValue
+    self.nodeStates[node][attribute] = newValue
+    self.onAttributeChanged(node,attribute,newValue,oldValue)
 
   def observeAttributes(self,observations):
     for node,attributes in observations:
@@ -47,8 +181,10 @@ class Manipulator(object):
       self.nodeStates[node] = {}
       for attribute in attributes:
         self.nodeStates[node][attribute] = node.GetAttribute(attribute)
-      if not node in self.observerTags:
-        self.observerTags[node] = node.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onNodeModified)
+      if self.registry:
+        self.registry.subscribe(self, node, attributes)
+      elif not node in self.observerTags:
+        self.observerTags[node] = node.AddObserver('ModifiedEvent', self.onNodeModified)
 
   def onAttributeChanged(self,node,attribute,newValue,oldValue):
     """Called when an attribute changes - to be overridden by subclass"""
@@ -58,34 +194,110 @@ class Manipulator(object):
 
 class SliceJumper(Manipulator):
   """Jump slices to the location of the hand tansform
-  when there is a pinch gesture"""
+  when there is a pinch gesture.
+  With coalesce set, transform events only record that a jump is
+  wanted and the jump to the latest location happens once when the
+  event loop comes around (so at most once per frame), and is skipped
+  when the location has moved less than minimumJumpVoxels voxels of
+  the background volume of the slice view.  That skip only holds while
+  the slices are where this jumper left them: a new pinch, or slice
+  offsets changed by something else (an undo, setSliceOffset), make
+  the next jump go through."""
 
-  def __init__(self,transform):
+  def __init__(self,transform,coalesce=True,minimumJumpVoxels=0.5,sliceViewName='Red'):
     super(SliceJumper,self).__init__()
     self.transform = transform
+    self.coalesce = coalesce
+    self.minimumJumpVoxels = minimumJumpVoxels
+    self.sliceViewName = sliceViewName
     self.jumping = False
+    self.jumpPending = False
     self.lastJumpLocation = numpy.array( (0,0,0) )
     self.currentJumpLocation = numpy.array( (0,0,0) )
     self.startOfJumpPosition = numpy.array( (0,0,0) )
+    self.jumpedLocation = None
+    self.jumpedOffsets = None
+    self.minimumJumpDistance = 0.
+    self.sliceNode = None
+    self.requestedJumps = 0
+    self.performedJumps = 0
     self.observeAttributes( ((transform, ('SlicerHands.gesture',)),) )
+    import slicer
     event = slicer.vtkMRMLTransformNode.TransformModifiedEvent
     self.observerTags[transform] = transform.AddObserver(event, self.onTransform)
 
   def position(self,transformNode):
-    m = vtk.vtkMatrix4x4()
-    transformNode.GetMatrixTransformToWorld(m)
-    return numpy.array( (m.GetElement(0,3),m.GetElement(1,3),m.GetElement(2,3)) )
+    return handsmrml.worldPosition(transformNode)
+
+  def sliceWidget(self):
+    import slicer
+    return slicer.app.layoutManager().sliceWidget(self.sliceViewName)
+
+  def sliceOffsets(self):
+    """Offsets of the slice views in the layout"""
+    import slicer
+    layoutManager = slicer.app.layoutManager()
+    if not layoutManager:
+      return []
+    return [layoutManager.sliceWidget(name).sliceLogic().GetSliceOffset()
+            for name in layoutManager.sliceViewNames()]
+
+  def jumpSliceNode(self):
+    """The slice node to jump, looked up once and again only
+    if it has been taken out of the scene"""
+    if not self.sliceNode or not self.sliceNode.GetScene():
+      self.sliceNode = self.sliceWidget().mrmlSliceNode()
+    return self.sliceNode
+
+  def updateMinimumJumpDistance(self):
+    """Convert the voxel threshold to mm for the current background volume"""
+    spacing = 1.
+    try:
+      volumeNode = self.sliceWidget().sliceLogic().GetBackgroundLayer().GetVolumeNode()
+      if volumeNode:
+        spacing = min(volumeNode.GetSpacing())
+    except AttributeError:
+      pass
+    self.minimumJumpDistance = self.minimumJumpVoxels * spacing
 
   def onTransform(self,caller,event):
     if self.jumping:
-      lm = slicer.app.layoutManager()
-      redWidget = lm.sliceWidget('Red')
-      redNode = redWidget.mrmlSliceNode()
-      currentPosition = self.position(caller)
-      move = currentPosition - self.startOfJumpPosition
-      self.currentJumpLocation = self.lastJumpLocation + move
-      redNode.JumpSlice(*self.currentJumpLocation)
-      redNode.JumpAllSlices(*self.currentJumpLocation)
+      self.requestedJumps += 1
+      if not self.coalesce:
+        self.jump()
+      elif not self.jumpPending:
+        self.jumpPending = True
+        deferFlush(self.flushJump)
+
+  def flushJump(self):
+    if self.jumpPending:
+      self.jumpPending = False
+      if self.jumping:
+        self.jump()
+
+  def jump(self):
+    """Jump to the current hand location unless it is too close
+    to where the slices already are"""
+    currentPosition = self.position(self.transform)
+    move = currentPosition - self.startOfJumpPosition
+    self.currentJumpLocation = self.lastJumpLocation + move
+    if self.jumpedLocation is not None:
+      distance = numpy.linalg.norm(self.currentJumpLocation - self.jumpedLocation)
+      if distance < self.minimumJumpDistance:
+        if self.sliceOffsets() == self.jumpedOffsets:
+          return
+        # the slices were moved by something else since the last jump
+        self.jumpedLocation = None
+    sliceNode = self.jumpSliceNode()
+    sliceNode.JumpSlice(*self.currentJumpLocation)
+    sliceNode.JumpAllSlices(*self.currentJumpLocation)
+    self.jumpedLocation = self.currentJumpLocation
+    self.jumpedOffsets = self.sliceOffsets()
+    self.performedJumps += 1
+
+  def reslicesSaved(self):
+    """Jumps requested by transform events that did not reslice"""
+    return self.requestedJumps - self.performedJumps
 
   def onAttributeChanged(self,node,attribute,newValue,oldValue):
     if node == self.transform:
@@ -94,7 +306,290 @@ class SliceJumper(Manipulator):
         if newJumpState and not self.jumping:
           # start of a jump action
           self.startOfJumpPosition = self.position(node)
+          self.jumpedLocation = None
+          self.updateMinimumJumpDistance()
         if not newJumpState and self.jumping:
           # end of a jump action
+          self.flushJump()
           self.lastJumpLocation = self.currentJumpLocation
         self.jumping = newJumpState
+
+
+class TwoHandedManipulator(Manipulator):
+  """Grab, turn and scale a target transform with both hands.
+  While both hand transforms carry the pinch gesture the similarity
+  transform from the starting hand positions to the current ones is
+  applied on top of the target's starting matrix (so the target's parent
+  is taken to be in world coordinates).  Hand moves are coalesced so the
+  target is written at most once per event loop pass, and volume
+  rendering is switched to adaptive quality aiming at targetFPS for the
+  length of the gesture.
+  Given the live skeleton (a handprotocol.SKELETON_DTYPE record that is
+  updated in place) the turn of both hands about the line between them
+  is applied too, which hand positions alone cannot show."""
+
+  def __init__(self,leftTransform,rightTransform,target,targetFPS=20.,allowScale=True,skeleton=None):
+    super(TwoHandedManipulator,self).__init__()
+    self.leftTransform = leftTransform
+    self.rightTransform = rightTransform
+    self.target = target
+    self.targetFPS = targetFPS
+    self.allowScale = allowScale
+    self.skeleton = skeleton
+    self.startOrientations = numpy.zeros((2, 4))
+    self.pinched = {leftTransform: False, rightTransform: False}
+    self.grabbing = False
+    self.updatePending = False
+    self.startHands = None
+    self.startTarget = numpy.identity(4)
+    self.savedRenderingSettings = []
+    self.requestedUpdates = 0
+    self.performedUpdates = 0
+    self.observeAttributes( ((leftTransform, ('SlicerHands.gesture',)),
+                             (rightTransform, ('SlicerHands.gesture',))) )
+    import slicer
+    event = slicer.vtkMRMLTransformNode.TransformModifiedEvent
+    for transform in (leftTransform, rightTransform):
+      self.observerTags[transform] = transform.AddObserver(event, self.onHandMoved)
+
+  def position(self,transformNode):
+    return handsmrml.worldPosition(transformNode)
+
+  def targetMatrix(self):
+    return handsmrml.transformMatrix(self.target)
+
+  def onAttributeChanged(self,node,attribute,newValue,oldValue):
+    if node in self.pinched and attribute == 'SlicerHands.gesture':
+      self.pinched[node] = newValue == 'pinch'
+      grabbing = all(self.pinched.values())
+      if grabbing and not self.grabbing:
+        self.startHands = (self.position(self.leftTransform), self.position(self.rightTransform))
+        self.startTarget = self.targetMatrix()
+        if self.skeleton is not None:
+          self.startOrientations[:] = self.skeleton['hands'][:, 3:7]
+        self.lowerRenderingQuality()
+      if not grabbing and self.grabbing:
+        self.flushUpdate()
+        self.restoreRenderingQuality()
+      self.grabbing = grabbing
+
+  def onHandMoved(self,caller,event):
+    if self.grabbing:
+      self.requestedUpdates += 1
+      if not self.updatePending:
+        self.updatePending = True
+        deferFlush(self.flushUpdate)
+
+  def flushUpdate(self):
+    if self.updatePending:
+      self.updatePending = False
+      if self.grabbing:
+        self.update()
+
+  def update(self):
+    """Write the target matrix for the current hand positions"""
+    left0,right0 = self.startHands
+    delta = similarityFromHandPairs(left0, right0,
+        self.position(self.leftTransform), self.position(self.rightTransform), self.allowScale, self.roll())
+    handsmrml.setTransformMatrix(self.target, numpy.dot(delta, self.startTarget))
+    self.performedUpdates += 1
+
+  def roll(self):
+    """Mean turn (radians) of the two hands about the line between
+    them since the grab started, read from the skeleton"""
+    if self.skeleton is None:
+      return 0.
+    hands = self.skeleton['hands']
+    axis = hands[1, 0:3] - hands[0, 0:3]
+    if numpy.linalg.norm(axis) < 1e-6:
+      return 0.
+    angle = 0.
+    for hand in (0, 1):
+      turn = quaternionMultiply(normalizedQuaternion(hands[hand, 3:7]),
+                                quaternionConjugate(normalizedQuaternion(self.startOrientations[hand])))
+      angle += twistAngle(turn, axis)
+    return angle / 2.
+
+  def lowerRenderingQuality(self):
+    """Switch volume rendering to adaptive quality for the gesture,
+    remembering the settings so they can be put back"""
+    import slicer
+    self.savedRenderingSettings = []
+    for viewNode in slicer.util.getNodes('vtkMRMLViewNode*').values():
+      if hasattr(viewNode, 'SetVolumeRenderingQuality'):
+        self.savedRenderingSettings.append((viewNode, viewNode.GetVolumeRenderingQuality(), viewNode.GetExpectedFPS()))
+        viewNode.SetExpectedFPS(self.targetFPS)
+        viewNode.SetVolumeRenderingQuality(viewNode.Adaptive)
+    for displayNode in slicer.util.getNodes('vtkMRMLVolumeRenderingDisplayNode*').values():
+      # older Slicer keeps the setting on the display node
+      if hasattr(displayNode, 'SetPerformanceControl'):
+        self.savedRenderingSettings.append((displayNode, displayNode.GetPerformanceControl(), displayNode.GetExpectedFPS()))
+        displayNode.SetExpectedFPS(self.targetFPS)
+        displayNode.SetPerformanceControl(0)
+
+  def restoreRenderingQuality(self):
+    for node,quality,expectedFPS in self.savedRenderingSettings:
+      node.SetExpectedFPS(expectedFPS)
+      if hasattr(node, 'SetVolumeRenderingQuality'):
+        node.SetVolumeRenderingQuality(quality)
+      else:
+        node.SetPerformanceControl(quality)
+    self.savedRenderingSettings = []
+
+  def cleanup(self):
+    if self.savedRenderingSettings:
+      self.restoreRenderingQuality()
+    super(TwoHandedManipulator,self).cleanup()
+
+
+class HistoryRecorder(Manipulator):
+  """Record what the hands change in each gesture in a
+  handscore.handhistory.ManipulationHistory, and undo and redo it.
+  A gesture runs from the first hand pinching to the last one letting
+  go; the slice offsets of the slice views and the matrices of the
+  linear transforms other than the excluded ones (the module's own
+  hand, table and camera transforms) are compared at both ends.  The
+  end is read on the next event loop pass so the coalesced updates of
+  the other manipulators have been written.
+  While no hand pinches, the recognized gesture undoGesture undoes the
+  last entry and redoGesture redoes it (None turns a binding off)."""
+
+  def __init__(self,handTransforms,exclude=(),capacity=64,maxValues=256,
+               undoGesture='swipe-left',redoGesture='swipe-right'):
+    super(HistoryRecorder,self).__init__()
+    self.handTransforms = list(handTransforms)
+    self.excludedIDs = set([node.GetID() for node in list(exclude) + self.handTransforms])
+    self.history = handhistory.ManipulationHistory(capacity, maxValues)
+    self.undoGesture = undoGesture
+    self.redoGesture = redoGesture
+    self.pinched = dict([(transform, False) for transform in self.handTransforms])
+    self.recording = False
+    self.endPending = False
+    self.observeAttributes([(transform, ('SlicerHands.gesture', 'SlicerHands.recognized'))
+                            for transform in self.handTransforms])
+
+  def sliceLogics(self):
+    """(view name, slice logic) of the slice views in the layout"""
+    import slicer
+    layoutManager = slicer.app.layoutManager()
+    return [(name, layoutManager.sliceWidget(name).sliceLogic()) for name in layoutManager.sliceViewNames()]
+
+  def states(self):
+    """(key, values) of everything a gesture may change"""
+    import slicer
+    states = []
+    for name,sliceLogic in self.sliceLogics():
+      states.append((('offset', name), (sliceLogic.GetSliceOffset(),)))
+    nodes = slicer.mrmlScene.GetNodesByClass('vtkMRMLLinearTransformNode')
+    for index in range(nodes.GetNumberOfItems()):
+      node = nodes.GetItemAsObject(index)
+      if node.GetID() not in self.excludedIDs:
+        states.append((('matrix', node.GetID()), handsmrml.transformMatrix(node)))
+    return states
+
+  def applyState(self,key,values):
+    import slicer
+    kind,name = key
+    if kind == 'offset':
+      sliceWidget = slicer.app.layoutManager().sliceWidget(name)
+      if sliceWidget:
+        sliceWidget.sliceLogic().SetSliceOffset(values[0])
+    else:
+      node = slicer.mrmlScene.GetNodeByID(name)
+      if node:
+        handsmrml.setTransformMatrix(node, values.reshape(4, 4))
+
+  def onAttributeChanged(self,node,attribute,newValue,oldValue):
+    if node not in self.pinched:
+      return
+    if attribute == 'SlicerHands.gesture':
+      self.pinched[node] = newValue == 'pinch'
+      pinching = any(self.pinched.values())
+      if pinching and not self.recording:
+        # a quick pinch can come before the last release was read
+        self.flushEnd()
+        self.history.begin(self.states())
+      if not pinching and self.recording and not self.endPending:
+        self.endPending = True
+        deferFlush(self.flushEnd)
+      self.recording = pinching
+    elif attribute == 'SlicerHands.recognized' and not any(self.pinched.values()):
+      if newValue and newValue == self.undoGesture:
+        self.undo()
+      elif newValue and newValue == self.redoGesture:
+        self.redo()
+
+  def flushEnd(self):
+    if self.endPending:
+      self.endPending = False
+      self.history.end(self.states())
+
+  def undo(self):
+    self.flushEnd()
+    return self.history.undo(self.applyState)
+
+  def redo(self):
+    self.flushEnd()
+    return self.history.redo(self.applyState)
+
+  def statistics(self):
+    return self.history.statistics()
+
+
+def grabTransformFor(node,name='SlicerHands-Grab'):
+  """Return the transform a volume or model moves with, creating one
+  under the scene root if it is not transformed yet"""
+  import slicer
+  transformNode = node.GetParentTransformNode()
+  if not transformNode:
+    transformNode = slicer.vtkMRMLLinearTransformNode()
+    transformNode.SetName(name)
+    slicer.mrmlScene.AddNode(transformNode)
+    node.SetAndObserveTransformNodeID(transformNode.GetID())
+  return transformNode
+
+
+def benchmarkDispatch(manipulatorCounts=(1,10,100),nodeCounts=(1,10,100),frames=100):
+  """Time per-frame transform updates plus a gesture change on every
+  node, with N manipulators watching M nodes, through the shared
+  registry and through the original per-manipulator observers"""
+  import slicer
+  class CountingManipulator(Manipulator):
+    def onAttributeChanged(self,node,attribute,newValue,oldValue):
+      self.changes += 1
+  results = []
+  for manipulatorCount in manipulatorCounts:
+    for nodeCount in nodeCounts:
+      for mode in ('registry', 'legacy'):
+        registry = AttributeWatchRegistry() if mode == 'registry' else None
+        nodes = [slicer.vtkMRMLLinearTransformNode() for i in range(nodeCount)]
+        manipulators = []
+        for i in range(manipulatorCount):
+          m = CountingManipulator(registry)
+          m.changes = 0
+          m.observeAttributes([(node, ('SlicerHands.gesture',)) for node in nodes])
+          manipulators.append(m)
+        start = time.time()
+        for frame in range(frames):
+          for node in nodes:
+            wasSuspended = registry.suspend(node) if registry else False
+            wasModifying = node.StartModify()
+            node.GetMatrixTransformToParent().SetElement(0, 3, frame)
+            node.EndModify(wasModifying)
+            if registry:
+              registry.resume(node, wasSuspended)
+          if frame % 10 == 0:
+            for node in nodes:
+              node.SetAttribute('SlicerHands.gesture', 'pinch' if frame % 20 == 0 else None)
+        elapsed = time.time() - start
+        for m in manipulators:
+          m.cleanup()
+        results.append({
+            'mode': mode,
+            'manipulators': manipulatorCount,
+            'nodes': nodeCount,
+            'frames': frames,
+            'secondsPerFrame': elapsed / frames,
+            'changes': sum([m.changes for m in manipulators]),
+            })
+  return results
@@ -0,0 +1,259 @@
+import time
+
+import numpy
+
+#
+# Picking scene models with the hands' pointing rays
+#
+# Each model gets a vtkModifiedBSPTree (a bounding box hierarchy over its
+# cells) that is kept between queries and rebuilt only when the
+# polydata, or its modification time, changes.  A query first clips the
+# ray against the world bounding boxes of all models at once in NumPy,
+# then walks the candidates nearest first through their trees, in each
+# model's own coordinates, and stops as soon as the nearest hit so far
+# is closer than the next box.
+#
+# ConfidenceGate adds hysteresis to the driver's pointing confidence so
+# a ray that hovers around the threshold does not flicker.
+#
+# vtk is imported on first use, as in handsmrml.
+#
+
+class ConfidenceGate(object):
+  """Pointing turns on at confidence >= on and off below off"""
+
+  def __init__(self,on=0.8,off=0.6):
+    self.on = on
+    self.off = off
+    self.active = False
+
+  def update(self,confidence):
+    self.active = confidence >= (self.off if self.active else self.on)
+    return self.active
+
+
+def rayBoxDistances(origin,direction,boxes,length):
+  """Distance along a unit ray at which it enters each of the (N,6)
+  VTK-style bounds (xmin,xmax,ymin,ymax,zmin,zmax), or inf if it misses
+  the box within length"""
+  lower = boxes[:, 0::2]
+  upper = boxes[:, 1::2]
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    inverse = 1. / direction
+    t0 = (lower - origin) * inverse
+    t1 = (upper - origin) * inverse
+  parallel = direction == 0.
+  if parallel.any():
+    # no limit along an axis the ray runs parallel to, if it is between
+    # the planes, otherwise a miss
+    outside = ((origin < lower) | (origin > upper)) & parallel
+    t0[:, parallel] = -numpy.inf
+    t1[:, parallel] = numpy.inf
+    t0[outside] = numpy.inf
+  near = numpy.minimum(t0, t1).max(axis=1)
+  far = numpy.maximum(t0, t1).min(axis=1)
+  near = numpy.maximum(near, 0.)
+  near[(near > far) | (near > length)] = numpy.inf
+  return near
+
+
+def worldBounds(bounds,matrix):
+  """Axis aligned bounds of local bounds moved by a 4x4 matrix"""
+  corners = numpy.array([(x, y, z) for x in bounds[0:2] for y in bounds[2:4] for z in bounds[4:6]])
+  corners = numpy.dot(corners, matrix[:3, :3].T) + matrix[:3, 3]
+  out = numpy.empty(6)
+  out[0::2] = corners.min(axis=0)
+  out[1::2] = corners.max(axis=0)
+  return out
+
+
+class PickEntry(object):
+  """The cached tree of one model and where it sits in the world"""
+
+  def __init__(self):
+    import vtk
+    self.polyData = None
+    self.modifiedTime = None
+    self.tree = vtk.vtkModifiedBSPTree()
+    self.localBounds = numpy.zeros(6)
+    self.matrix = numpy.identity(4)
+    self.inverse = numpy.identity(4)
+    self.buildSeconds = 0.
+
+  def update(self,polyData):
+    """Rebuild the tree if the polydata changed; returns True if it did"""
+    modifiedTime = polyData.GetMTime()
+    if polyData is self.polyData and modifiedTime == self.modifiedTime:
+      return False
+    start = time.time()
+    self.polyData = polyData
+    self.modifiedTime = modifiedTime
+    self.tree.SetDataSet(polyData)
+    self.tree.Modified()
+    self.tree.BuildLocator()
+    self.localBounds[:] = polyData.GetBounds()
+    self.buildSeconds = time.time() - start
+    return True
+
+  def place(self,matrix):
+    """Move the model to world matrix; returns its world bounds"""
+    self.matrix[:] = matrix
+    self.inverse[:] = numpy.linalg.inv(matrix)
+    return worldBounds(self.localBounds, matrix)
+
+
+class ModelPicker(object):
+  """Nearest model hit by a ray, over a changing set of models.
+  Targets are (key, polyData, worldMatrix) with worldMatrix None for
+  models that are not transformed; keys name the cache entries, so use
+  something stable like the model node ID."""
+
+  def __init__(self,length=5000.,tolerance=0.):
+    import vtk
+    self.length = length
+    self.tolerance = tolerance
+    self.entries = {}
+    # the entries, world matrices and world bounds of the last targets
+    self.keys = []
+    self.matrices = numpy.zeros((0, 4, 4))
+    self.bounds = numpy.zeros((0, 6))
+    self.points = vtk.vtkPoints()
+    self.cellIds = vtk.vtkIdList()
+    self.queryCount = 0
+    self.hitCount = 0
+    self.treeQueryCount = 0
+    self.buildCount = 0
+    self.buildSeconds = 0.
+    self.querySeconds = 0.
+
+  def refresh(self,targets):
+    """Bring the cache up to date with targets; returns their entries
+    and their world bounds as an (N,6) array"""
+    keys = []
+    entries = []
+    matrices = []
+    rebuilt = []
+    identity = numpy.identity(4)
+    for key,polyData,matrix in targets:
+      entry = self.entries.get(key)
+      if entry is None:
+        entry = self.entries[key] = PickEntry()
+      if entry.update(polyData):
+        self.buildCount += 1
+        self.buildSeconds += entry.buildSeconds
+        rebuilt.append(len(entries))
+      keys.append(key)
+      entries.append(entry)
+      matrices.append(identity if matrix is None else matrix)
+    matrices = numpy.array(matrices).reshape(-1, 4, 4)
+    if keys == self.keys:
+      # the matrices are compared all at once, which is most of the work
+      # when nothing moved
+      moved = (matrices != self.matrices).any(axis=(1, 2))
+      moved[rebuilt] = True
+    else:
+      moved = numpy.ones(len(keys), dtype=bool)
+      self.bounds = numpy.empty((len(keys), 6))
+      if len(self.entries) > len(keys):
+        # forget the models that are gone
+        live = set(keys)
+        for key in list(self.entries.keys()):
+          if key not in live:
+            del self.entries[key]
+    for index in numpy.flatnonzero(moved):
+      self.bounds[index] = entries[index].place(matrices[index])
+    self.keys = keys
+    self.matrices = matrices
+    return list(zip(keys, entries)),self.bounds
+
+  def pick(self,origin,direction,targets):
+    """Return (key, point, distance) of the nearest hit along the ray,
+    or None.  origin and direction are in world coordinates."""
+    start = time.time()
+    self.queryCount += 1
+    origin = numpy.asarray(origin, dtype=float)
+    direction = numpy.asarray(direction, dtype=float)
+    direction = direction / numpy.linalg.norm(direction)
+    entries,bounds = self.refresh(targets)
+    best = None
+    if entries:
+      distances = rayBoxDistances(origin, direction, bounds, self.length)
+      for index in numpy.argsort(distances):
+        if distances[index] == numpy.inf or (best and distances[index] > best[2]):
+          break
+        key,entry = entries[index]
+        hit = self.intersect(entry, origin, direction)
+        if hit is not None and (best is None or hit[1] < best[2]):
+          best = (key, hit[0], hit[1])
+    if best:
+      self.hitCount += 1
+    self.querySeconds += time.time() - start
+    return best
+
+  def intersect(self,entry,origin,direction):
+    """Nearest (point, distance) where the ray meets one model"""
+    end = origin + self.length * direction
+    localOrigin = numpy.dot(entry.inverse[:3, :3], origin) + entry.inverse[:3, 3]
+    localEnd = numpy.dot(entry.inverse[:3, :3], end) + entry.inverse[:3, 3]
+    self.treeQueryCount += 1
+    self.points.Reset()
+    self.cellIds.Reset()
+    entry.tree.IntersectWithLine(localOrigin.tolist(), localEnd.tolist(), self.tolerance, self.points, self.cellIds)
+    count = self.points.GetNumberOfPoints()
+    if not count:
+      return None
+    hits = numpy.array([self.points.GetPoint(index) for index in range(count)])
+    hits = numpy.dot(hits, entry.matrix[:3, :3].T) + entry.matrix[:3, 3]
+    distances = numpy.dot(hits - origin, direction)
+    nearest = distances.argmin()
+    return hits[nearest],distances[nearest]
+
+  def statistics(self):
+    return {
+        'models': len(self.entries),
+        'queries': self.queryCount,
+        'hits': self.hitCount,
+        'treeQueries': self.treeQueryCount,
+        'builds': self.buildCount,
+        'buildSeconds': self.buildSeconds,
+        'secondsPerQuery': self.querySeconds / self.queryCount if self.queryCount else 0.,
+        }
+
+
+def benchmarkPicking(modelCounts=(1,10,100),resolutions=(16,64,256),queries=200):
+  """Build and query seconds for grids of sphere models; a sphere of
+  resolution r has about 2 r^2 triangles.  Plain polydata, no scene."""
+  import vtk
+  results = []
+  for resolution in resolutions:
+    source = vtk.vtkSphereSource()
+    source.SetRadius(20.)
+    source.SetThetaResolution(resolution)
+    source.SetPhiResolution(resolution)
+    source.Update()
+    for modelCount in modelCounts:
+      side = int(numpy.ceil(numpy.sqrt(modelCount)))
+      targets = []
+      for index in range(modelCount):
+        polyData = vtk.vtkPolyData()
+        polyData.DeepCopy(source.GetOutput())
+        matrix = numpy.identity(4)
+        matrix[0:2, 3] = 50. * (index % side), 50. * (index // side)
+        targets.append((index, polyData, matrix))
+      picker = ModelPicker()
+      start = time.time()
+      picker.refresh(targets)
+      buildSeconds = time.time() - start
+      random = numpy.random.RandomState(resolution + modelCount)
+      aims = random.uniform(-25., 50. * side - 25., (queries, 2))
+      start = time.time()
+      for x,y in aims:
+        picker.pick((x, y, 500.), (0., 0., -1.), targets)
+      results.append({
+          'models': modelCount,
+          'trianglesPerModel': source.GetOutput().GetNumberOfCells(),
+          'buildSeconds': buildSeconds,
+          'secondsPerQuery': (time.time() - start) / queries,
+          'hitFraction': float(picker.hitCount) / queries,
+          })
+  return results